@@ -3,6 +3,7 @@ Database connection and models for multi-tenant SaaS platform.
 Uses Neon PostgreSQL.
 """
 
+import json
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
@@ -196,6 +197,19 @@ def get_user_by_id(user_id: int) -> Optional[dict]:
 
 # ==================== BOT OPERATIONS ====================
 
+# Bot runners start, stop or reconfigure the bot sent on this channel
+BOT_EVENTS_CHANNEL = "bot_events"
+
+
+def _notify_bot_event(cursor, bot_id: int, event: str):
+    """Queue a bot change event; PostgreSQL delivers it on commit."""
+    # Only the ID travels: any session can LISTEN, so no credentials in payloads
+    cursor.execute(
+        "SELECT pg_notify(%s, %s)",
+        (BOT_EVENTS_CHANNEL, json.dumps({"bot_id": bot_id, "event": event}))
+    )
+
+
 def create_bot(user_id: int, telegram_token: str, bot_username: str = None, bot_name: str = None) -> Optional[dict]:
     """Create a new bot."""
     with get_cursor() as cursor:
@@ -204,7 +218,9 @@ def create_bot(user_id: int, telegram_token: str, bot_username: str = None, bot_
             VALUES (%s, %s, %s, %s)
             RETURNING id, user_id, telegram_token, bot_username, bot_name, is_active, created_at
         """, (user_id, telegram_token, bot_username, bot_name))
-        return dict(cursor.fetchone())
+        bot = dict(cursor.fetchone())
+        _notify_bot_event(cursor, bot['id'], "created")
+        return bot
 
 
 def get_bots_by_user(user_id: int) -> list[dict]:
@@ -214,6 +230,7 @@ def get_bots_by_user(user_id: int) -> list[dict]:
             SELECT b.*, 
                    (SELECT COUNT(*) FROM products WHERE bot_id = b.id) as products_count,
                    (SELECT COUNT(*) FROM bot_users WHERE bot_id = b.id) as users_count,
+                   (SELECT COUNT(*) FROM bot_users WHERE bot_id = b.id AND is_blocked = false) as reachable_users_count,
                    (SELECT COUNT(*) FROM orders WHERE bot_id = b.id AND status = 'completed') as transactions_count
             FROM bots b
             WHERE user_id = %s
@@ -254,6 +271,8 @@ def update_bot(bot_id: int, **kwargs) -> Optional[dict]:
             RETURNING *
         """, values)
         row = cursor.fetchone()
+        if row:
+            _notify_bot_event(cursor, bot_id, "updated")
         return dict(row) if row else None
 
 
@@ -261,11 +280,25 @@ def delete_bot(bot_id: int) -> bool:
     """Delete a bot."""
     with get_cursor() as cursor:
         cursor.execute("DELETE FROM bots WHERE id = %s", (bot_id,))
-        return cursor.rowcount > 0
+        deleted = cursor.rowcount > 0
+        if deleted:
+            _notify_bot_event(cursor, bot_id, "deleted")
+        return deleted
 
 
 # ==================== PRODUCT OPERATIONS ====================
 
+# Bot runners drop their cached catalog for the bot ID sent on this channel
+CATALOG_CHANNEL = "catalog_invalidate"
+
+
+def _notify_catalog_changed(cursor, product_id: int):
+    """Queue a catalog invalidation; PostgreSQL delivers it on commit."""
+    cursor.execute("""
+        SELECT pg_notify(%s, bot_id::text) FROM products WHERE id = %s
+    """, (CATALOG_CHANNEL, product_id))
+
+
 def create_product(bot_id: int, name: str, price: int, category_id: int = None, description: str = None) -> Optional[dict]:
     """Create a new product."""
     with get_cursor() as cursor:
@@ -274,7 +307,9 @@ def create_product(bot_id: int, name: str, price: int, category_id: int = None,
             VALUES (%s, %s, %s, %s, %s)
             RETURNING *
         """, (bot_id, category_id, name, price, description))
-        return dict(cursor.fetchone())
+        product = dict(cursor.fetchone())
+        _notify_catalog_changed(cursor, product['id'])
+        return product
 
 
 def get_products_by_bot(bot_id: int) -> list[dict]:
@@ -283,8 +318,9 @@ def get_products_by_bot(bot_id: int) -> list[dict]:
         cursor.execute("""
             SELECT p.*, 
                    c.name as category_name,
-                   (SELECT COUNT(*) FROM product_stock WHERE product_id = p.id AND is_sold = false) as stock,
-                   (SELECT COUNT(*) FROM product_stock WHERE product_id = p.id AND is_sold = true) as sold
+                   p.available_stock as stock,
+                   p.reserved_stock as reserved,
+                   p.sold_count as sold
             FROM products p
             LEFT JOIN categories c ON p.category_id = c.id
             WHERE p.bot_id = %s
@@ -293,15 +329,121 @@ def get_products_by_bot(bot_id: int) -> list[dict]:
         return [dict(row) for row in cursor.fetchall()]
 
 
+def get_product_by_id(product_id: int, user_id: int) -> Optional[dict]:
+    """Get a product owned by the user."""
+    with get_cursor() as cursor:
+        cursor.execute("""
+            SELECT p.* FROM products p
+            JOIN bots b ON b.id = p.bot_id
+            WHERE p.id = %s AND b.user_id = %s
+        """, (product_id, user_id))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+# Advisory lock class for stock imports, keyed by product ID, so two
+# uploads into one product cannot both add the same item
+STOCK_IMPORT_LOCK = 5704
+
+
+def _copy_escape(content: str) -> str:
+    """Escape a value for COPY text format."""
+    return (content.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+class _StockCopySource:
+    """
+    File-like COPY source that encodes stock lines as they are read.
+
+    Only one read buffer is held, so an import of any size stays
+    constant-memory. Blank lines are skipped. A COPY ends once `stop_at`
+    lines have been read; the next COPY continues where it stopped.
+    """
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = bytearray()
+        self.count = 0
+        self.stop_at = None
+        self.exhausted = False
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            if self.stop_at is not None and self.count >= self.stop_at:
+                break
+            line = next(self._lines, None)
+            if line is None:
+                self.exhausted = True
+                break
+            if isinstance(line, bytes):
+                line = line.decode("utf-8", errors="replace")
+            content = line.strip()
+            if not content:
+                continue
+            self.count += 1
+            self._buffer += f"{self.count}\t{_copy_escape(content)}\n".encode()
+
+        if size < 0 or size >= len(self._buffer):
+            chunk, self._buffer = bytes(self._buffer), bytearray()
+        else:
+            chunk = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return chunk
+
+
+def iter_import_product_stock(product_id: int, lines, batch_size: int = 10000):
+    """
+    Bulk-add stock from an iterable of lines (str or bytes), step by step.
+
+    Lines are streamed into a temp table with COPY FROM STDIN, `batch_size`
+    lines per COPY, yielding {"progress": n} after each; then they are
+    added in one INSERT that drops duplicates within the upload and items
+    the product already has (matched on md5(content)). The last item,
+    yielded after the commit, is {"received", "added", "duplicates"}.
+    Nothing is added if the generator is closed before that.
+    """
+    with get_cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", (STOCK_IMPORT_LOCK, product_id))
+        cursor.execute("CREATE TEMP TABLE stock_import (line BIGINT, content TEXT) ON COMMIT DROP")
+        source = _StockCopySource(lines)
+        while not source.exhausted:
+            source.stop_at = source.count + batch_size
+            cursor.copy_expert("COPY stock_import (line, content) FROM STDIN", source)
+            yield {"progress": source.count}
+        cursor.execute("""
+            INSERT INTO product_stock (product_id, content)
+            SELECT %(product_id)s, s.content FROM (
+                SELECT DISTINCT ON (md5(content)) line, content
+                FROM stock_import
+                ORDER BY md5(content), line
+            ) s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM product_stock ps
+                WHERE ps.product_id = %(product_id)s AND md5(ps.content) = md5(s.content)
+            )
+            ORDER BY s.line
+        """, {"product_id": product_id})
+        added = cursor.rowcount
+        if added:
+            _notify_catalog_changed(cursor, product_id)
+    yield {"received": source.count, "added": added, "duplicates": source.count - added}
+
+
+def import_product_stock(product_id: int, lines) -> dict:
+    """
+    Bulk-add stock from an iterable of lines (str or bytes).
+
+    Returns {"received", "added", "duplicates"}; see iter_import_product_stock.
+    """
+    for event in iter_import_product_stock(product_id, lines):
+        if "progress" not in event:
+            return event
+
+
 def add_product_stock(product_id: int, contents: list[str]) -> int:
     """Add stock items to a product. Returns count of items added."""
-    with get_cursor() as cursor:
-        for content in contents:
-            cursor.execute("""
-                INSERT INTO product_stock (product_id, content)
-                VALUES (%s, %s)
-            """, (product_id, content.strip()))
-        return len(contents)
+    return import_product_stock(product_id, contents)["added"]
 
 
 # ==================== TRANSACTION OPERATIONS ====================
@@ -313,7 +455,8 @@ def get_transactions_by_bot(bot_id: int, limit: int = 50) -> list[dict]:
             SELECT o.*, 
                    p.name as product_name,
                    bu.username as buyer_username,
-                   bu.first_name as buyer_name
+                   bu.first_name as buyer_name,
+                   (SELECT COALESCE(SUM(oi.quantity), 1) FROM order_items oi WHERE oi.order_id = o.id) as quantity
             FROM orders o
             LEFT JOIN products p ON o.product_id = p.id
             LEFT JOIN bot_users bu ON o.bot_user_id = bu.id
@@ -331,23 +474,40 @@ def get_bot_stats(bot_id: int) -> dict:
             SELECT 
                 (SELECT COUNT(*) FROM products WHERE bot_id = %s) as total_products,
                 (SELECT COUNT(*) FROM bot_users WHERE bot_id = %s) as total_users,
+                (SELECT COUNT(*) FROM bot_users WHERE bot_id = %s AND is_blocked = false) as reachable_users,
                 (SELECT COUNT(*) FROM orders WHERE bot_id = %s AND status = 'completed') as total_transactions,
                 (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE bot_id = %s AND status = 'completed') as total_revenue
-        """, (bot_id, bot_id, bot_id, bot_id))
+        """, (bot_id, bot_id, bot_id, bot_id, bot_id))
         return dict(cursor.fetchone())
 
 
 # ==================== BROADCAST OPERATIONS ====================
 
+# Bot runners lease and send broadcasts announced on this channel
+BROADCAST_JOBS_CHANNEL = "broadcast_jobs"
+
+
 def create_broadcast(bot_id: int, message: str) -> Optional[dict]:
-    """Create a broadcast record."""
+    """Queue a broadcast job; the bot's runner picks it up on commit."""
     with get_cursor() as cursor:
         cursor.execute("""
             INSERT INTO broadcasts (bot_id, message)
             VALUES (%s, %s)
             RETURNING *
         """, (bot_id, message))
-        return dict(cursor.fetchone())
+        broadcast = dict(cursor.fetchone())
+        cursor.execute("SELECT pg_notify(%s, %s)", (BROADCAST_JOBS_CHANNEL, str(bot_id)))
+        return broadcast
+
+
+def get_broadcast(broadcast_id: int, bot_id: int) -> Optional[dict]:
+    """Get a broadcast of a bot."""
+    with get_cursor() as cursor:
+        cursor.execute("""
+            SELECT * FROM broadcasts WHERE id = %s AND bot_id = %s
+        """, (broadcast_id, bot_id))
+        row = cursor.fetchone()
+        return dict(row) if row else None
 
 
 def get_broadcasts_by_bot(bot_id: int, limit: int = 20) -> list[dict]:
@@ -362,15 +522,14 @@ def get_broadcasts_by_bot(bot_id: int, limit: int = 20) -> list[dict]:
         return [dict(row) for row in cursor.fetchall()]
 
 
-def get_bot_users_for_broadcast(bot_id: int) -> list[dict]:
-    """Get all non-blocked users for broadcast."""
+def count_broadcast_audience(bot_id: int) -> int:
+    """Number of non-blocked users a broadcast would reach."""
     with get_cursor() as cursor:
         cursor.execute("""
-            SELECT telegram_id, username, first_name
-            FROM bot_users
+            SELECT COUNT(*) AS count FROM bot_users
             WHERE bot_id = %s AND is_blocked = false
         """, (bot_id,))
-        return [dict(row) for row in cursor.fetchall()]
+        return cursor.fetchone()['count']
 
 
 if __name__ == "__main__":
@@ -44,6 +44,7 @@ def list_bots():
             'is_active': bot['is_active'],
             'products_count': bot['products_count'],
             'users_count': bot['users_count'],
+            'reachable_users_count': bot['reachable_users_count'],
             'transactions_count': bot['transactions_count'],
             'created_at': bot['created_at'].isoformat() if bot['created_at'] else None,
         } for bot in bots]
@@ -2,12 +2,15 @@
 Product management routes.
 """
 
-from flask import Blueprint, request, jsonify
+import json
+
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from database import (
     get_bot_by_id, create_product, get_products_by_bot,
-    add_product_stock
+    add_product_stock, get_product_by_id, import_product_stock,
+    iter_import_product_stock
 )
 
 products_bp = Blueprint('products', __name__, url_prefix='/api')
@@ -34,6 +37,7 @@ def list_products(bot_id: int):
             'price': p['price'],
             'category_name': p['category_name'],
             'stock': p['stock'],
+            'reserved': p['reserved'],
             'sold': p['sold'],
             'is_active': p['is_active'],
             'created_at': p['created_at'].isoformat() if p['created_at'] else None,
@@ -100,13 +104,65 @@ def add_stock(product_id: int):
     if not stock_items:
         return jsonify({'error': 'Stock items wajib diisi'}), 400
     
-    # TODO: Verify product ownership through bot
+    # Verify product ownership through bot
+    if not get_product_by_id(product_id, user_id):
+        return jsonify({'error': 'Produk tidak ditemukan'}), 404
     
     try:
-        count = add_product_stock(product_id, stock_items)
+        result = import_product_stock(product_id, stock_items)
         return jsonify({
-            'message': f'{count} item berhasil ditambahkan',
-            'added_count': count
+            'message': f"{result['added']} item berhasil ditambahkan",
+            'added_count': result['added'],
+            'duplicate_count': result['duplicates'],
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+
+def _ndjson_stock_lines(source):
+    """Stock contents from NDJSON lines of strings or {"content": ...} objects."""
+    for raw in source:
+        raw = raw.strip()
+        if not raw:
+            continue
+        item = json.loads(raw)
+        yield str(item.get('content', '')) if isinstance(item, dict) else str(item)
+
+
+@products_bp.route('/products/<int:product_id>/stock/import', methods=['POST'])
+@jwt_required()
+def import_stock(product_id: int):
+    """
+    Bulk-import stock from a streamed upload.
+    
+    Takes the file as the raw request body, either one item per line
+    (text/plain) or NDJSON (application/x-ndjson). The body is read line
+    by line straight into COPY while the response streams, so its size
+    does not matter. Responds with NDJSON: {"progress": n} while
+    importing, then a final line with "done", "received", "added" and
+    "duplicates", or "error". Nothing is added if the upload breaks off.
+    """
+    user_id = int(get_jwt_identity())
+    
+    # Verify product ownership through bot
+    if not get_product_by_id(product_id, user_id):
+        return jsonify({'error': 'Produk tidak ditemukan'}), 404
+    
+    # Multipart forms are parsed and spooled whole before they can be read
+    if request.mimetype == 'multipart/form-data':
+        return jsonify({'error': 'Kirim file sebagai body (text/plain atau application/x-ndjson)'}), 415
+    
+    ndjson = request.mimetype == 'application/x-ndjson'
+    
+    def generate():
+        # Runs inside the request context, so the body is read as the import goes
+        lines = _ndjson_stock_lines(request.stream) if ndjson else request.stream
+        try:
+            for event in iter_import_product_stock(product_id, lines):
+                if 'progress' not in event:
+                    event = {'done': True, **event}
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({'error': str(e)}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
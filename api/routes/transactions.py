@@ -32,6 +32,7 @@ def list_transactions(bot_id: int):
             'id': t['id'],
             'order_id': t['order_id'],
             'product_name': t['product_name'],
+            'quantity': t['quantity'],
             'buyer_username': t['buyer_username'] or t['buyer_name'] or 'Unknown',
             'amount': t['amount'],
             'status': t['status'],
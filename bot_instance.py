@@ -4,10 +4,18 @@ Wraps a single Telegram bot with its configuration and handlers.
 """
 
 import logging
-from telegram.ext import Application
+import os
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+from database_pg import current_bot_id
+from utils.rate_limiter import TelegramRateLimiter
 
 logger = logging.getLogger(__name__)
 
+# Alternative Bot API endpoint (local Bot API server or a test fake)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
 
 class BotInstance:
     """Represents a single bot instance with its configuration."""
@@ -32,9 +40,16 @@ class BotInstance:
         self.bot_name = bot_config.get('bot_name', 'Unnamed Bot')
         self.pakasir_slug = bot_config.get('pakasir_slug')
         self.pakasir_api_key = bot_config.get('pakasir_api_key')
+        self.telegram_token = bot_config['telegram_token']
+        self.update_mode = None
+        self._webhook_server = None
         
-        # Build application
-        self.app = Application.builder().token(bot_config['telegram_token']).build()
+        # Build application; every request of this bot goes through its limiter
+        self.rate_limiter = TelegramRateLimiter()
+        builder = Application.builder().token(self.telegram_token).rate_limiter(self.rate_limiter)
+        if TELEGRAM_API_URL:
+            builder = builder.base_url(f"{TELEGRAM_API_URL.rstrip('/')}/bot")
+        self.app = builder.build()
         
         # Store bot_id in bot_data for handlers to access
         self.app.bot_data['bot_id'] = self.bot_id
@@ -45,8 +60,27 @@ class BotInstance:
         # Register handlers based on type
         self._register_handlers()
     
+    def needs_restart(self, bot_config: dict) -> bool:
+        """Whether a new configuration requires rebuilding the Application."""
+        return (
+            bot_config['telegram_token'] != self.telegram_token
+            or bot_config.get('bot_type', 'store') != self.bot_type
+        )
+    
+    def apply_config(self, bot_config: dict):
+        """Hot-swap settings that handlers read from bot_data on every update."""
+        self.bot_username = bot_config.get('bot_username', self.bot_username)
+        self.bot_name = bot_config.get('bot_name', self.bot_name)
+        self.pakasir_slug = bot_config.get('pakasir_slug')
+        self.pakasir_api_key = bot_config.get('pakasir_api_key')
+        self.app.bot_data['pakasir_slug'] = self.pakasir_slug
+        self.app.bot_data['pakasir_api_key'] = self.pakasir_api_key
+    
     def _register_handlers(self):
         """Register handlers based on bot type."""
+        # Runs before every other handler group
+        self.app.add_handler(TypeHandler(Update, self._bind_bot_context), group=-1)
+        
         if self.bot_type == 'store':
             self._register_store_handlers()
         elif self.bot_type == 'verification':
@@ -56,6 +90,10 @@ class BotInstance:
         else:
             self._register_custom_handlers()
     
+    async def _bind_bot_context(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Tag the current update with this bot's ID for database metrics."""
+        current_bot_id.set(self.bot_id)
+    
     def _register_store_handlers(self):
         """Register store bot handlers."""
         from handlers.store import get_all_store_handlers
@@ -93,16 +131,47 @@ class BotInstance:
         
         logger.info(f"[{self.bot_username}] Custom handlers registered")
     
-    async def start(self):
-        """Initialize and start the bot (without blocking)."""
+    async def start(self, webhook_server=None):
+        """
+        Initialize and start the bot (without blocking).
+        
+        Args:
+            webhook_server: Shared TelegramWebhookServer to receive updates
+                through. Falls back to polling if omitted or if the
+                webhook cannot be registered.
+        """
         await self.app.initialize()
         await self.app.start()
-        await self.app.updater.start_polling(drop_pending_updates=True)
-        logger.info(f"✅ Bot started: @{self.bot_username} (ID: {self.bot_id}, Type: {self.bot_type})")
+        
+        if webhook_server is not None:
+            from webhook.telegram import webhook_secret
+            
+            try:
+                await webhook_server.register(
+                    self.bot_id, self.app, webhook_secret(self.bot_id, self.telegram_token)
+                )
+                self._webhook_server = webhook_server
+                self.update_mode = "webhook"
+            except Exception as e:
+                logger.warning(f"[{self.bot_username}] Webhook registration failed, polling instead: {e}")
+        
+        if self.update_mode is None:
+            await self.app.updater.start_polling(drop_pending_updates=True)
+            self.update_mode = "polling"
+        
+        logger.info(
+            f"✅ Bot started: @{self.bot_username} "
+            f"(ID: {self.bot_id}, Type: {self.bot_type}, Mode: {self.update_mode})"
+        )
     
     async def stop(self):
         """Stop the bot."""
-        await self.app.updater.stop()
+        if self._webhook_server is not None:
+            await self._webhook_server.unregister(self.bot_id)
+            self._webhook_server = None
+        if self.app.updater.running:
+            await self.app.updater.stop()
+        self.update_mode = None
         await self.app.stop()
         await self.app.shutdown()
         logger.info(f"⏹️ Bot stopped: @{self.bot_username}")
@@ -4,24 +4,74 @@ Orchestrates multiple bot instances from the database.
 """
 
 import asyncio
+import json
 import logging
+import os
 import signal
 import sys
 from typing import Dict, Optional
 
-from database_pg import get_active_bots, get_bot_by_id
+from database_pg import get_active_bots, get_pool, close_pool, get_pool_stats
 from bot_instance import BotInstance
+from services.catalog_cache import catalog_cache
+from services.pakasir import get_pakasir_stats, close_pakasir_session
+from services.qr_renderer import qr_renderer
+from services.payment_status import payment_status
+from services.purchases import purchases
+from services.flash_sale import flash_sales
+from services.payment_reconciler import PaymentReconciler, RECONCILER_ENABLED
+from services.order_expiry import OrderExpirySweeper, ORDER_SWEEP_ENABLED
+from services.delivery import DeliveryQueue
+from services.broadcast import BroadcastRunner
+from services.blocked_users import BlockedUsers
+import database_async
 
 logger = logging.getLogger(__name__)
 
+# "webhook" routes all bots through one HTTP listener, "polling" runs getUpdates per bot
+BOT_UPDATE_MODE = os.getenv("BOT_UPDATE_MODE", "polling").lower()
+# Full comparison against the bots table, catching NOTIFY events that were missed
+BOT_RECONCILE_INTERVAL = float(os.getenv("BOT_RECONCILE_INTERVAL", "60"))
+# Channel the API notifies with {"bot_id": ..., "event": ...} on bot changes
+BOT_EVENTS_CHANNEL = "bot_events"
+
 
 class BotManager:
     """Manages multiple Telegram bot instances."""
     
-    def __init__(self):
+    def __init__(self, worker_id: Optional[str] = None, worker_index: int = 0):
+        """
+        Args:
+            worker_id: Run as a sharded worker that only serves the bots it
+                owns (see sharding.py). None serves every active bot.
+            worker_index: Index of this worker on the host, used to pick
+                its webhook port.
+        """
         self.bots: Dict[int, BotInstance] = {}
         self._running = False
         self._shutdown_event = asyncio.Event()
+        self.webhook_server = None
+        # Listener bots register their Telegram webhooks with; None means polling
+        self.update_server = None
+        self.pakasir_webhook = None
+        self.worker_index = worker_index
+        # Serializes bot start/stop between events, reconciliation and sharding
+        self.lifecycle_lock = asyncio.Lock()
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self._event_tasks: set = set()
+        self.delivery_queue = DeliveryQueue(self)
+        self.payment_reconciler = PaymentReconciler(self) if RECONCILER_ENABLED else None
+        self.order_sweeper = OrderExpirySweeper() if ORDER_SWEEP_ENABLED else None
+        self.broadcasts = BroadcastRunner(self, worker_id)
+        self.blocked_users = BlockedUsers()
+        self.shard = None
+        if worker_id:
+            from sharding import ShardCoordinator
+            self.shard = ShardCoordinator(self, worker_id)
+    
+    def owns(self, bot_id: int) -> bool:
+        """Whether this process should run `bot_id`."""
+        return self.shard is None or self.shard.owns(bot_id)
     
     def load_bots(self) -> int:
         """
@@ -42,12 +92,13 @@ class BotManager:
         
         return len(self.bots)
     
-    def add_bot(self, bot_id: int) -> Optional[BotInstance]:
+    async def add_bot(self, bot_id: int, bot_config: Optional[dict] = None) -> Optional[BotInstance]:
         """
         Add and start a single bot by ID.
         
         Args:
             bot_id: Database ID of the bot
+            bot_config: Its row from the bots table, fetched if not given
             
         Returns:
             BotInstance if successful, None otherwise
@@ -56,7 +107,8 @@ class BotManager:
             logger.warning(f"Bot {bot_id} already running")
             return self.bots[bot_id]
         
-        bot_config = get_bot_by_id(bot_id)
+        if bot_config is None:
+            bot_config = await database_async.get_bot_by_id(bot_id)
         if not bot_config:
             logger.error(f"Bot {bot_id} not found in database")
             return None
@@ -69,18 +121,20 @@ class BotManager:
             logger.error(f"Failed to create bot {bot_id}: {e}")
             return None
     
-    async def start_bot(self, bot_id: int) -> bool:
+    async def start_bot(self, bot_id: int, bot_config: Optional[dict] = None) -> bool:
         """Start a specific bot."""
         if bot_id not in self.bots:
-            instance = self.add_bot(bot_id)
+            instance = await self.add_bot(bot_id, bot_config)
             if not instance:
                 return False
         
         try:
-            await self.bots[bot_id].start()
+            await self.bots[bot_id].start(self.update_server)
             return True
         except Exception as e:
             logger.error(f"Failed to start bot {bot_id}: {e}")
+            # Drop the half-started instance so reconciliation retries it
+            self.bots.pop(bot_id, None)
             return False
     
     async def stop_bot(self, bot_id: int) -> bool:
@@ -97,10 +151,82 @@ class BotManager:
             logger.error(f"Failed to stop bot {bot_id}: {e}")
             return False
     
-    async def restart_bot(self, bot_id: int) -> bool:
+    async def restart_bot(self, bot_id: int, bot_config: Optional[dict] = None) -> bool:
         """Restart a specific bot."""
         await self.stop_bot(bot_id)
-        return await self.start_bot(bot_id)
+        # Build a fresh instance even if stopping the old one failed
+        self.bots.pop(bot_id, None)
+        return await self.start_bot(bot_id, bot_config)
+    
+    async def apply_bot_config(self, bot_id: int, bot_config: Optional[dict]):
+        """
+        Bring one bot in line with its database row without touching the others.
+        
+        Args:
+            bot_id: Database ID of the bot
+            bot_config: Current row from the bots table, None if deleted
+        """
+        instance = self.bots.get(bot_id)
+        
+        if not bot_config or not bot_config['is_active']:
+            if instance:
+                logger.info(f"Bot {bot_id} deactivated or deleted, stopping")
+                await self.stop_bot(bot_id)
+            return
+        
+        if instance is None:
+            # Sharded workers only start bots they hold the lock for
+            if self.shard is None:
+                logger.info(f"Bot {bot_id} activated, starting")
+                await self.start_bot(bot_id, bot_config)
+            return
+        
+        if instance.needs_restart(bot_config):
+            logger.info(f"Bot {bot_id} token or type changed, restarting")
+            await self.restart_bot(bot_id, bot_config)
+        else:
+            instance.apply_config(bot_config)
+    
+    async def reconcile(self):
+        """Compare running bots with the bots table and fix any difference."""
+        active = {b['id']: b for b in await database_async.get_active_bots()}
+        
+        async with self.lifecycle_lock:
+            for bot_id in set(self.bots) | set(active):
+                await self.apply_bot_config(bot_id, active.get(bot_id))
+    
+    async def _handle_bot_event(self, bot_id: Optional[int]):
+        try:
+            if bot_id is None:
+                await self.reconcile()
+            else:
+                bot_config = await database_async.get_bot_by_id(bot_id)
+                async with self.lifecycle_lock:
+                    await self.apply_bot_config(bot_id, bot_config)
+        except Exception as e:
+            logger.error(f"Failed to apply bot event for bot {bot_id}: {e}")
+        if self.shard is not None:
+            self.shard.wake()
+    
+    def _on_bot_event(self, payload: Optional[str]):
+        """NOTIFY callback; payload None means events may have been missed."""
+        try:
+            bot_id = int(json.loads(payload)['bot_id']) if payload else None
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed bot event: {payload!r}")
+            return
+        
+        task = asyncio.create_task(self._handle_bot_event(bot_id))
+        self._event_tasks.add(task)
+        task.add_done_callback(self._event_tasks.discard)
+    
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(BOT_RECONCILE_INTERVAL)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Bot reconciliation failed: {e}")
     
     async def start_all(self):
         """Start all loaded bots concurrently."""
@@ -108,12 +234,15 @@ class BotManager:
             logger.warning("No bots to start")
             return
         
-        tasks = [bot.start() for bot in self.bots.values()]
+        bot_ids = list(self.bots)
+        tasks = [self.bots[bot_id].start(self.update_server) for bot_id in bot_ids]
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
-        for bot_id, result in zip(self.bots.keys(), results):
+        for bot_id, result in zip(bot_ids, results):
             if isinstance(result, Exception):
                 logger.error(f"Bot {bot_id} failed to start: {result}")
+                # Drop the half-started instance so reconciliation retries it
+                self.bots.pop(bot_id, None)
     
     async def stop_all(self):
         """Stop all running bots."""
@@ -140,21 +269,80 @@ class BotManager:
         print("🤖 Multi-Bot Platform")
         print("=" * 50)
         
-        # Load bots
-        count = self.load_bots()
-        print(f"\n📦 Loaded {count} bot(s) from database")
+        # Open the minimum number of pooled database connections up front
+        try:
+            get_pool().warm()
+        except Exception as e:
+            logger.error(f"Failed to warm database pool: {e}")
+        
+        if self.shard is None:
+            # Load bots; bots added later are picked up from bot events
+            count = self.load_bots()
+            print(f"\n📦 Loaded {count} bot(s) from database")
+            
+            if count == 0:
+                print("⚠️ No active bots found. Waiting for bots added via the web dashboard.")
         
-        if count == 0:
-            print("⚠️ No active bots found. Add bots via the web dashboard.")
-            return
+        # Start, stop and reconfigure bots as the dashboard changes them
+        try:
+            await database_async.add_listener(BOT_EVENTS_CHANNEL, self._on_bot_event)
+        except Exception as e:
+            logger.error(f"Failed to subscribe to bot events: {e}")
+        self._reconcile_task = asyncio.create_task(self._reconcile_loop())
         
-        # Start all bots
-        print("\n🚀 Starting all bots...")
-        await self.start_all()
+        # Drop cached catalogs when the dashboard or another runner changes them
+        try:
+            await catalog_cache.start()
+        except Exception as e:
+            logger.error(f"Failed to subscribe to catalog invalidations: {e}")
         
-        print("\n" + "=" * 50)
-        print("All bots running! Press Ctrl+C to stop.")
-        print("=" * 50)
+        await self._start_webhook_server()
+        
+        if self.shard is None:
+            # Start all bots
+            print("\n🚀 Starting all bots...")
+            async with self.lifecycle_lock:
+                await self.start_all()
+            
+            print("\n" + "=" * 50)
+            print("All bots running! Press Ctrl+C to stop.")
+            print("=" * 50)
+        else:
+            # Bots are started and stopped as this worker gains and loses them
+            print(f"\n🧩 Worker {self.shard.worker_id} joining the bot ring...")
+            await self.shard.start()
+        
+        # Flag users who blocked a bot, reported by the senders below
+        await self.blocked_users.start()
+        
+        # Send purchased products queued by fulfillment
+        await self.delivery_queue.start()
+        
+        # Hand out flash-sale stock from memory
+        await flash_sales.start()
+        
+        # Send broadcasts the dashboard queues for our bots
+        await self.broadcasts.start()
+        try:
+            await database_async.add_listener(
+                database_async.BROADCAST_JOBS_CHANNEL, self.broadcasts.on_job_event
+            )
+        except Exception as e:
+            logger.error(f"Failed to subscribe to broadcast jobs: {e}")
+        
+        # Deliver paid orders without waiting for buyers to press "Cek Status"
+        if self.payment_reconciler is not None:
+            await self.payment_reconciler.start()
+            try:
+                await database_async.add_listener(
+                    database_async.PAYMENT_EVENTS_CHANNEL, self.payment_reconciler.on_payment_event
+                )
+            except Exception as e:
+                logger.error(f"Failed to subscribe to payment events: {e}")
+        
+        # Expire unpaid orders; safe to run on every worker
+        if self.order_sweeper is not None:
+            await self.order_sweeper.start()
         
         # Wait for shutdown
         try:
@@ -163,9 +351,67 @@ class BotManager:
             pass
         
         print("\n🛑 Shutting down...")
+        self._reconcile_task.cancel()
+        for task in list(self._event_tasks):
+            task.cancel()
+        await asyncio.gather(self._reconcile_task, *self._event_tasks, return_exceptions=True)
+        if self.order_sweeper is not None:
+            await self.order_sweeper.stop()
+        if self.payment_reconciler is not None:
+            await self.payment_reconciler.stop()
+        await purchases.stop()
+        await flash_sales.stop()
+        await self.broadcasts.stop()
+        await self.delivery_queue.stop()
+        await self.blocked_users.stop()
+        if self.shard is not None:
+            await self.shard.stop()
         await self.stop_all()
+        if self.webhook_server is not None:
+            await self.webhook_server.stop()
+        await close_pakasir_session()
+        qr_renderer.close()
+        await database_async.stop_listeners()
+        await database_async.close_pool()
+        close_pool()
         print("👋 All bots stopped. Goodbye!")
     
+    async def _start_webhook_server(self):
+        """Start the shared webhook listener for Telegram updates and/or Pakasir payments."""
+        from webhook.telegram import TelegramWebhookServer, WEBHOOK_BASE_URL, WEBHOOK_PORT
+        from webhook.pakasir import PakasirWebhook, PAKASIR_WEBHOOK_ENABLED, PAKASIR_WEBHOOK_PATH
+        
+        telegram_updates = BOT_UPDATE_MODE == "webhook"
+        if telegram_updates and not WEBHOOK_BASE_URL:
+            print("⚠️ BOT_UPDATE_MODE=webhook but WEBHOOK_BASE_URL is not set - using polling")
+            telegram_updates = False
+        if not telegram_updates and not PAKASIR_WEBHOOK_ENABLED:
+            return
+        
+        # Each worker on a host listens on its own port; "{worker}" in the
+        # base URL lets a reverse proxy route to it
+        server = TelegramWebhookServer(
+            base_url=WEBHOOK_BASE_URL.replace("{worker}", str(self.worker_index)),
+            port=WEBHOOK_PORT + self.worker_index
+        )
+        pakasir_webhook = None
+        if PAKASIR_WEBHOOK_ENABLED:
+            pakasir_webhook = PakasirWebhook()
+            pakasir_webhook.attach(server.web_app)
+        try:
+            await server.start()
+        except Exception as e:
+            logger.error(f"Failed to start webhook listener: {e}")
+            return
+        
+        self.webhook_server = server
+        self.pakasir_webhook = pakasir_webhook
+        if telegram_updates:
+            self.update_server = server
+            print(f"🌐 Receiving updates via webhook at {server.base_url}/tg/<bot_id>/...")
+        if pakasir_webhook is not None:
+            print(f"💳 Receiving Pakasir payments on port {server.port} at {PAKASIR_WEBHOOK_PATH}")
+    
     async def _shutdown(self):
         """Trigger shutdown."""
         self._running = False
@@ -181,8 +427,26 @@ class BotManager:
                     "id": b.bot_id,
                     "username": b.bot_username,
                     "name": b.bot_name,
-                    "type": b.bot_type
+                    "type": b.bot_type,
+                    "update_mode": b.update_mode,
+                    "rate_limiter": b.rate_limiter.stats(),
                 }
                 for b in self.bots.values()
-            ]
+            ],
+            "db_pool": get_pool_stats(),
+            "db_async_pool": database_async.get_pool_stats(),
+            "catalog_cache": catalog_cache.stats(),
+            "qr_renderer": qr_renderer.stats(),
+            "payment_status": payment_status.stats(),
+            "purchases": purchases.stats(),
+            "flash_sale": flash_sales.stats(),
+            "webhook": self.webhook_server.stats() if self.webhook_server else None,
+            "pakasir_webhook": self.pakasir_webhook.stats() if self.pakasir_webhook else None,
+            "shard": self.shard.stats() if self.shard else None,
+            "payment_reconciler": self.payment_reconciler.stats() if self.payment_reconciler else None,
+            "order_expiry": self.order_sweeper.stats() if self.order_sweeper else None,
+            "deliveries": self.delivery_queue.stats(),
+            "broadcasts": self.broadcasts.stats(),
+            "blocked_users": self.blocked_users.stats(),
+            "pakasir": get_pakasir_stats()
         }
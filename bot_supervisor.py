@@ -0,0 +1,111 @@
+"""
+Bot Supervisor Module.
+Runs the bot platform as N worker processes that share the bots between
+them (see sharding.py), restarting workers that die.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes; 0 keeps the single-process BotManager
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "0"))
+# Prefix of worker IDs, unique per host so several hosts can share the ring
+BOT_WORKER_PREFIX = os.getenv("BOT_WORKER_PREFIX", socket.gethostname())
+
+
+def worker_id_for(index: int) -> str:
+    """Stable worker ID, so a restarted worker gets its old bots back."""
+    return f"{BOT_WORKER_PREFIX}:{index}"
+
+
+def _run_worker(index: int):
+    """Entry point of a worker process."""
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(
+        format=f"%(asctime)s - worker {index} - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO
+    )
+
+    from bot_manager import BotManager
+
+    manager = BotManager(worker_id=worker_id_for(index), worker_index=index)
+    try:
+        asyncio.run(manager.run())
+    except KeyboardInterrupt:
+        pass
+
+
+class Supervisor:
+    """Starts worker processes and restarts them with backoff when they exit."""
+
+    def __init__(self, workers: int = BOT_WORKERS):
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._processes: dict[int, multiprocessing.Process] = {}
+        self._started_at: dict[int, float] = {}
+        self._backoff: dict[int, float] = {}
+        self._restart_at: dict[int, float] = {}
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(target=_run_worker, args=(index,), name=f"bot-worker-{index}")
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Started worker {worker_id_for(index)} (pid {process.pid})")
+
+    def _stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        """Run workers until SIGINT/SIGTERM, then stop them gracefully."""
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        print("=" * 50)
+        print(f"🧩 Bot Supervisor: {self.workers} worker process(es)")
+        print("=" * 50)
+
+        for index in range(self.workers):
+            self._spawn(index)
+
+        while not self._stopping:
+            now = time.monotonic()
+            for index in range(self.workers):
+                process = self._processes.get(index)
+                if process is not None and process.is_alive():
+                    continue
+
+                if process is not None:
+                    # Reset backoff for workers that ran a while before dying
+                    uptime = now - self._started_at[index]
+                    backoff = 1.0 if uptime > 60 else min(self._backoff.get(index, 0.5) * 2, 60.0)
+                    self._backoff[index] = backoff
+                    self._restart_at[index] = now + backoff
+                    self._processes.pop(index)
+                    logger.warning(
+                        f"Worker {worker_id_for(index)} exited with code {process.exitcode}, "
+                        f"restarting in {backoff:.0f}s"
+                    )
+                elif now >= self._restart_at.get(index, 0):
+                    self._spawn(index)
+            time.sleep(1)
+
+        print("\n🛑 Stopping workers...")
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + 30
+        for process in self._processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+        print("👋 All workers stopped. Goodbye!")
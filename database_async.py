@@ -0,0 +1,1413 @@
+"""
+Async database access for Bot Runner.
+Same functions as database_pg, backed by an asyncpg pool so handlers
+never block the event loop shared by all bots.
+"""
+
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, date, timedelta
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import asyncpg
+
+from database_pg import (
+    DATABASE_URL,
+    DB_POOL_MIN,
+    DB_POOL_MAX,
+    DB_POOL_TIMEOUT,
+    DB_POOL_MAX_IDLE,
+    current_bot_id
+)
+
+# Prepared statements do not survive a transaction-mode pooler (e.g. Neon "-pooler" hosts)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv(
+    "DB_STATEMENT_CACHE_SIZE",
+    "0" if "-pooler" in DATABASE_URL else "100"
+))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+
+# libpq-only URL parameters that asyncpg would send as server settings
+_LIBPQ_ONLY_PARAMS = {"channel_binding", "connect_timeout", "application_name"}
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+_metrics: dict = {}
+
+
+def _asyncpg_dsn(url: str) -> str:
+    """Strip libpq-only query parameters asyncpg does not understand."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k not in _LIBPQ_ONLY_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+async def get_pool() -> asyncpg.Pool:
+    """Get the asyncpg pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    _asyncpg_dsn(DATABASE_URL),
+                    min_size=DB_POOL_MIN,
+                    max_size=DB_POOL_MAX,
+                    max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+                    statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                    command_timeout=DB_COMMAND_TIMEOUT
+                )
+    return _pool
+
+
+async def close_pool():
+    """Close the asyncpg pool."""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+def _record(field: str, wait: float = 0.0):
+    """Update per-bot acquisition metrics."""
+    bot_id = current_bot_id.get()
+    stats = _metrics.get(bot_id)
+    if stats is None:
+        stats = _metrics[bot_id] = {
+            "acquired": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "wait_total_ms": 0.0,
+            "wait_max_ms": 0.0,
+        }
+    stats[field] += 1
+    if field == "acquired":
+        wait_ms = wait * 1000
+        stats["wait_total_ms"] += wait_ms
+        stats["wait_max_ms"] = max(stats["wait_max_ms"], wait_ms)
+
+
+def get_pool_stats() -> dict:
+    """Get asyncpg pool size and per-bot acquisition metrics."""
+    pool = _pool
+    return {
+        "size": pool.get_size() if pool else 0,
+        "idle": pool.get_idle_size() if pool else 0,
+        "min": DB_POOL_MIN,
+        "max": DB_POOL_MAX,
+        "bots": {bot_id: dict(stats) for bot_id, stats in _metrics.items()},
+    }
+
+
+@asynccontextmanager
+async def get_connection():
+    """Lease a pooled connection inside a transaction."""
+    pool = await get_pool()
+    started = time.monotonic()
+    try:
+        conn = await pool.acquire(timeout=DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        _record("timeouts")
+        raise
+    except Exception:
+        _record("errors")
+        raise
+    _record("acquired", time.monotonic() - started)
+
+    try:
+        async with conn.transaction():
+            yield conn
+    finally:
+        await pool.release(conn)
+
+
+async def _fetch(query: str, *args) -> list[dict]:
+    async with get_connection() as conn:
+        return [dict(row) for row in await conn.fetch(query, *args)]
+
+
+async def _fetchrow(query: str, *args) -> Optional[dict]:
+    async with get_connection() as conn:
+        row = await conn.fetchrow(query, *args)
+        return dict(row) if row else None
+
+
+async def _execute(query: str, *args) -> int:
+    """Execute a statement and return the number of affected rows."""
+    async with get_connection() as conn:
+        return _rowcount(await conn.execute(query, *args))
+
+
+def _rowcount(status: str) -> int:
+    """Parse the row count from a command tag such as 'UPDATE 3'."""
+    try:
+        return int(status.rsplit(" ", 1)[-1])
+    except (ValueError, AttributeError):
+        return 0
+
+
+# ==================== LISTEN / NOTIFY ====================
+
+# LISTEN needs a session connection; transaction-mode poolers drop it between statements
+DATABASE_LISTEN_URL = os.getenv("DATABASE_LISTEN_URL") or DATABASE_URL.replace("-pooler", "")
+LISTEN_KEEPALIVE = float(os.getenv("LISTEN_KEEPALIVE", "30"))
+
+_listeners: dict[str, list] = {}
+_listen_conn: Optional[asyncpg.Connection] = None
+_listen_task: Optional[asyncio.Task] = None
+
+
+def _dispatch(conn, pid, channel, payload):
+    for callback in list(_listeners.get(channel, ())):
+        try:
+            callback(payload)
+        except Exception as e:
+            print(f"⚠️ Listener for {channel} failed: {e}")
+
+
+async def _listen_loop():
+    """Keep one LISTEN connection open, reconnecting with backoff."""
+    global _listen_conn
+    backoff = 1.0
+
+    while True:
+        try:
+            _listen_conn = await asyncpg.connect(
+                _asyncpg_dsn(DATABASE_LISTEN_URL),
+                statement_cache_size=0
+            )
+            for channel in list(_listeners):
+                await _listen_conn.add_listener(channel, _dispatch)
+
+            # Notifications sent while disconnected are lost: tell
+            # every listener to treat its state as stale
+            for channel in list(_listeners):
+                _dispatch(_listen_conn, None, channel, None)
+            backoff = 1.0
+
+            while True:
+                await asyncio.sleep(LISTEN_KEEPALIVE)
+                await _listen_conn.fetchval("SELECT 1")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ LISTEN connection lost: {e}; reconnecting in {backoff:.0f}s")
+        finally:
+            conn, _listen_conn = _listen_conn, None
+            if conn is not None and not conn.is_closed():
+                conn.terminate()
+
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60.0)
+
+
+async def add_listener(channel: str, callback):
+    """
+    Call `callback(payload)` for every NOTIFY on `channel`.
+
+    The callback runs on the event loop and must not block. It is also
+    called with payload None after a reconnect, since notifications may
+    have been missed in between.
+    """
+    global _listen_task
+    is_new = channel not in _listeners
+    _listeners.setdefault(channel, []).append(callback)
+
+    if is_new and _listen_conn is not None:
+        await _listen_conn.add_listener(channel, _dispatch)
+    if _listen_task is None:
+        _listen_task = asyncio.create_task(_listen_loop())
+
+
+async def stop_listeners():
+    """Close the LISTEN connection and drop all callbacks."""
+    global _listen_task
+    _listeners.clear()
+    if _listen_task is not None:
+        task, _listen_task = _listen_task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+async def notify(channel: str, payload: str = ""):
+    """Send a NOTIFY to every process listening on `channel`."""
+    await _execute("SELECT pg_notify($1, $2)", channel, payload)
+
+
+# ==================== BOT OPERATIONS ====================
+
+async def get_active_bots() -> list[dict]:
+    """Get all active bots from database."""
+    return await _fetch("""
+        SELECT id, user_id, telegram_token, bot_username, bot_name,
+               pakasir_slug, pakasir_api_key, bot_type, is_active
+        FROM bots
+        WHERE is_active = true
+    """)
+
+
+async def get_bot_by_id(bot_id: int) -> Optional[dict]:
+    """Get bot by ID."""
+    return await _fetchrow("""
+        SELECT id, user_id, telegram_token, bot_username, bot_name,
+               pakasir_slug, pakasir_api_key, bot_type, is_active
+        FROM bots WHERE id = $1
+    """, bot_id)
+
+
+async def get_bot_owner_telegram_id(bot_id: int) -> Optional[int]:
+    """Get the Telegram ID of the bot owner (for admin check)."""
+    row = await _fetchrow("""
+        SELECT u.telegram_id
+        FROM bots b
+        JOIN users u ON b.user_id = u.id
+        WHERE b.id = $1
+    """, bot_id)
+    return row['telegram_id'] if row else None
+
+
+# ==================== BOT USER OPERATIONS ====================
+
+async def get_or_create_bot_user(bot_id: int, telegram_id: int, username: str = None, first_name: str = None) -> dict:
+    """Get or create a bot user, clearing is_blocked for a returning user."""
+    async with get_connection() as conn:
+        # Try to get existing
+        row = await conn.fetchrow("""
+            SELECT * FROM bot_users
+            WHERE bot_id = $1 AND telegram_id = $2
+        """, bot_id, telegram_id)
+
+        if row:
+            if row['is_blocked']:
+                # The user is talking to the bot again, so they unblocked it
+                row = await conn.fetchrow("""
+                    UPDATE bot_users SET is_blocked = false
+                    WHERE id = $1
+                    RETURNING *
+                """, row['id'])
+            return dict(row)
+
+        # Create new
+        row = await conn.fetchrow("""
+            INSERT INTO bot_users (bot_id, telegram_id, username, first_name)
+            VALUES ($1, $2, $3, $4)
+            RETURNING *
+        """, bot_id, telegram_id, username, first_name)
+        return dict(row)
+
+
+async def get_bot_user(bot_id: int, telegram_id: int) -> Optional[dict]:
+    """Get bot user by telegram ID."""
+    return await _fetchrow("""
+        SELECT * FROM bot_users
+        WHERE bot_id = $1 AND telegram_id = $2
+    """, bot_id, telegram_id)
+
+
+# ==================== CATEGORY OPERATIONS ====================
+
+async def get_categories_by_bot(bot_id: int, active_only: bool = True) -> list[dict]:
+    """Get categories for a bot."""
+    query = "SELECT * FROM categories WHERE bot_id = $1"
+    if active_only:
+        query += " AND is_active = true"
+    query += " ORDER BY sort_order, name"
+    return await _fetch(query, bot_id)
+
+
+async def get_category_by_id(category_id: int) -> Optional[dict]:
+    """Get category by ID."""
+    return await _fetchrow("SELECT * FROM categories WHERE id = $1", category_id)
+
+
+async def create_category(bot_id: int, name: str, description: str = None) -> dict:
+    """Create a new category."""
+    return await _fetchrow("""
+        INSERT INTO categories (bot_id, name, description)
+        VALUES ($1, $2, $3)
+        RETURNING *
+    """, bot_id, name, description)
+
+
+async def update_category(category_id: int, **kwargs) -> Optional[dict]:
+    """Update a category."""
+    allowed = ['name', 'description', 'is_active', 'sort_order']
+    updates = {k: v for k, v in kwargs.items() if k in allowed and v is not None}
+
+    if not updates:
+        return await get_category_by_id(category_id)
+
+    set_clause = ", ".join([f"{k} = ${i}" for i, k in enumerate(updates.keys(), 1)])
+    values = list(updates.values()) + [category_id]
+    return await _fetchrow(f"""
+        UPDATE categories SET {set_clause}
+        WHERE id = ${len(values)} RETURNING *
+    """, *values)
+
+
+async def delete_category(category_id: int) -> bool:
+    """Delete a category."""
+    return await _execute("DELETE FROM categories WHERE id = $1", category_id) > 0
+
+
+# ==================== PRODUCT OPERATIONS ====================
+
+async def get_products_by_bot(bot_id: int, active_only: bool = True) -> list[dict]:
+    """Get all products for a bot."""
+    query = """
+        SELECT p.*, c.name as category_name,
+               p.available_stock as stock
+        FROM products p
+        LEFT JOIN categories c ON p.category_id = c.id
+        WHERE p.bot_id = $1
+    """
+    if active_only:
+        query += " AND p.is_active = true"
+    query += " ORDER BY p.name"
+    return await _fetch(query, bot_id)
+
+
+async def get_products_by_category(category_id: int, bot_id: int, active_only: bool = True) -> list[dict]:
+    """Get products in a category."""
+    query = """
+        SELECT p.*,
+               p.available_stock as stock
+        FROM products p
+        WHERE p.category_id = $1 AND p.bot_id = $2
+    """
+    if active_only:
+        query += " AND p.is_active = true"
+    query += " ORDER BY p.name"
+    return await _fetch(query, category_id, bot_id)
+
+
+async def get_product_by_id(product_id: int) -> Optional[dict]:
+    """Get product by ID."""
+    return await _fetchrow("""
+        SELECT p.*,
+               p.available_stock as stock
+        FROM products p
+        WHERE p.id = $1
+    """, product_id)
+
+
+async def create_product(bot_id: int, category_id: int, name: str, price: int, description: str = None) -> dict:
+    """Create a new product."""
+    return await _fetchrow("""
+        INSERT INTO products (bot_id, category_id, name, price, description)
+        VALUES ($1, $2, $3, $4, $5)
+        RETURNING *
+    """, bot_id, category_id, name, price, description)
+
+
+async def update_product(product_id: int, **kwargs) -> Optional[dict]:
+    """Update a product."""
+    allowed = ['name', 'description', 'price', 'category_id', 'is_active', 'flash_sale']
+    updates = {k: v for k, v in kwargs.items() if k in allowed and v is not None}
+
+    if not updates:
+        return await get_product_by_id(product_id)
+
+    set_clause = ", ".join([f"{k} = ${i}" for i, k in enumerate(updates.keys(), 1)])
+    set_clause += ", updated_at = NOW()"
+    values = list(updates.values()) + [product_id]
+    return await _fetchrow(f"""
+        UPDATE products SET {set_clause}
+        WHERE id = ${len(values)} RETURNING *
+    """, *values)
+
+
+async def delete_product(product_id: int) -> bool:
+    """Delete a product."""
+    return await _execute("DELETE FROM products WHERE id = $1", product_id) > 0
+
+
+# ==================== STOCK OPERATIONS ====================
+
+async def get_available_stock(product_id: int) -> Optional[dict]:
+    """Get one available stock item (not sold or reserved)."""
+    return await _fetchrow("""
+        SELECT * FROM product_stock
+        WHERE product_id = $1 AND is_sold = false AND reserved_for IS NULL
+        LIMIT 1
+    """, product_id)
+
+
+async def mark_stock_sold(stock_id: int, order_id: int) -> bool:
+    """Mark a stock item as sold."""
+    return await _execute("""
+        UPDATE product_stock
+        SET is_sold = true, sold_at = NOW(), order_id = $1
+        WHERE id = $2
+    """, order_id, stock_id) > 0
+
+
+async def reserve_stock(order_id: str, product_id: int, quantity: int, hold: float) -> bool:
+    """
+    Hold `quantity` free stock items for a checkout, all or nothing.
+
+    `order_id` is the order code; the order row may not exist yet. Items
+    stay reserved while the order is pending; if it is never created they
+    are released `hold` seconds from now (release_stale_reservations).
+    Concurrent reservers skip each other's rows, so thousands of
+    checkouts never wait on one another.
+    """
+    reserved = await _fetch("""
+        WITH picked AS (
+            SELECT id FROM product_stock
+            WHERE product_id = $2 AND is_sold = false AND reserved_for IS NULL
+            ORDER BY id
+            LIMIT $3
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE product_stock ps
+        SET reserved_for = $1, reserved_until = NOW() + make_interval(secs => $4)
+        FROM picked
+        WHERE ps.id = picked.id AND (SELECT COUNT(*) FROM picked) = $3
+        RETURNING ps.id
+    """, order_id, product_id, quantity, float(hold))
+    return len(reserved) == quantity
+
+
+async def reserve_stock_batch(holder: str, product_id: int, limit: int, hold: float) -> list[int]:
+    """
+    Reserve up to `limit` free stock items for `holder` (a flash-sale
+    pool) for `hold` seconds. Returns the reserved item IDs.
+    """
+    rows = await _fetch("""
+        WITH picked AS (
+            SELECT id FROM product_stock
+            WHERE product_id = $2 AND is_sold = false AND reserved_for IS NULL
+            ORDER BY id
+            LIMIT $3
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE product_stock ps
+        SET reserved_for = $1, reserved_until = NOW() + make_interval(secs => $4)
+        FROM picked
+        WHERE ps.id = picked.id
+        RETURNING ps.id
+    """, holder, product_id, limit, float(hold))
+    return [row['id'] for row in rows]
+
+
+async def assign_reserved_stock(holder: str, assignments: list[tuple[int, str]], hold: float) -> list[int]:
+    """
+    Move items reserved by `holder` to order codes, as (stock_id, order_id)
+    pairs, in one statement. Items the holder no longer has are skipped;
+    returns the IDs that were moved.
+    """
+    if not assignments:
+        return []
+    stock_ids, order_ids = zip(*assignments)
+    rows = await _fetch("""
+        UPDATE product_stock ps
+        SET reserved_for = a.order_id, reserved_until = NOW() + make_interval(secs => $4)
+        FROM unnest($2::int[], $3::text[]) AS a(id, order_id)
+        WHERE ps.id = a.id AND ps.reserved_for = $1 AND ps.is_sold = false
+        RETURNING ps.id
+    """, holder, list(stock_ids), list(order_ids), float(hold))
+    return [row['id'] for row in rows]
+
+
+async def renew_reservations(holder: str, hold: float) -> int:
+    """Extend the hold on every unsold item reserved by `holder`."""
+    return await _execute("""
+        UPDATE product_stock SET reserved_until = NOW() + make_interval(secs => $2)
+        WHERE reserved_for = $1 AND is_sold = false
+    """, holder, float(hold))
+
+
+async def release_reservations(order_id: str) -> int:
+    """Return the unsold items reserved for an order code to the free stock."""
+    return await _execute("""
+        UPDATE product_stock SET reserved_for = NULL, reserved_until = NULL
+        WHERE reserved_for = $1 AND is_sold = false
+    """, order_id)
+
+
+async def release_stock_items(holder: str, stock_ids: list[int]) -> int:
+    """Return items still reserved by `holder` to the free stock."""
+    return await _execute("""
+        UPDATE product_stock SET reserved_for = NULL, reserved_until = NULL
+        WHERE id = ANY($2::int[]) AND reserved_for = $1 AND is_sold = false
+    """, holder, stock_ids)
+
+
+async def release_stale_reservations(limit: int) -> int:
+    """
+    Release up to `limit` reserved items whose order is no longer pending,
+    or was never created and whose hold ran out. Returns how many.
+    """
+    return await _execute("""
+        WITH stale AS (
+            SELECT ps.id FROM product_stock ps
+            LEFT JOIN orders o ON o.order_id = ps.reserved_for
+            WHERE ps.reserved_for IS NOT NULL AND ps.is_sold = false
+              AND (o.status <> 'pending' OR (o.id IS NULL AND ps.reserved_until < NOW()))
+            LIMIT $1
+            FOR UPDATE OF ps SKIP LOCKED
+        )
+        UPDATE product_stock ps SET reserved_for = NULL, reserved_until = NULL
+        FROM stale
+        WHERE ps.id = stale.id
+    """, limit)
+
+
+# Advisory lock class for stock imports, keyed by product ID (same as the API)
+STOCK_IMPORT_LOCK = 5704
+
+# Adds staged stock lines, skipping duplicates within the import and items
+# the product already has (idx_product_stock_content_md5)
+_INSERT_STAGED_STOCK = """
+    INSERT INTO product_stock (product_id, content)
+    SELECT $1, s.content FROM (
+        SELECT DISTINCT ON (md5(content)) line, content
+        FROM stock_import
+        ORDER BY md5(content), line
+    ) s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM product_stock ps
+        WHERE ps.product_id = $1 AND md5(ps.content) = md5(s.content)
+    )
+    ORDER BY s.line
+"""
+
+
+async def add_stock_items(product_id: int, contents: list[str]) -> int:
+    """
+    Add multiple stock items to a product, copied in one COPY.
+    Duplicates are skipped. Returns count of items added.
+    """
+    records = [(line, content) for line, content in enumerate(
+        (c.strip() for c in contents if c.strip()), start=1
+    )]
+    if not records:
+        return 0
+
+    async with get_connection() as conn:
+        await conn.execute("SELECT pg_advisory_xact_lock($1, $2)", STOCK_IMPORT_LOCK, product_id)
+        await conn.execute("CREATE TEMP TABLE stock_import (line BIGINT, content TEXT) ON COMMIT DROP")
+        await conn.copy_records_to_table("stock_import", records=records, columns=["line", "content"])
+        return _rowcount(await conn.execute(_INSERT_STAGED_STOCK, product_id))
+
+
+# ==================== ORDER OPERATIONS ====================
+
+async def create_order(
+    bot_id: int,
+    bot_user_id: int,
+    product_id: int,
+    order_id: str,
+    amount: int,
+    fee: int = 0,
+    total: int = 0,
+    qris_string: str = None,
+    expired_at: datetime = None,
+    quantity: int = 1
+) -> dict:
+    """Create a new order for `quantity` items of a product; `amount` is the price of all of them."""
+    return await _fetchrow("""
+        WITH new_order AS (
+            INSERT INTO orders (bot_id, bot_user_id, product_id, order_id, amount, fee, total, qris_string, expired_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            RETURNING *
+        ), item AS (
+            INSERT INTO order_items (order_id, product_id, quantity, unit_price)
+            SELECT id, product_id, $10, amount / $10 FROM new_order
+        )
+        SELECT new_order.*, $10::int AS quantity FROM new_order
+    """, bot_id, bot_user_id, product_id, order_id, amount, fee, total, qris_string, expired_at, quantity)
+
+
+async def get_reusable_order(bot_user_id: int, product_id: int, min_validity: float) -> Optional[dict]:
+    """
+    Get the user's newest pending order for a product whose QRIS stays
+    valid for at least `min_validity` more seconds.
+    """
+    return await _fetchrow("""
+        SELECT o.*, EXTRACT(EPOCH FROM (o.expired_at - NOW()))::float AS expires_in,
+               (SELECT COALESCE(SUM(oi.quantity), 1) FROM order_items oi WHERE oi.order_id = o.id) AS quantity
+        FROM orders o
+        WHERE o.bot_user_id = $1 AND o.product_id = $2 AND o.status = 'pending'
+          AND o.expired_at > NOW() + make_interval(secs => $3)
+        ORDER BY o.created_at DESC
+        LIMIT 1
+    """, bot_user_id, product_id, min_validity)
+
+
+async def get_superseded_orders(bot_user_id: int, product_id: int, keep_order_id: str) -> list[dict]:
+    """Get the user's other pending orders for a product."""
+    return await _fetch("""
+        SELECT order_id, amount FROM orders
+        WHERE bot_user_id = $1 AND product_id = $2 AND status = 'pending' AND order_id <> $3
+    """, bot_user_id, product_id, keep_order_id)
+
+
+async def cancel_pending_order(order_id: str) -> bool:
+    """Cancel an order if it is still pending, releasing its reserved stock."""
+    row = await _fetchrow("""
+        WITH cancelled AS (
+            UPDATE orders SET status = 'cancelled'
+            WHERE order_id = $1 AND status = 'pending'
+            RETURNING order_id
+        ), released AS (
+            UPDATE product_stock ps SET reserved_for = NULL, reserved_until = NULL
+            FROM cancelled c
+            WHERE ps.reserved_for = c.order_id AND ps.is_sold = false
+        )
+        SELECT COUNT(*) > 0 AS cancelled FROM cancelled
+    """, order_id)
+    return row['cancelled']
+
+
+async def get_order_by_order_id(order_id: str) -> Optional[dict]:
+    """Get order by Pakasir order ID."""
+    return await _fetchrow("""
+        SELECT o.*, p.name as product_name, bu.telegram_id,
+               (SELECT COALESCE(SUM(oi.quantity), 1) FROM order_items oi WHERE oi.order_id = o.id) AS quantity
+        FROM orders o
+        LEFT JOIN products p ON o.product_id = p.id
+        LEFT JOIN bot_users bu ON o.bot_user_id = bu.id
+        WHERE o.order_id = $1
+    """, order_id)
+
+
+async def get_orders_by_bot(bot_id: int, limit: int = 50) -> list[dict]:
+    """Get orders for a bot."""
+    return await _fetch("""
+        SELECT o.*, p.name as product_name, bu.username, bu.first_name
+        FROM orders o
+        LEFT JOIN products p ON o.product_id = p.id
+        LEFT JOIN bot_users bu ON o.bot_user_id = bu.id
+        WHERE o.bot_id = $1
+        ORDER BY o.created_at DESC
+        LIMIT $2
+    """, bot_id, limit)
+
+
+async def get_orders_by_user(bot_id: int, bot_user_id: int, limit: int = 10) -> list[dict]:
+    """Get orders for a specific user."""
+    return await _fetch("""
+        SELECT o.*, p.name as product_name,
+               (SELECT COALESCE(SUM(oi.quantity), 1) FROM order_items oi WHERE oi.order_id = o.id) AS quantity
+        FROM orders o
+        LEFT JOIN products p ON o.product_id = p.id
+        WHERE o.bot_id = $1 AND o.bot_user_id = $2
+        ORDER BY o.created_at DESC
+        LIMIT $3
+    """, bot_id, bot_user_id, limit)
+
+
+async def update_order_status(order_id: str, status: str, paid_at: datetime = None) -> bool:
+    """Update order status."""
+    if paid_at:
+        return await _execute("""
+            UPDATE orders SET status = $1, paid_at = $2
+            WHERE order_id = $3
+        """, status, paid_at, order_id) > 0
+    return await _execute("""
+        UPDATE orders SET status = $1
+        WHERE order_id = $2
+    """, status, order_id) > 0
+
+
+async def mark_order_paid(order_id: str, paid_at: datetime = None) -> bool:
+    """Move a pending order to paid. Only the first caller gets True."""
+    return await _execute("""
+        UPDATE orders SET status = 'paid', paid_at = COALESCE($1, NOW())
+        WHERE order_id = $2 AND status = 'pending'
+    """, paid_at, order_id) > 0
+
+
+async def complete_order(order_id: str, paid_at: datetime = None) -> Optional[tuple[dict, list[dict]]]:
+    """
+    Mark a pending order paid and claim its stock in one transaction.
+
+    Returns (order, stock_items) for the caller that flipped the order, or
+    None if it was not pending any more. All `quantity` items are claimed
+    in one statement: those reserved at checkout first, topped up with
+    free ones if reservations were released; fewer items come back when
+    the product ran out. The buyer's message is queued in deliveries in
+    the same transaction, so a paid order is never left without a claim
+    attempt or a delivery, whichever path completes it.
+    """
+    async with get_connection() as conn:
+        order = await conn.fetchrow("""
+            UPDATE orders SET status = 'paid', paid_at = COALESCE($1, NOW())
+            WHERE order_id = $2 AND status = 'pending'
+            RETURNING *,
+                (SELECT telegram_id FROM bot_users WHERE id = orders.bot_user_id) AS telegram_id,
+                (SELECT COALESCE(SUM(oi.quantity), 1) FROM order_items oi WHERE oi.order_id = orders.id) AS quantity
+        """, paid_at, order_id)
+        if order is None:
+            return None
+        stock_items = await conn.fetch("""
+            WITH reserved AS (
+                SELECT id FROM product_stock
+                WHERE reserved_for = $3 AND is_sold = false
+                ORDER BY id
+                LIMIT $4
+                FOR UPDATE SKIP LOCKED
+            ), free AS (
+                SELECT id FROM product_stock
+                WHERE product_id = $2 AND is_sold = false AND reserved_for IS NULL
+                ORDER BY id
+                LIMIT GREATEST($4 - (SELECT COUNT(*) FROM reserved), 0)
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE product_stock
+            SET is_sold = true, sold_at = NOW(), order_id = $1,
+                reserved_for = NULL, reserved_until = NULL
+            WHERE id IN (SELECT id FROM reserved UNION ALL SELECT id FROM free)
+            AND is_sold = false
+            RETURNING *
+        """, order['id'], order['product_id'], order_id, order['quantity'])
+        if order['telegram_id']:
+            await conn.execute("""
+                INSERT INTO deliveries (bot_id, order_id, chat_id)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (order_id) DO NOTHING
+            """, order['bot_id'], order['id'], order['telegram_id'])
+        return dict(order), sorted((dict(item) for item in stock_items), key=lambda item: item['id'])
+
+
+async def get_pending_orders(bot_ids: list[int]) -> list[dict]:
+    """
+    Get pending orders of the given bots for the payment reconciler.
+
+    Ages are computed by the database so they do not depend on the
+    timezone the orders were written in. `notified` is true when Pakasir
+    already reported the payment through the webhook.
+    """
+    return await _fetch("""
+        SELECT o.order_id, o.bot_id, o.amount,
+               EXTRACT(EPOCH FROM (NOW() - o.created_at))::float AS age,
+               EXTRACT(EPOCH FROM (o.expired_at - NOW()))::float AS expires_in,
+               EXISTS (
+                   SELECT 1 FROM webhook_events w
+                   WHERE w.order_id = o.order_id AND w.status = 'completed'
+               ) AS notified
+        FROM orders o
+        WHERE o.status = 'pending' AND o.bot_id = ANY($1::int[])
+    """, bot_ids)
+
+
+# Channel notified with {"order_id", "bot_id", "amount"} when Pakasir reports a payment
+PAYMENT_EVENTS_CHANNEL = "payment_events"
+
+
+async def record_payment_webhook(project: str, order_id: str, amount: int, status: str, payload: str) -> str:
+    """
+    Validate a Pakasir notification against its order and record it once.
+
+    Returns "recorded", "duplicate" (a retry of a recorded notification),
+    "not_pending" (recorded, but the order was already paid or cancelled),
+    "unknown_order", "project_mismatch" or "amount_mismatch". An order
+    the expiry sweeper already expired is reopened.
+    A recorded completed payment of a pending order is announced on
+    PAYMENT_EVENTS_CHANNEL in the same transaction.
+    """
+    async with get_connection() as conn:
+        order = await conn.fetchrow("""
+            SELECT o.order_id, o.bot_id, o.amount, o.status, b.pakasir_slug
+            FROM orders o
+            JOIN bots b ON b.id = o.bot_id
+            WHERE o.order_id = $1
+        """, order_id)
+        if order is None:
+            return "unknown_order"
+        if order['pakasir_slug'] != project:
+            return "project_mismatch"
+        if order['amount'] != amount:
+            return "amount_mismatch"
+
+        event_id = await conn.fetchval("""
+            INSERT INTO webhook_events (idempotency_key, source, bot_id, order_id, status, payload)
+            VALUES ($1, 'pakasir', $2, $3, $4, $5::jsonb)
+            ON CONFLICT (idempotency_key) DO NOTHING
+            RETURNING id
+        """, f"pakasir:{project}:{order_id}:{status}", order['bot_id'], order_id, status, payload)
+        if event_id is None:
+            return "duplicate"
+        if order['status'] == 'expired' and status == 'completed':
+            # Paid just as the expiry sweeper got to it; give it a fresh grace period
+            await conn.execute("""
+                UPDATE orders SET status = 'pending', expired_at = NOW()
+                WHERE order_id = $1 AND status = 'expired'
+            """, order_id)
+        elif order['status'] != 'pending':
+            return "not_pending"
+
+        if status == 'completed':
+            await conn.execute(
+                "SELECT pg_notify($1, $2)",
+                PAYMENT_EVENTS_CHANNEL,
+                json.dumps({"order_id": order_id, "bot_id": order['bot_id'], "amount": amount})
+            )
+        return "recorded"
+
+
+async def expire_pending_orders(grace: float, untimed_ttl: float, limit: int) -> list[dict]:
+    """
+    Move up to `limit` overdue pending orders to expired.
+
+    An order is overdue `grace` seconds after its expired_at, or
+    `untimed_ttl` seconds after creation if it has none. Their reserved
+    stock is released in the same statement. Rows another sweeper is
+    expiring are skipped, so sweepers on several workers never wait on or
+    return the same order. Returns the expired orders with their bot's
+    Pakasir credentials for the upstream cancel.
+    """
+    return await _fetch("""
+        WITH due AS (
+            SELECT id FROM orders
+            WHERE status = 'pending'
+              AND (expired_at < NOW() - make_interval(secs => $1)
+                   OR (expired_at IS NULL AND created_at < NOW() - make_interval(secs => $2)))
+            LIMIT $3
+            FOR UPDATE SKIP LOCKED
+        ), expired AS (
+            UPDATE orders o SET status = 'expired'
+            FROM due
+            WHERE o.id = due.id
+            RETURNING o.order_id, o.bot_id, o.amount
+        ), released AS (
+            UPDATE product_stock ps SET reserved_for = NULL, reserved_until = NULL
+            FROM expired e
+            WHERE ps.reserved_for = e.order_id AND ps.is_sold = false
+        )
+        SELECT e.order_id, e.bot_id, e.amount, b.pakasir_slug, b.pakasir_api_key
+        FROM expired e
+        LEFT JOIN bots b ON b.id = e.bot_id
+    """, float(grace), float(untimed_ttl), limit)
+
+
+async def reopen_expired_order(order_id: str) -> bool:
+    """
+    Move an expired order back to pending because Pakasir reports it paid,
+    and announce it on PAYMENT_EVENTS_CHANNEL so its reconciler confirms
+    and delivers it.
+    """
+    async with get_connection() as conn:
+        order = await conn.fetchrow("""
+            UPDATE orders SET status = 'pending', expired_at = NOW()
+            WHERE order_id = $1 AND status = 'expired'
+            RETURNING order_id, bot_id, amount
+        """, order_id)
+        if order is None:
+            return False
+        await conn.execute("SELECT pg_notify($1, $2)", PAYMENT_EVENTS_CHANNEL, json.dumps(dict(order)))
+        return True
+
+
+async def get_bot_stats(bot_id: int) -> dict:
+    """Get statistics for a bot."""
+    return await _fetchrow("""
+        SELECT
+            (SELECT COUNT(*) FROM products WHERE bot_id = $1) as total_products,
+            (SELECT COUNT(*) FROM bot_users WHERE bot_id = $1) as total_users,
+            (SELECT COUNT(*) FROM bot_users WHERE bot_id = $1 AND is_blocked = false) as reachable_users,
+            (SELECT COUNT(*) FROM orders WHERE bot_id = $1 AND status = 'paid') as total_orders,
+            (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE bot_id = $1 AND status = 'paid') as total_revenue
+    """, bot_id)
+
+
+# ==================== DELIVERY OPERATIONS ====================
+
+async def claim_deliveries(bot_ids: list[int], limit: int, lease: float) -> list[dict]:
+    """
+    Lease due deliveries of the given bots for `lease` seconds.
+
+    Each row comes with the order code, product name and the stock
+    contents sold to the order. A lease that runs out (the worker died
+    mid-send) makes the delivery claimable again; parts_sent says where
+    to resume.
+    """
+    return await _fetch("""
+        WITH claimed AS (
+            UPDATE deliveries d
+            SET status = 'sending', attempts = d.attempts + 1,
+                locked_until = NOW() + make_interval(secs => $3)
+            WHERE d.id IN (
+                SELECT id FROM deliveries
+                WHERE bot_id = ANY($1::int[])
+                  AND status IN ('pending', 'sending')
+                  AND next_attempt_at <= NOW()
+                  AND (locked_until IS NULL OR locked_until < NOW())
+                ORDER BY next_attempt_at
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING d.*
+        )
+        SELECT c.id, c.bot_id, c.chat_id, c.attempts, c.parts_sent,
+               o.order_id AS order_code, p.name AS product_name,
+               (SELECT COALESCE(SUM(oi.quantity), 1) FROM order_items oi WHERE oi.order_id = o.id) AS quantity,
+               ARRAY(
+                   SELECT ps.content FROM product_stock ps
+                   WHERE ps.order_id = c.order_id ORDER BY ps.id
+               ) AS items
+        FROM claimed c
+        JOIN orders o ON o.id = c.order_id
+        LEFT JOIN products p ON p.id = o.product_id
+    """, bot_ids, limit, float(lease))
+
+
+async def record_delivery_part(delivery_id: int, parts_sent: int, message_id: int):
+    """Record a sent message as a receipt, so a retry resumes after it."""
+    await _execute("""
+        UPDATE deliveries
+        SET parts_sent = $2, message_ids = array_append(message_ids, $3)
+        WHERE id = $1
+    """, delivery_id, parts_sent, message_id)
+
+
+async def finish_delivery(delivery_id: int, status: str = 'sent', error: str = None):
+    """Close a delivery as sent or failed."""
+    await _execute("""
+        UPDATE deliveries
+        SET status = $2, last_error = $3, locked_until = NULL,
+            sent_at = CASE WHEN $2 = 'sent' THEN NOW() END
+        WHERE id = $1
+    """, delivery_id, status, error)
+
+
+async def retry_delivery(delivery_id: int, delay: float, error: str):
+    """Release a delivery to be tried again after `delay` seconds."""
+    await _execute("""
+        UPDATE deliveries
+        SET status = 'pending', locked_until = NULL, last_error = $3,
+            next_attempt_at = NOW() + make_interval(secs => $2)
+        WHERE id = $1
+    """, delivery_id, float(delay), error)
+
+
+# ==================== BROADCAST OPERATIONS ====================
+
+# The API announces new broadcast jobs on this channel with the bot ID
+BROADCAST_JOBS_CHANNEL = "broadcast_jobs"
+
+
+async def claim_broadcast(bot_ids: list[int], worker: str, lease: float) -> Optional[dict]:
+    """
+    Lease the oldest runnable broadcast of the given bots to `worker`.
+
+    A job whose lease ran out (its worker died) is taken over and resumes
+    after last_telegram_id. The audience is counted on the first claim.
+    """
+    return await _fetchrow("""
+        UPDATE broadcasts b
+        SET status = 'running', locked_by = $2,
+            locked_until = NOW() + make_interval(secs => $3),
+            started_at = COALESCE(b.started_at, NOW()),
+            total_count = CASE WHEN b.started_at IS NULL THEN (
+                SELECT COUNT(*) FROM bot_users u
+                WHERE u.bot_id = b.bot_id AND u.is_blocked = false
+            ) ELSE b.total_count END
+        WHERE b.id = (
+            SELECT id FROM broadcasts
+            WHERE bot_id = ANY($1::int[])
+              AND status IN ('pending', 'running')
+              AND (locked_until IS NULL OR locked_until < NOW())
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING b.id, b.bot_id, b.message, b.last_telegram_id
+    """, bot_ids, worker, float(lease))
+
+
+async def stream_broadcast_recipients(broadcast_id: int, bot_id: int, after: int, chunk_size: int):
+    """
+    Yield reachable users after `after` in telegram_id order, `chunk_size` at a time.
+
+    Backed by a named WITH HOLD cursor on its own session connection: the
+    server materializes the audience when the cursor is declared, so no
+    transaction stays open while chunks are sent and only one chunk is held
+    here. Users already recorded for the broadcast are skipped.
+    """
+    name = f"broadcast_{int(broadcast_id)}"
+    conn = await asyncpg.connect(_asyncpg_dsn(DATABASE_LISTEN_URL), statement_cache_size=0)
+    try:
+        # Plain integers only, so they can be inlined into the utility statement
+        await conn.execute(f"""
+            DECLARE {name} NO SCROLL CURSOR WITH HOLD FOR
+            SELECT u.telegram_id FROM bot_users u
+            WHERE u.bot_id = {int(bot_id)} AND u.is_blocked = false AND u.telegram_id > {int(after)}
+              AND NOT EXISTS (
+                  SELECT 1 FROM broadcast_recipients r
+                  WHERE r.broadcast_id = {int(broadcast_id)} AND r.telegram_id = u.telegram_id
+              )
+            ORDER BY u.telegram_id
+        """)
+        while True:
+            rows = await conn.fetch(f"FETCH FORWARD {int(chunk_size)} FROM {name}")
+            if not rows:
+                return
+            yield [row['telegram_id'] for row in rows]
+    finally:
+        # Ending the session drops the cursor
+        if not conn.is_closed():
+            conn.terminate()
+
+
+async def record_broadcast_progress(
+    broadcast_id: int, worker: str, lease: float, last_telegram_id: int,
+    results: list[tuple[int, str, Optional[str]]]
+) -> bool:
+    """
+    Store (telegram_id, status, error) outcomes, move the checkpoint and renew the lease.
+
+    Recipients with status 'blocked' are flagged in bot_users at the same
+    time. Returns False if `worker` no longer holds the job, which must then stop.
+    """
+    row = await _fetchrow("""
+        WITH blocked AS (
+            UPDATE bot_users u SET is_blocked = true
+            FROM broadcasts b
+            WHERE b.id = $1 AND b.locked_by = $2
+              AND u.bot_id = b.bot_id AND u.telegram_id = ANY($8::bigint[])
+        ),
+        recorded AS (
+            INSERT INTO broadcast_recipients (broadcast_id, telegram_id, status, error)
+            SELECT $1, r.telegram_id, r.status, r.error
+            FROM unnest($5::bigint[], $6::text[], $7::text[]) AS r(telegram_id, status, error)
+            WHERE EXISTS (SELECT 1 FROM broadcasts WHERE id = $1 AND locked_by = $2)
+            ON CONFLICT DO NOTHING
+            RETURNING status
+        )
+        UPDATE broadcasts
+        SET recipients_count = recipients_count + (SELECT COUNT(*) FROM recorded WHERE status = 'sent'),
+            failed_count = failed_count + (SELECT COUNT(*) FROM recorded WHERE status <> 'sent'),
+            last_telegram_id = GREATEST(last_telegram_id, $4),
+            locked_until = NOW() + make_interval(secs => $3)
+        WHERE id = $1 AND locked_by = $2
+        RETURNING id
+    """, broadcast_id, worker, float(lease), last_telegram_id,
+        [r[0] for r in results], [r[1] for r in results], [r[2] for r in results],
+        [r[0] for r in results if r[1] == 'blocked'])
+    return row is not None
+
+
+async def finish_broadcast(broadcast_id: int, worker: str):
+    """Mark a broadcast completed."""
+    await _execute("""
+        UPDATE broadcasts
+        SET status = 'completed', completed_at = NOW(), locked_by = NULL, locked_until = NULL
+        WHERE id = $1 AND locked_by = $2
+    """, broadcast_id, worker)
+
+
+async def release_broadcast(broadcast_id: int, worker: str):
+    """Give a running broadcast back so another worker resumes it right away."""
+    await _execute("""
+        UPDATE broadcasts SET locked_by = NULL, locked_until = NULL
+        WHERE id = $1 AND locked_by = $2
+    """, broadcast_id, worker)
+
+
+async def compact_broadcast_recipients(retention_days: float, max_broadcasts: int) -> int:
+    """
+    Delete per-recipient rows of broadcasts completed over `retention_days` ago.
+
+    Their totals stay on the broadcasts row. Returns the rows deleted.
+    """
+    return await _execute("""
+        DELETE FROM broadcast_recipients
+        WHERE broadcast_id IN (
+            SELECT b.id FROM broadcasts b
+            WHERE b.status = 'completed'
+              AND b.completed_at < NOW() - make_interval(secs => $1 * 86400)
+              AND EXISTS (SELECT 1 FROM broadcast_recipients r WHERE r.broadcast_id = b.id)
+            ORDER BY b.id
+            LIMIT $2
+        )
+    """, float(retention_days), max_broadcasts)
+
+
+# ==================== BLOCKED USER OPERATIONS ====================
+
+async def mark_users_blocked(users: list[tuple[int, int]]) -> int:
+    """Flag (bot_id, telegram_id) pairs as blocked in one statement. Returns rows changed."""
+    return await _execute("""
+        UPDATE bot_users u SET is_blocked = true
+        FROM unnest($1::int[], $2::bigint[]) AS b(bot_id, telegram_id)
+        WHERE u.bot_id = b.bot_id AND u.telegram_id = b.telegram_id AND u.is_blocked = false
+    """, [u[0] for u in users], [u[1] for u in users])
+
+
+# ==================== VERIFICATION OPERATIONS ====================
+
+async def create_verification(bot_id: int, telegram_id: int, student_id: str, full_name: str) -> dict:
+    """Create a new verification request."""
+    return await _fetchrow("""
+        INSERT INTO verifications (bot_id, telegram_id, student_id, full_name, status)
+        VALUES ($1, $2, $3, $4, 'pending')
+        RETURNING *
+    """, bot_id, telegram_id, student_id, full_name)
+
+
+async def get_verification_by_telegram(bot_id: int, telegram_id: int) -> Optional[dict]:
+    """Get verification by telegram ID."""
+    return await _fetchrow("""
+        SELECT * FROM verifications
+        WHERE bot_id = $1 AND telegram_id = $2
+        ORDER BY created_at DESC
+        LIMIT 1
+    """, bot_id, telegram_id)
+
+
+async def get_pending_verifications(bot_id: int) -> list[dict]:
+    """Get all pending verifications for a bot."""
+    return await _fetch("""
+        SELECT * FROM verifications
+        WHERE bot_id = $1 AND status = 'pending'
+        ORDER BY created_at ASC
+    """, bot_id)
+
+
+async def update_verification_status(verification_id: int, status: str) -> bool:
+    """Update verification status (approved/rejected)."""
+    if status == 'approved':
+        return await _execute("""
+            UPDATE verifications SET status = $1, verified_at = NOW()
+            WHERE id = $2
+        """, status, verification_id) > 0
+    return await _execute("""
+        UPDATE verifications SET status = $1
+        WHERE id = $2
+    """, status, verification_id) > 0
+
+
+# ==================== POINTS VERIFY OPERATIONS ====================
+
+async def get_or_create_pv_user(bot_id: int, telegram_id: int, username: str = None, full_name: str = None, invited_by: int = None) -> dict:
+    """Get or create a points verify user with balance."""
+    async with get_connection() as conn:
+        # Try to get existing
+        row = await conn.fetchrow("""
+            SELECT * FROM pv_users
+            WHERE bot_id = $1 AND telegram_id = $2
+        """, bot_id, telegram_id)
+
+        if row:
+            return dict(row)
+
+        # Create new with initial balance
+        row = await conn.fetchrow("""
+            INSERT INTO pv_users (bot_id, telegram_id, username, full_name, balance, invited_by)
+            VALUES ($1, $2, $3, $4, 1, $5)
+            RETURNING *
+        """, bot_id, telegram_id, username, full_name, invited_by)
+        new_user = dict(row)
+
+        # If invited, give reward to inviter
+        if invited_by:
+            await conn.execute("""
+                UPDATE pv_users SET balance = balance + 2
+                WHERE bot_id = $1 AND telegram_id = $2
+            """, bot_id, invited_by)
+
+            # Record invitation
+            await conn.execute("""
+                INSERT INTO pv_invitations (bot_id, inviter_id, invitee_id)
+                VALUES ($1, $2, $3)
+            """, bot_id, invited_by, telegram_id)
+
+        return new_user
+
+
+async def get_pv_user(bot_id: int, telegram_id: int) -> Optional[dict]:
+    """Get points verify user."""
+    return await _fetchrow("""
+        SELECT * FROM pv_users
+        WHERE bot_id = $1 AND telegram_id = $2
+    """, bot_id, telegram_id)
+
+
+async def pv_user_exists(bot_id: int, telegram_id: int) -> bool:
+    """Check if user exists."""
+    return await get_pv_user(bot_id, telegram_id) is not None
+
+
+async def is_pv_user_blocked(bot_id: int, telegram_id: int) -> bool:
+    """Check if user is blocked."""
+    user = await get_pv_user(bot_id, telegram_id)
+    return user and user.get('is_blocked', False)
+
+
+async def block_pv_user(bot_id: int, telegram_id: int) -> bool:
+    """Block a user."""
+    return await _execute("""
+        UPDATE pv_users SET is_blocked = true
+        WHERE bot_id = $1 AND telegram_id = $2
+    """, bot_id, telegram_id) > 0
+
+
+async def unblock_pv_user(bot_id: int, telegram_id: int) -> bool:
+    """Unblock a user."""
+    return await _execute("""
+        UPDATE pv_users SET is_blocked = false
+        WHERE bot_id = $1 AND telegram_id = $2
+    """, bot_id, telegram_id) > 0
+
+
+async def get_pv_blacklist(bot_id: int) -> list[dict]:
+    """Get blocked users list."""
+    return await _fetch("""
+        SELECT * FROM pv_users
+        WHERE bot_id = $1 AND is_blocked = true
+    """, bot_id)
+
+
+async def add_pv_balance(bot_id: int, telegram_id: int, amount: int) -> bool:
+    """Add balance to user."""
+    return await _execute("""
+        UPDATE pv_users SET balance = balance + $1
+        WHERE bot_id = $2 AND telegram_id = $3
+    """, amount, bot_id, telegram_id) > 0
+
+
+async def deduct_pv_balance(bot_id: int, telegram_id: int, amount: int) -> bool:
+    """Deduct balance from user (checks if sufficient)."""
+    return await _execute("""
+        UPDATE pv_users SET balance = balance - $1
+        WHERE bot_id = $2 AND telegram_id = $3 AND balance >= $1
+    """, amount, bot_id, telegram_id) > 0
+
+
+async def can_pv_checkin(bot_id: int, telegram_id: int) -> bool:
+    """Check if user can check-in today."""
+    user = await get_pv_user(bot_id, telegram_id)
+    if not user:
+        return False
+
+    last_checkin = user.get('last_checkin')
+    if not last_checkin:
+        return True
+
+    return last_checkin.date() < date.today()
+
+
+async def pv_checkin(bot_id: int, telegram_id: int) -> bool:
+    """Perform daily check-in."""
+    return await _execute("""
+        UPDATE pv_users
+        SET balance = balance + 1, last_checkin = NOW()
+        WHERE bot_id = $1 AND telegram_id = $2
+        AND (last_checkin IS NULL OR DATE(last_checkin) < CURRENT_DATE)
+    """, bot_id, telegram_id) > 0
+
+
+async def add_pv_verification(bot_id: int, telegram_id: int, verify_type: str, verify_url: str, status: str, result: str = "", verify_id: str = "") -> bool:
+    """Add verification record."""
+    await _execute("""
+        INSERT INTO pv_verifications (bot_id, telegram_id, verify_type, verify_url, verify_id, status, result)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+    """, bot_id, telegram_id, verify_type, verify_url, verify_id, status, result)
+    return True
+
+
+async def get_pv_user_verifications(bot_id: int, telegram_id: int) -> list[dict]:
+    """Get user's verification history."""
+    return await _fetch("""
+        SELECT * FROM pv_verifications
+        WHERE bot_id = $1 AND telegram_id = $2
+        ORDER BY created_at DESC
+    """, bot_id, telegram_id)
+
+
+# Card Key Operations
+async def create_pv_card_key(bot_id: int, key_code: str, balance: int, created_by: int, max_uses: int = 1, expire_days: int = None) -> bool:
+    """Create a redemption card key."""
+    expire_at = None
+    if expire_days:
+        expire_at = datetime.now() + timedelta(days=expire_days)
+
+    try:
+        await _execute("""
+            INSERT INTO pv_card_keys (bot_id, key_code, balance, max_uses, created_by, expire_at)
+            VALUES ($1, $2, $3, $4, $5, $6)
+        """, bot_id, key_code, balance, max_uses, created_by, expire_at)
+        return True
+    except Exception:
+        return False
+
+
+async def use_pv_card_key(bot_id: int, key_code: str, telegram_id: int) -> int:
+    """
+    Use a card key. Returns:
+    - positive number: balance added
+    - -1: max uses reached
+    - -2: expired
+    - -3: already used by this user
+    - None: key not found
+    """
+    async with get_connection() as conn:
+        # Get key info
+        card = await conn.fetchrow("""
+            SELECT * FROM pv_card_keys WHERE bot_id = $1 AND key_code = $2
+        """, bot_id, key_code)
+
+        if not card:
+            return None
+
+        card = dict(card)
+
+        # Check expiry
+        if card.get('expire_at') and datetime.now() > card['expire_at']:
+            return -2
+
+        # Check max uses
+        if card['current_uses'] >= card['max_uses']:
+            return -1
+
+        # Check if user already used
+        used = await conn.fetchrow("""
+            SELECT 1 FROM pv_card_key_usage
+            WHERE bot_id = $1 AND key_code = $2 AND telegram_id = $3
+        """, bot_id, key_code, telegram_id)
+        if used:
+            return -3
+
+        # Use the key
+        await conn.execute("""
+            UPDATE pv_card_keys SET current_uses = current_uses + 1
+            WHERE bot_id = $1 AND key_code = $2
+        """, bot_id, key_code)
+
+        await conn.execute("""
+            INSERT INTO pv_card_key_usage (bot_id, key_code, telegram_id)
+            VALUES ($1, $2, $3)
+        """, bot_id, key_code, telegram_id)
+
+        await conn.execute("""
+            UPDATE pv_users SET balance = balance + $1
+            WHERE bot_id = $2 AND telegram_id = $3
+        """, card['balance'], bot_id, telegram_id)
+
+        return card['balance']
+
+
+async def get_pv_card_keys(bot_id: int) -> list[dict]:
+    """Get all card keys for a bot."""
+    return await _fetch("""
+        SELECT * FROM pv_card_keys
+        WHERE bot_id = $1
+        ORDER BY created_at DESC
+    """, bot_id)
+
+
+async def get_all_pv_user_ids(bot_id: int) -> list[int]:
+    """Get all user telegram IDs for broadcast."""
+    rows = await _fetch("""
+        SELECT telegram_id FROM pv_users WHERE bot_id = $1
+    """, bot_id)
+    return [row['telegram_id'] for row in rows]
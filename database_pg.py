@@ -3,10 +3,16 @@ Database connection for Bot Runner.
 Connects to the same PostgreSQL database as the API.
 """
 
+import io
 import os
+import threading
+import time
 import psycopg2
+import psycopg2.pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 from typing import Optional
 from dotenv import load_dotenv
@@ -15,19 +21,272 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "")
 
+# Connection pool settings
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))  # close idle connections above min after this
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))  # ping connections idle longer than this
+
+# Bot the current update is processed for (set by BotInstance), used for pool metrics
+current_bot_id: ContextVar[Optional[int]] = ContextVar("current_bot_id", default=None)
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool.
+    
+    Connections are reused LIFO so the oldest idle ones can be evicted,
+    pinged before reuse when they sat idle for a while, and discarded
+    when they come back broken.
+    """
+    
+    def __init__(
+        self,
+        dsn: str,
+        minconn: int = DB_POOL_MIN,
+        maxconn: int = DB_POOL_MAX,
+        timeout: float = DB_POOL_TIMEOUT,
+        max_idle: float = DB_POOL_MAX_IDLE,
+        check_after: float = DB_POOL_CHECK_AFTER
+    ):
+        self.dsn = dsn
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+        
+        self._idle: list[tuple] = []  # (connection, returned_at)
+        self._size = 0  # open connections, idle + leased
+        self._closed = False
+        self._cond = threading.Condition()
+        self._metrics: dict = {}
+    
+    def _connect(self):
+        return psycopg2.connect(
+            self.dsn,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+    
+    def _is_healthy(self, conn, returned_at: float) -> bool:
+        """Check a connection taken from the idle stack."""
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+    
+    def _evict_idle(self) -> list:
+        """Pop connections idle longer than max_idle (caller holds the lock)."""
+        now = time.monotonic()
+        evicted = []
+        while (
+            self._idle
+            and self._size > self.minconn
+            and now - self._idle[0][1] > self.max_idle
+        ):
+            conn, _ = self._idle.pop(0)
+            self._size -= 1
+            evicted.append(conn)
+        return evicted
+    
+    def _record(self, field: str, wait: float = 0.0):
+        """Update per-bot acquisition metrics (caller holds the lock)."""
+        bot_id = current_bot_id.get()
+        stats = self._metrics.get(bot_id)
+        if stats is None:
+            stats = self._metrics[bot_id] = {
+                "acquired": 0,
+                "timeouts": 0,
+                "errors": 0,
+                "wait_total_ms": 0.0,
+                "wait_max_ms": 0.0,
+            }
+        stats[field] += 1
+        if field == "acquired":
+            wait_ms = wait * 1000
+            stats["wait_total_ms"] += wait_ms
+            stats["wait_max_ms"] = max(stats["wait_max_ms"], wait_ms)
+    
+    @staticmethod
+    def _close_all(connections: list):
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    
+    def warm(self):
+        """Open connections up to the minimum size."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+    
+    def getconn(self):
+        """Lease a connection, waiting up to `timeout` seconds for one."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn = None
+        returned_at = None
+        reserved = False
+        evicted = []
+        
+        with self._cond:
+            while not self._closed:
+                evicted.extend(self._evict_idle())
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    reserved = True
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._record("timeouts")
+                    break
+                self._cond.wait(remaining)
+            closed = self._closed
+        self._close_all(evicted)
+        
+        if closed:
+            raise psycopg2.pool.PoolError("connection pool is closed")
+        if conn is None and not reserved:
+            raise PoolTimeout(
+                f"No database connection available after {self.timeout}s "
+                f"(pool max={self.maxconn})"
+            )
+        
+        try:
+            if conn is not None and not self._is_healthy(conn, returned_at):
+                self._close_all([conn])
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._record("errors")
+                self._cond.notify()
+            raise
+        
+        with self._cond:
+            self._record("acquired", time.monotonic() - started)
+        return conn
+    
+    def putconn(self, conn, discard: bool = False):
+        """Return a leased connection to the pool."""
+        if not discard and not conn.closed:
+            if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        
+        with self._cond:
+            if self._closed or discard or conn.closed:
+                self._size -= 1
+                self._close_all([conn])
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+    
+    def close(self):
+        """Close all idle connections and refuse new leases."""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._size -= len(idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        self._close_all(idle)
+    
+    def stats(self) -> dict:
+        """Pool size and per-bot acquisition metrics."""
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min": self.minconn,
+                "max": self.maxconn,
+                "bots": {
+                    bot_id: dict(stats) for bot_id, stats in self._metrics.items()
+                },
+            }
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Get the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DATABASE_URL)
+    return _pool
+
+
+def close_pool():
+    """Close the process-wide connection pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def get_pool_stats() -> dict:
+    """Get connection pool metrics."""
+    return get_pool().stats()
+
 
 @contextmanager
 def get_connection():
-    """Get database connection with context manager."""
-    conn = psycopg2.connect(DATABASE_URL)
+    """Lease a pooled database connection with context manager."""
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
     try:
         yield conn
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
         raise
     finally:
-        conn.close()
+        pool.putconn(conn, discard=broken)
 
 
 @contextmanager
@@ -83,7 +342,7 @@ def get_bot_owner_telegram_id(bot_id: int) -> Optional[int]:
 # ==================== BOT USER OPERATIONS ====================
 
 def get_or_create_bot_user(bot_id: int, telegram_id: int, username: str = None, first_name: str = None) -> dict:
-    """Get or create a bot user."""
+    """Get or create a bot user, clearing is_blocked for a returning user."""
     with get_cursor() as cursor:
         # Try to get existing
         cursor.execute("""
@@ -93,6 +352,14 @@ def get_or_create_bot_user(bot_id: int, telegram_id: int, username: str = None,
         row = cursor.fetchone()
         
         if row:
+            if row['is_blocked']:
+                # The user is talking to the bot again, so they unblocked it
+                cursor.execute("""
+                    UPDATE bot_users SET is_blocked = false
+                    WHERE id = %s
+                    RETURNING *
+                """, (row['id'],))
+                row = cursor.fetchone()
             return dict(row)
         
         # Create new
@@ -180,7 +447,7 @@ def get_products_by_bot(bot_id: int, active_only: bool = True) -> list[dict]:
     with get_cursor() as cursor:
         query = """
             SELECT p.*, c.name as category_name,
-                   (SELECT COUNT(*) FROM product_stock WHERE product_id = p.id AND is_sold = false) as stock
+                   p.available_stock as stock
             FROM products p
             LEFT JOIN categories c ON p.category_id = c.id
             WHERE p.bot_id = %s
@@ -197,7 +464,7 @@ def get_products_by_category(category_id: int, bot_id: int, active_only: bool =
     with get_cursor() as cursor:
         query = """
             SELECT p.*,
-                   (SELECT COUNT(*) FROM product_stock WHERE product_id = p.id AND is_sold = false) as stock
+                   p.available_stock as stock
             FROM products p
             WHERE p.category_id = %s AND p.bot_id = %s
         """
@@ -213,7 +480,7 @@ def get_product_by_id(product_id: int) -> Optional[dict]:
     with get_cursor() as cursor:
         cursor.execute("""
             SELECT p.*,
-                   (SELECT COUNT(*) FROM product_stock WHERE product_id = p.id AND is_sold = false) as stock
+                   p.available_stock as stock
             FROM products p
             WHERE p.id = %s
         """, (product_id,))
@@ -234,7 +501,7 @@ def create_product(bot_id: int, category_id: int, name: str, price: int, descrip
 
 def update_product(product_id: int, **kwargs) -> Optional[dict]:
     """Update a product."""
-    allowed = ['name', 'description', 'price', 'category_id', 'is_active']
+    allowed = ['name', 'description', 'price', 'category_id', 'is_active', 'flash_sale']
     updates = {k: v for k, v in kwargs.items() if k in allowed and v is not None}
     
     if not updates:
@@ -262,11 +529,11 @@ def delete_product(product_id: int) -> bool:
 # ==================== STOCK OPERATIONS ====================
 
 def get_available_stock(product_id: int) -> Optional[dict]:
-    """Get one available stock item (not sold)."""
+    """Get one available stock item (not sold or reserved)."""
     with get_cursor() as cursor:
         cursor.execute("""
             SELECT * FROM product_stock
-            WHERE product_id = %s AND is_sold = false
+            WHERE product_id = %s AND is_sold = false AND reserved_for IS NULL
             LIMIT 1
         """, (product_id,))
         row = cursor.fetchone()
@@ -284,15 +551,44 @@ def mark_stock_sold(stock_id: int, order_id: int) -> bool:
         return cursor.rowcount > 0
 
 
+# Advisory lock class for stock imports, keyed by product ID (same as the API)
+STOCK_IMPORT_LOCK = 5704
+
+
+def _copy_escape(content: str) -> str:
+    """Escape a value for COPY text format."""
+    return (content.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
 def add_stock_items(product_id: int, contents: list[str]) -> int:
-    """Add multiple stock items to a product."""
-    with get_cursor() as cursor:
-        for content in contents:
-            cursor.execute("""
-                INSERT INTO product_stock (product_id, content)
-                VALUES (%s, %s)
-            """, (product_id, content.strip()))
-        return len(contents)
+    """
+    Add multiple stock items to a product, copied in one COPY.
+    Duplicates are skipped. Returns count of items added.
+    """
+    lines = [c.strip() for c in contents if c.strip()]
+    if not lines:
+        return 0
+
+    data = io.StringIO("".join(f"{n}\t{_copy_escape(c)}\n" for n, c in enumerate(lines, start=1)))
+    with get_cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", (STOCK_IMPORT_LOCK, product_id))
+        cursor.execute("CREATE TEMP TABLE stock_import (line BIGINT, content TEXT) ON COMMIT DROP")
+        cursor.copy_expert("COPY stock_import (line, content) FROM STDIN", data)
+        cursor.execute("""
+            INSERT INTO product_stock (product_id, content)
+            SELECT %(product_id)s, s.content FROM (
+                SELECT DISTINCT ON (md5(content)) line, content
+                FROM stock_import
+                ORDER BY md5(content), line
+            ) s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM product_stock ps
+                WHERE ps.product_id = %(product_id)s AND md5(ps.content) = md5(s.content)
+            )
+            ORDER BY s.line
+        """, {"product_id": product_id})
+        return cursor.rowcount
 
 
 # ==================== ORDER OPERATIONS ====================
@@ -384,9 +680,10 @@ def get_bot_stats(bot_id: int) -> dict:
             SELECT 
                 (SELECT COUNT(*) FROM products WHERE bot_id = %s) as total_products,
                 (SELECT COUNT(*) FROM bot_users WHERE bot_id = %s) as total_users,
+                (SELECT COUNT(*) FROM bot_users WHERE bot_id = %s AND is_blocked = false) as reachable_users,
                 (SELECT COUNT(*) FROM orders WHERE bot_id = %s AND status = 'paid') as total_orders,
                 (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE bot_id = %s AND status = 'paid') as total_revenue
-        """, (bot_id, bot_id, bot_id, bot_id))
+        """, (bot_id, bot_id, bot_id, bot_id, bot_id))
         return dict(cursor.fetchone())
 
 
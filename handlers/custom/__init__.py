@@ -7,7 +7,7 @@ from telegram.ext import CommandHandler
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from database_pg import get_or_create_bot_user
+from database_async import get_or_create_bot_user
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -16,7 +16,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bot_id = context.bot_data.get('bot_id')
     
     # Register user
-    get_or_create_bot_user(
+    await get_or_create_bot_user(
         bot_id=bot_id,
         telegram_id=user.id,
         username=user.username,
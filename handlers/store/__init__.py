@@ -32,6 +32,7 @@ from .admin import (
     admin_products,
     admin_product_detail,
     admin_product_toggle,
+    admin_product_flash,
     admin_product_delete,
     admin_product_add_start,
     admin_product_select_category,
@@ -106,6 +107,7 @@ def get_all_store_handlers(bot_id: int) -> list:
         CallbackQueryHandler(admin_products, pattern="^admin_products$"),
         CallbackQueryHandler(admin_product_detail, pattern="^admin_prod_\\d+$"),
         CallbackQueryHandler(admin_product_toggle, pattern="^admin_prod_toggle_\\d+$"),
+        CallbackQueryHandler(admin_product_flash, pattern="^admin_prod_flash_\\d+$"),
         CallbackQueryHandler(admin_product_delete, pattern="^admin_prod_del_\\d+$"),
         CallbackQueryHandler(admin_orders, pattern="^admin_orders$"),
         CallbackQueryHandler(admin_stats, pattern="^admin_stats$"),
@@ -127,8 +129,8 @@ def get_all_store_handlers(bot_id: int) -> list:
     
     # === ORDER HANDLERS ===
     handlers.extend([
-        CallbackQueryHandler(show_buy_confirmation, pattern="^buy_\\d+$"),
-        CallbackQueryHandler(process_purchase, pattern="^confirm_buy_\\d+$"),
+        CallbackQueryHandler(show_buy_confirmation, pattern="^buy_\\d+(_\\d+)?$"),
+        CallbackQueryHandler(process_purchase, pattern="^confirm_buy_\\d+(_\\d+)?$"),
         CallbackQueryHandler(check_payment_status, pattern="^check_[A-Z0-9]+$"),
         CallbackQueryHandler(cancel_payment, pattern="^cancel_[A-Z0-9]+$"),
         CallbackQueryHandler(show_my_orders, pattern="^menu_orders$"),
@@ -7,7 +7,7 @@ import os
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 
-from database_pg import (
+from database_async import (
     get_categories_by_bot,
     get_category_by_id,
     create_category,
@@ -22,6 +22,8 @@ from database_pg import (
     get_bot_stats,
     add_stock_items
 )
+from services.catalog_cache import catalog_cache
+from services.flash_sale import flash_sales
 from utils.keyboard import create_back_keyboard
 
 # Conversation states
@@ -72,7 +74,7 @@ async def admin_categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     bot_id = context.bot_data.get('bot_id')
-    categories = get_categories_by_bot(bot_id, active_only=False)
+    categories = await get_categories_by_bot(bot_id, active_only=False)
     
     keyboard = []
     for cat in categories:
@@ -101,7 +103,7 @@ async def admin_category_detail(update: Update, context: ContextTypes.DEFAULT_TY
         return
     
     category_id = int(query.data.split("_")[2])
-    category = get_category_by_id(category_id)
+    category = await get_category_by_id(category_id)
     
     if not category:
         await query.edit_message_text("❌ Kategori tidak ditemukan.")
@@ -137,11 +139,12 @@ async def admin_category_toggle(update: Update, context: ContextTypes.DEFAULT_TY
         return
     
     category_id = int(query.data.split("_")[3])
-    category = get_category_by_id(category_id)
+    category = await get_category_by_id(category_id)
     
     if category:
         new_status = not category['is_active']
-        update_category(category_id, is_active=new_status)
+        await update_category(category_id, is_active=new_status)
+        await catalog_cache.invalidate(context.bot_data.get('bot_id'))
     
     # Redirect back to detail
     query.data = f"admin_cat_{category_id}"
@@ -157,7 +160,8 @@ async def admin_category_delete(update: Update, context: ContextTypes.DEFAULT_TY
         return
     
     category_id = int(query.data.split("_")[3])
-    delete_category(category_id)
+    await delete_category(category_id)
+    await catalog_cache.invalidate(context.bot_data.get('bot_id'))
     
     await admin_categories(update, context)
 
@@ -201,7 +205,8 @@ async def admin_category_add_desc(update: Update, context: ContextTypes.DEFAULT_
     name = context.user_data.get('new_cat_name')
     desc = update.message.text if update.message.text != '-' else None
     
-    create_category(bot_id, name, desc)
+    await create_category(bot_id, name, desc)
+    await catalog_cache.invalidate(bot_id)
     
     await update.message.reply_text(
         f"✅ Kategori *{name}* berhasil ditambahkan!",
@@ -223,7 +228,7 @@ async def admin_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     bot_id = context.bot_data.get('bot_id')
-    products = get_products_by_bot(bot_id, active_only=False)
+    products = await get_products_by_bot(bot_id, active_only=False)
     
     keyboard = []
     for prod in products:
@@ -253,7 +258,7 @@ async def admin_product_detail(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     product_id = int(query.data.split("_")[2])
-    product = get_product_by_id(product_id)
+    product = await get_product_by_id(product_id)
     
     if not product:
         await query.edit_message_text("❌ Produk tidak ditemukan.")
@@ -269,11 +274,16 @@ async def admin_product_detail(update: Update, context: ContextTypes.DEFAULT_TYP
         f"💰 Harga: {price_str}\n"
         f"📊 Status: {status}\n"
         f"📦 Stok: {stock}"
+        f" (+{product.get('reserved_stock') or 0} dipesan, {product.get('sold_count') or 0} terjual)"
     )
+    if product.get('flash_sale'):
+        text += f"\n⚡ Flash sale: {flash_sales.pooled(product_id)} item siap di pool"
     
     toggle_text = "❌ Nonaktifkan" if product['is_active'] else "✅ Aktifkan"
+    flash_text = "⚡ Flash Sale: ON" if product.get('flash_sale') else "⚡ Flash Sale: OFF"
     keyboard = [
         [InlineKeyboardButton(toggle_text, callback_data=f"admin_prod_toggle_{product_id}")],
+        [InlineKeyboardButton(flash_text, callback_data=f"admin_prod_flash_{product_id}")],
         [InlineKeyboardButton("🗑️ Hapus", callback_data=f"admin_prod_del_{product_id}")],
         [InlineKeyboardButton("◀️ Kembali", callback_data="admin_products")]
     ]
@@ -294,11 +304,35 @@ async def admin_product_toggle(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     product_id = int(query.data.split("_")[3])
-    product = get_product_by_id(product_id)
+    product = await get_product_by_id(product_id)
     
     if product:
         new_status = not product['is_active']
-        update_product(product_id, is_active=new_status)
+        await update_product(product_id, is_active=new_status)
+        await catalog_cache.invalidate(context.bot_data.get('bot_id'))
+    
+    query.data = f"admin_prod_{product_id}"
+    await admin_product_detail(update, context)
+
+
+async def admin_product_flash(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Toggle flash-sale mode (stock served from an in-memory pool)."""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_owner(update.effective_user.id):
+        return
+    
+    product_id = int(query.data.split("_")[3])
+    product = await get_product_by_id(product_id)
+    
+    if product:
+        flash_sale = not product.get('flash_sale')
+        await update_product(product_id, flash_sale=flash_sale)
+        if not flash_sale:
+            # Return the pooled items to the regular stock
+            await flash_sales.release(product_id)
+        await catalog_cache.invalidate(context.bot_data.get('bot_id'))
     
     query.data = f"admin_prod_{product_id}"
     await admin_product_detail(update, context)
@@ -313,7 +347,8 @@ async def admin_product_delete(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     product_id = int(query.data.split("_")[3])
-    delete_product(product_id)
+    await delete_product(product_id)
+    await catalog_cache.invalidate(context.bot_data.get('bot_id'))
     
     await admin_products(update, context)
 
@@ -327,7 +362,7 @@ async def admin_product_add_start(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END
     
     bot_id = context.bot_data.get('bot_id')
-    categories = get_categories_by_bot(bot_id)
+    categories = await get_categories_by_bot(bot_id)
     
     if not categories:
         await query.edit_message_text(
@@ -432,15 +467,18 @@ async def admin_product_add_content(update: Update, context: ContextTypes.DEFAUL
     stock_items = update.message.text.strip().split('\n')
     
     # Create product
-    product = create_product(bot_id, category_id, name, price, desc)
+    product = await create_product(bot_id, category_id, name, price, desc)
     
-    # Add stock items
+    # Add stock items (duplicate lines are skipped)
+    added = 0
     if stock_items and stock_items[0]:
-        add_stock_items(product['id'], stock_items)
+        added = await add_stock_items(product['id'], stock_items)
+    
+    await catalog_cache.invalidate(bot_id)
     
     await update.message.reply_text(
         f"✅ Produk *{name}* berhasil ditambahkan!\n"
-        f"📦 {len(stock_items)} stok ditambahkan.",
+        f"📦 {added} stok ditambahkan.",
         parse_mode="Markdown",
         reply_markup=create_back_keyboard("admin_products")
     )
@@ -478,7 +516,7 @@ async def admin_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     bot_id = context.bot_data.get('bot_id')
-    orders = get_orders_by_bot(bot_id, limit=20)
+    orders = await get_orders_by_bot(bot_id, limit=20)
     
     if not orders:
         await query.edit_message_text(
@@ -513,14 +551,15 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     bot_id = context.bot_data.get('bot_id')
-    stats = get_bot_stats(bot_id)
+    stats = await get_bot_stats(bot_id)
     
     revenue_str = f"Rp {stats['total_revenue']:,}".replace(",", ".")
     
     text = (
         "📊 *Statistik Toko*\n\n"
         f"📦 Produk: {stats['total_products']}\n"
-        f"👥 User: {stats['total_users']}\n"
+        f"👥 User: {stats['total_users']} ({stats['reachable_users']} aktif, "
+        f"{stats['total_users'] - stats['reachable_users']} memblokir bot)\n"
         f"🛒 Pesanan: {stats['total_orders']}\n"
         f"💰 Total Revenue: {revenue_str}"
     )
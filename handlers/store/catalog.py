@@ -6,12 +6,8 @@ Handles category and product browsing.
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from database_pg import (
-    get_categories_by_bot,
-    get_products_by_category,
-    get_product_by_id,
-    get_category_by_id
-)
+from services.catalog_cache import catalog_cache
+from services.flash_sale import flash_sales
 from utils.keyboard import (
     create_category_keyboard,
     create_product_keyboard,
@@ -26,7 +22,7 @@ async def show_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     bot_id = context.bot_data.get('bot_id')
-    categories = get_categories_by_bot(bot_id)
+    categories = await catalog_cache.get_categories(bot_id)
     
     if not categories:
         await query.edit_message_text(
@@ -58,8 +54,8 @@ async def show_category_products(update: Update, context: ContextTypes.DEFAULT_T
     # Extract category ID from callback data
     category_id = int(query.data.split("_")[1])
     
-    category = get_category_by_id(category_id)
-    products = get_products_by_category(category_id, bot_id)
+    category = await catalog_cache.get_category(bot_id, category_id)
+    products = await catalog_cache.get_products_by_category(bot_id, category_id)
     
     if not category:
         await query.edit_message_text(
@@ -89,10 +85,12 @@ async def show_product_detail(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
     
+    bot_id = context.bot_data.get('bot_id')
+    
     # Extract product ID from callback data
     product_id = int(query.data.split("_")[1])
     
-    product = get_product_by_id(product_id)
+    product = await catalog_cache.get_product(bot_id, product_id)
     
     if not product:
         await query.edit_message_text(
@@ -105,12 +103,22 @@ async def show_product_detail(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Format price
     price_str = f"Rp {product['price']:,}".replace(",", ".")
     
-    # Stock info
+    # Stock info (reserved items are held by other buyers' checkouts)
     stock = product.get('stock', 0)
+    reserved = product.get('reserved_stock') or 0
+    if product.get('flash_sale') and stock not in (-1, None):
+        # Items in this worker's flash-sale pool are reserved but still for sale
+        pooled = flash_sales.pooled(product['id'])
+        stock += pooled
+        reserved = max(0, reserved - pooled)
     if stock == -1 or stock is None:
         stock_str = "Unlimited"
     elif stock > 0:
         stock_str = f"{stock} tersedia"
+        if reserved:
+            stock_str += f" ({reserved} sedang dipesan)"
+    elif reserved:
+        stock_str = f"⏳ {reserved} sedang dipesan pembeli lain"
     else:
         stock_str = "❌ Stok habis"
     
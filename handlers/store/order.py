@@ -3,24 +3,24 @@ Store Bot - Order Handler.
 Handles purchases, payments, and order history.
 """
 
+import math
 import os
-import uuid
 from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from database_pg import (
+from database_async import (
     get_product_by_id,
     get_bot_user,
-    create_order,
     get_order_by_order_id,
     get_orders_by_user,
-    update_order_status,
-    get_available_stock,
-    mark_stock_sold
+    cancel_pending_order
 )
+from services.flash_sale import flash_sales
 from services.pakasir import PakasirClient
-from utils.qr_generator import generate_qr_image
+from services.payment_status import payment_status, PAID, PENDING, CANCELLED, NOT_FOUND
+from services.purchases import purchases, OutOfStock, ORDER_MAX_QUANTITY
+from services.qr_renderer import qr_renderer
 from utils.keyboard import (
     create_confirm_purchase_keyboard,
     create_payment_keyboard,
@@ -28,27 +28,24 @@ from utils.keyboard import (
 )
 
 
-def generate_order_id() -> str:
-    """Generate unique order ID."""
-    timestamp = datetime.now().strftime("%y%m%d")
-    unique = uuid.uuid4().hex[:6].upper()
-    return f"ORD{timestamp}{unique}"
-
-
 async def show_buy_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show purchase confirmation."""
     query = update.callback_query
     await query.answer()
     
-    # Extract product ID
-    product_id = int(query.data.split("_")[1])
-    product = get_product_by_id(product_id)
+    # Extract product ID and the chosen quantity
+    parts = query.data.split("_")  # buy_<id>[_<quantity>]
+    product_id = int(parts[1])
+    quantity = int(parts[2]) if len(parts) > 2 else 1
+    product = await get_product_by_id(product_id)
     
     if not product:
         await query.edit_message_text("❌ Produk tidak ditemukan.")
         return
     
     stock = product.get('stock', 0)
+    if product.get('flash_sale') and stock == 0:
+        stock = flash_sales.pooled(product['id'])
     if stock == 0:
         await query.edit_message_text(
             "❌ Maaf, stok produk habis.",
@@ -56,13 +53,19 @@ async def show_buy_confirmation(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return
     
+    max_quantity = ORDER_MAX_QUANTITY if stock in (-1, None) else min(ORDER_MAX_QUANTITY, stock)
+    quantity = max(1, min(quantity, max_quantity))
+    
     # Format price
     price_str = f"Rp {product['price']:,}".replace(",", ".")
+    total_str = f"Rp {product['price'] * quantity:,}".replace(",", ".")
     
     text = (
         f"🛒 *Konfirmasi Pembelian*\n\n"
         f"📦 *Produk:* {product['name']}\n"
-        f"💰 *Harga:* {price_str}\n\n"
+        f"💰 *Harga:* {price_str}\n"
+        f"🔢 *Jumlah:* {quantity}\n"
+        f"💵 *Subtotal:* {total_str}\n\n"
         f"_Biaya tambahan dari payment gateway akan ditampilkan saat pembayaran._\n\n"
         f"Lanjutkan pembayaran?"
     )
@@ -70,12 +73,34 @@ async def show_buy_confirmation(update: Update, context: ContextTypes.DEFAULT_TY
     await query.edit_message_text(
         text,
         parse_mode="Markdown",
-        reply_markup=create_confirm_purchase_keyboard(product_id)
+        reply_markup=create_confirm_purchase_keyboard(product_id, quantity, max_quantity)
+    )
+
+
+def payment_caption(order: dict, product_name: str, expired_at: datetime = None) -> str:
+    """Caption of the QRIS payment photo."""
+    amount_str = f"Rp {order['amount']:,}".replace(",", ".")
+    fee_str = f"Rp {order['fee']:,}".replace(",", ".")
+    total_str = f"Rp {order['total']:,}".replace(",", ".")
+    if (order.get('quantity') or 1) > 1:
+        product_name += f" x{order['quantity']}"
+    
+    return (
+        f"💳 *Pembayaran QRIS*\n\n"
+        f"🆔 *Order:* `{order['order_id']}`\n"
+        f"📦 *Produk:* {product_name}\n\n"
+        f"💰 *Harga:* {amount_str}\n"
+        f"📋 *Biaya Admin:* {fee_str}\n"
+        f"━━━━━━━━━━━━━━━\n"
+        f"💵 *Total Bayar:* {total_str}\n\n"
+        f"📱 *Scan QR di bawah dengan aplikasi e-wallet atau mobile banking Anda*\n\n"
+        f"⏰ *Berlaku hingga:* {expired_at.strftime('%H:%M WIB') if expired_at else 'N/A'}\n\n"
+        f"_Setelah pembayaran berhasil, produk akan dikirim otomatis._"
     )
 
 
 async def process_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Process purchase and generate QRIS."""
+    """Process purchase and generate QRIS (or show the buyer's pending one again)."""
     query = update.callback_query
     await query.answer("⏳ Memproses pembayaran...")
     
@@ -83,9 +108,11 @@ async def process_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pakasir_slug = context.bot_data.get('pakasir_slug')
     pakasir_api_key = context.bot_data.get('pakasir_api_key')
     
-    # Extract product ID
-    product_id = int(query.data.split("_")[2])  # confirm_buy_<id>
-    product = get_product_by_id(product_id)
+    # Extract product ID and quantity
+    parts = query.data.split("_")  # confirm_buy_<id>[_<quantity>]
+    product_id = int(parts[2])
+    quantity = max(1, min(int(parts[3]) if len(parts) > 3 else 1, ORDER_MAX_QUANTITY))
+    product = await get_product_by_id(product_id)
     
     if not product:
         await query.edit_message_text("❌ Produk tidak ditemukan.")
@@ -94,31 +121,37 @@ async def process_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Get bot user
     bot_user_id = context.user_data.get('bot_user_id')
     if not bot_user_id:
-        bot_user = get_bot_user(bot_id, update.effective_user.id)
+        bot_user = await get_bot_user(bot_id, update.effective_user.id)
         if not bot_user:
             await query.edit_message_text("❌ User tidak ditemukan. Silakan /start ulang.")
             return
         bot_user_id = bot_user['id']
     
-    # Generate unique order ID
-    order_id = generate_order_id()
-    
     # Show processing message
     await query.edit_message_text(
         "⏳ *Membuat pembayaran QRIS...*\n\nMohon tunggu sebentar.",
         parse_mode="Markdown"
     )
     
-    # Create Pakasir client for this bot
-    pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
-    
-    # Create transaction via Pakasir
-    payment = await pakasir.create_transaction(
-        order_id=order_id,
-        amount=product['price']
-    )
+    # Reuses the buyer's pending order for this product while it is valid
+    try:
+        purchase = await purchases.purchase(
+            bot_id, bot_user_id, product, pakasir_slug, pakasir_api_key, quantity
+        )
+    except OutOfStock:
+        if quantity > 1:
+            await query.edit_message_text(
+                f"❌ Maaf, stok tidak cukup untuk {quantity} item.",
+                reply_markup=create_back_keyboard(f"buy_{product_id}")
+            )
+        else:
+            await query.edit_message_text(
+                "❌ Maaf, stok produk habis.",
+                reply_markup=create_back_keyboard(f"cat_{product['category_id']}")
+            )
+        return
     
-    if not payment:
+    if not purchase:
         await query.edit_message_text(
             "❌ *Gagal membuat pembayaran*\n\n"
             "Terjadi kesalahan saat menghubungi payment gateway. "
@@ -128,119 +161,70 @@ async def process_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Parse expired_at
-    try:
-        expired_at = datetime.fromisoformat(payment.expired_at.replace("Z", "+00:00"))
-    except:
-        expired_at = None
-    
-    # Save order to database
-    order = create_order(
-        bot_id=bot_id,
-        bot_user_id=bot_user_id,
-        product_id=product_id,
-        order_id=order_id,
-        amount=product['price'],
-        fee=payment.fee,
-        total=payment.total_payment,
-        qris_string=payment.payment_number,
-        expired_at=expired_at
-    )
-    
-    # Generate QR code image
-    qr_image = generate_qr_image(payment.payment_number)
+    order = purchase.order
+    caption = purchase.caption or payment_caption(order, product['name'], purchase.expired_at)
     
-    # Format amounts
-    amount_str = f"Rp {product['price']:,}".replace(",", ".")
-    fee_str = f"Rp {payment.fee:,}".replace(",", ".")
-    total_str = f"Rp {payment.total_payment:,}".replace(",", ".")
-    
-    # Create payment message
-    payment_text = (
-        f"💳 *Pembayaran QRIS*\n\n"
-        f"🆔 *Order:* `{order_id}`\n"
-        f"📦 *Produk:* {product['name']}\n\n"
-        f"💰 *Harga:* {amount_str}\n"
-        f"📋 *Biaya Admin:* {fee_str}\n"
-        f"━━━━━━━━━━━━━━━\n"
-        f"💵 *Total Bayar:* {total_str}\n\n"
-        f"📱 *Scan QR di bawah dengan aplikasi e-wallet atau mobile banking Anda*\n\n"
-        f"⏰ *Berlaku hingga:* {expired_at.strftime('%H:%M WIB') if expired_at else 'N/A'}\n\n"
-        f"_Setelah pembayaran berhasil, produk akan dikirim otomatis._"
-    )
+    # Photo sent before for this order, else render QR code image (cached, off the event loop)
+    photo = purchase.photo or await qr_renderer.render(order['qris_string'])
     
     # Delete previous message
     await query.delete_message()
     
     # Send QR code as photo
-    await context.bot.send_photo(
+    message = await context.bot.send_photo(
         chat_id=update.effective_chat.id,
-        photo=qr_image,
-        caption=payment_text,
+        photo=photo,
+        caption=caption,
         parse_mode="Markdown",
-        reply_markup=create_payment_keyboard(order_id)
+        reply_markup=create_payment_keyboard(order['order_id'])
     )
+    if message.photo:
+        purchases.remember(order['order_id'], caption, message.photo[-1].file_id)
 
 
 async def check_payment_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check payment status manually."""
     query = update.callback_query
+    
+    # Extract order ID
+    order_id = query.data.split("_")[1]  # check_<order_id>
+    
+    # Repeated presses within the cooldown only get a notice
+    wait = payment_status.cooldown_remaining(order_id)
+    if wait > 0:
+        await query.answer(f"⏳ Status baru saja diperiksa. Coba lagi dalam {math.ceil(wait)} detik.")
+        return
+    
     await query.answer("🔄 Memeriksa status...")
     
     pakasir_slug = context.bot_data.get('pakasir_slug')
     pakasir_api_key = context.bot_data.get('pakasir_api_key')
     
-    # Extract order ID
-    order_id = query.data.split("_")[1]  # check_<order_id>
-    
-    order = get_order_by_order_id(order_id)
+    result = await payment_status.check(order_id, pakasir_slug, pakasir_api_key)
     
-    if not order:
+    if result == NOT_FOUND:
         await query.message.reply_text("❌ Order tidak ditemukan.")
-        return
-    
-    if order['status'] == "paid":
+    elif result == PAID:
         await query.message.reply_text(
             f"✅ *Pembayaran Sudah Berhasil!*\n\n"
             f"Order `{order_id}` sudah terbayar dan produk sudah dikirim.",
             parse_mode="Markdown"
         )
-        return
-    
-    # Check status from Pakasir
-    pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
-    status = await pakasir.get_transaction_status(order_id, order['amount'])
-    
-    if status and status.status == "completed":
-        # Update order status
-        update_order_status(order_id, "paid", datetime.now())
-        
-        # Get and deliver stock
-        stock_item = get_available_stock(order['product_id'])
-        if stock_item:
-            mark_stock_sold(stock_item['id'], order['id'])
-            
-            await query.message.reply_text(
-                f"✅ *Pembayaran Berhasil!*\n\n"
-                f"Order: `{order_id}`\n\n"
-                f"📦 *Produk Anda:*\n"
-                f"```\n{stock_item['content']}\n```",
-                parse_mode="Markdown"
-            )
-        else:
-            await query.message.reply_text(
-                f"✅ *Pembayaran Berhasil!*\n\n"
-                f"Order: `{order_id}`\n\n"
-                f"⚠️ Mohon hubungi admin untuk pengiriman produk.",
-                parse_mode="Markdown"
-            )
-    else:
+    elif result == PENDING:
         await query.message.reply_text(
             f"⏳ *Pembayaran Belum Diterima*\n\n"
             f"Order `{order_id}` masih menunggu pembayaran.\n"
             f"Silakan scan QRIS dan selesaikan pembayaran.",
             parse_mode="Markdown"
         )
+    elif result == CANCELLED:
+        await query.message.reply_text(
+            f"⚠️ *Order Dibatalkan*\n\n"
+            f"Order `{order_id}` sudah dibatalkan.\n"
+            f"Jika Anda sudah membayar, mohon hubungi admin.",
+            parse_mode="Markdown"
+        )
+    # FULFILLED: the delivery queue sends the product
 
 
 async def cancel_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -254,7 +238,7 @@ async def cancel_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Extract order ID
     order_id = query.data.split("_")[1]  # cancel_<order_id>
     
-    order = get_order_by_order_id(order_id)
+    order = await get_order_by_order_id(order_id)
     
     if not order:
         await query.message.reply_text("❌ Order tidak ditemukan.")
@@ -271,8 +255,13 @@ async def cancel_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
     await pakasir.cancel_transaction(order_id, order['amount'])
     
-    # Update local status
-    update_order_status(order_id, "cancelled")
+    # Update local status and release the reserved stock
+    if not await cancel_pending_order(order_id):
+        await query.message.reply_text(
+            f"⚠️ Order `{order_id}` tidak dapat dibatalkan.",
+            parse_mode="Markdown"
+        )
+        return
     
     await query.message.reply_text(
         f"✅ *Order Dibatalkan*\n\n"
@@ -291,7 +280,7 @@ async def show_my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bot_user_id = context.user_data.get('bot_user_id')
     
     if not bot_user_id:
-        bot_user = get_bot_user(bot_id, update.effective_user.id)
+        bot_user = await get_bot_user(bot_id, update.effective_user.id)
         if not bot_user:
             await query.edit_message_text(
                 "❌ User tidak ditemukan. Silakan /start.",
@@ -300,7 +289,7 @@ async def show_my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         bot_user_id = bot_user['id']
     
-    orders = get_orders_by_user(bot_id, bot_user_id)
+    orders = await get_orders_by_user(bot_id, bot_user_id)
     
     if not orders:
         await query.edit_message_text(
@@ -324,6 +313,8 @@ async def show_my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         amount_str = f"Rp {order['amount']:,}".replace(",", ".")
         date_str = order['created_at'].strftime("%d/%m/%Y") if order.get('created_at') else "N/A"
         product_name = order.get('product_name', 'Unknown')
+        if (order.get('quantity') or 1) > 1:
+            product_name += f" x{order['quantity']}"
         
         text += f"{emoji} `{order['order_id']}`\n"
         text += f"   📦 {product_name}\n"
@@ -7,7 +7,7 @@ import os
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from database_pg import get_or_create_bot_user
+from database_async import get_or_create_bot_user
 from utils.keyboard import create_menu_keyboard, create_admin_menu_keyboard
 
 # Owner Telegram ID for admin access
@@ -25,7 +25,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bot_id = context.bot_data.get('bot_id')
     
     # Get or create bot user in database
-    bot_user = get_or_create_bot_user(
+    bot_user = await get_or_create_bot_user(
         bot_id=bot_id,
         telegram_id=user.id,
         username=user.username,
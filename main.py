@@ -35,6 +35,12 @@ def main():
     if not owner_id:
         print("⚠️ OWNER_TELEGRAM_ID not set - admin features will be disabled")
     
+    # Spread bots over several worker processes
+    from bot_supervisor import BOT_WORKERS, Supervisor
+    if BOT_WORKERS > 0:
+        Supervisor(BOT_WORKERS).run()
+        return
+    
     # Run the bot manager
     manager = BotManager()
     
@@ -0,0 +1,128 @@
+"""
+Handler Latency Benchmark
+
+Simulates many bots sharing one event loop, each serving concurrent users
+that browse a product (the query behind show_product_detail), and reports
+handler latency percentiles for the blocking psycopg2 layer versus the
+asyncpg layer.
+
+Usage:
+    python bench_handler_latency.py --bots 50 --users 10 --duration 20
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import database_pg
+import database_async
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def sync_handler(product_id: int):
+    """Handler body as it was: blocking psycopg2 call inside async def."""
+    database_pg.get_product_by_id(product_id)
+    await asyncio.sleep(0.005)  # reply to Telegram
+
+
+async def async_handler(product_id: int):
+    """Handler body awaiting the asyncpg layer."""
+    await database_async.get_product_by_id(product_id)
+    await asyncio.sleep(0.005)  # reply to Telegram
+
+
+async def run_mode(handler, product_id: int, bots: int, users: int, duration: float) -> list[float]:
+    """Run `bots * users` concurrent clients and collect per-call latency in ms."""
+    latencies: list[float] = []
+    deadline = time.monotonic() + duration
+
+    async def client(bot_id: int):
+        database_pg.current_bot_id.set(bot_id)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            await handler(product_id)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*[
+        client(bot_id)
+        for bot_id in range(bots)
+        for _ in range(users)
+    ])
+    return latencies
+
+
+async def measure_loop_lag(stop: asyncio.Event) -> list[float]:
+    """Measure how late a 10 ms timer fires while handlers run."""
+    lags = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(max(0.0, (time.perf_counter() - started) * 1000 - 10))
+    return lags
+
+
+async def bench(args):
+    product_id = args.product_id
+    if product_id is None:
+        row = await database_async._fetchrow("SELECT id FROM products ORDER BY id LIMIT 1")
+        if not row:
+            print("❌ No products found. Pass --product-id or create a product first.")
+            return
+        product_id = row['id']
+
+    # Warm both pools so connection setup is not measured
+    database_pg.get_pool().warm()
+    await database_async.get_pool()
+
+    print("=" * 60)
+    print(f"📊 Handler latency: {args.bots} bots x {args.users} users, {args.duration}s per mode")
+    print("=" * 60)
+    print(f"{'mode':<8}{'calls':>9}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'lag p99':>10}")
+
+    for name, handler in (("sync", sync_handler), ("async", async_handler)):
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_loop_lag(stop))
+        latencies = await run_mode(handler, product_id, args.bots, args.users, args.duration)
+        stop.set()
+        lags = await lag_task
+
+        print(
+            f"{name:<8}{len(latencies):>9}{len(latencies) / args.duration:>9.0f}"
+            f"{statistics.median(latencies):>10.1f}{percentile(latencies, 95):>10.1f}"
+            f"{percentile(latencies, 99):>10.1f}{percentile(lags, 99):>10.1f}"
+        )
+
+    await database_async.close_pool()
+    database_pg.close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark store handler latency under concurrent load")
+    parser.add_argument("--bots", type=int, default=50)
+    parser.add_argument("--users", type=int, default=10, help="concurrent users per bot")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per mode")
+    parser.add_argument("--product-id", type=int, default=None)
+    args = parser.parse_args()
+
+    if not database_pg.DATABASE_URL:
+        print("❌ DATABASE_URL not set")
+        return
+
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
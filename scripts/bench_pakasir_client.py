@@ -0,0 +1,157 @@
+"""
+Pakasir Client Benchmark
+
+Runs the shared Pakasir client against scripts/fake_pakasir.py:
+
+1. Throughput and latency of create + detail calls, comparing a fresh
+   aiohttp session per call (the old behaviour) with the pooled client
+2. An upstream outage, checking that retries stay bounded, the circuit
+   opens and fails fast, and closes again once Pakasir recovers
+
+Usage:
+    python bench_pakasir_client.py --calls 2000 --concurrency 100 --latency 50
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, ".."))
+sys.path.insert(0, SCRIPTS_DIR)
+
+FAKE_PORT = 18090
+
+# Must be set before services.pakasir reads them
+os.environ["PAKASIR_API_BASE_URL"] = f"http://127.0.0.1:{FAKE_PORT}/api"
+os.environ.setdefault("PAKASIR_BREAKER_RESET", "2")
+os.environ.setdefault("PAKASIR_RETRY_BASE", "0.05")
+
+import aiohttp
+
+from fake_pakasir import FakePakasir
+from services.pakasir import PakasirClient, PakasirHTTP, PAKASIR_API_BASE_URL
+
+
+async def legacy_flow(order_id: str, amount: int):
+    """create + detail, each on its own session, as before."""
+    payload = {"project": "bench", "order_id": order_id, "amount": amount, "api_key": "k"}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{PAKASIR_API_BASE_URL}/transactioncreate/qris", json=payload) as r:
+            await r.json()
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{PAKASIR_API_BASE_URL}/transactiondetail", params=payload) as r:
+            await r.json()
+
+
+async def pooled_flow(client: PakasirClient, order_id: str, amount: int):
+    await client.create_transaction(order_id, amount)
+    await client.get_transaction_status(order_id, amount)
+
+
+async def run_flows(name: str, flow, calls: int, concurrency: int) -> list[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(n: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await flow(f"{name.upper()}{n:07d}", 10000 + n)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(n) for n in range(calls)])
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    print(
+        f"{name:<8}{calls / elapsed:>10.0f}{statistics.median(ordered):>10.1f}"
+        f"{ordered[int(len(ordered) * 0.95)]:>10.1f}{ordered[int(len(ordered) * 0.99)]:>10.1f}"
+    )
+    return latencies
+
+
+async def check_outage(fake: FakePakasir, http: PakasirHTTP) -> bool:
+    """Drive the client through an outage and a recovery."""
+    client = PakasirClient("bench", "k", http=http)
+    ok = True
+
+    fake.fail_rate = 1.0
+    before = sum(fake.calls.values())
+    results = [await client.get_transaction_status("NOPE", 1) for _ in range(20)]
+    upstream_calls = sum(fake.calls.values()) - before
+    state = http.breaker.state
+
+    print(f"   outage: 20 status checks -> {upstream_calls} upstream calls, circuit {state}")
+    if any(results):
+        print("   ❌ expected every call to fail during the outage")
+        ok = False
+    if state != "open":
+        print("   ❌ circuit did not open")
+        ok = False
+    if upstream_calls > http.breaker.threshold + 2:
+        print("   ❌ open circuit still sent calls upstream")
+        ok = False
+
+    fake.fail_rate = 0.0
+    await asyncio.sleep(http.breaker.reset_after + 0.1)
+    payment = await client.create_transaction("RECOVER0001", 5000)
+    state = http.breaker.state
+    print(f"   recovery: create {'succeeded' if payment else 'failed'}, circuit {state}")
+    if not payment or state != "closed":
+        print("   ❌ circuit did not close after recovery")
+        ok = False
+
+    return ok
+
+
+async def bench(args):
+    fake = FakePakasir(latency_ms=args.latency, jitter_ms=args.jitter)
+    runner = await fake.start(port=FAKE_PORT)
+
+    print("=" * 60)
+    print(f"📊 Pakasir client: {args.calls} create+detail flows, concurrency {args.concurrency}")
+    print("=" * 60)
+    print(f"{'client':<8}{'flows/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+    await run_flows("legacy", legacy_flow, args.calls, args.concurrency)
+
+    http = PakasirHTTP()
+    client = PakasirClient("bench", "k", http=http)
+    await run_flows("pooled", lambda o, a: pooled_flow(client, o, a), args.calls, args.concurrency)
+
+    print("\nPer-endpoint histograms (pooled):")
+    for endpoint, snapshot in http.stats()["endpoints"].items():
+        print(
+            f"   {endpoint:<18} n={snapshot['count']:<7} avg={snapshot['avg_ms']}ms "
+            f"p50≤{snapshot['p50_ms']}ms p99≤{snapshot['p99_ms']}ms errors={snapshot['errors']}"
+        )
+
+    print("\nOutage handling:")
+    outage_http = PakasirHTTP()
+    ok = await check_outage(fake, outage_http)
+
+    await http.close()
+    await outage_http.close()
+    await runner.cleanup()
+
+    print("\n✅ Client behaved as expected" if ok else "\n❌ Client checks failed")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pooled Pakasir client against a fake server")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=50.0, help="fake server latency in ms")
+    parser.add_argument("--jitter", type=float, default=20.0)
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(bench(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
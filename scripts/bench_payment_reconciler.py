@@ -0,0 +1,233 @@
+"""
+Payment Reconciler Benchmark
+
+Runs services/payment_reconciler.py against scripts/fake_pakasir.py with
+thousands of pending orders spread over many bots, some of which get paid
+at random times. The orders table is simulated in memory, so no database
+is needed. Halfway through, the reconciler is stopped and a fresh one
+started to check that nothing is lost or delivered twice across a restart.
+
+Reports status-check throughput, payment-to-delivery latency and calls per
+order, and fails if any paid order is missed, an unpaid one is delivered,
+or a bot exceeds its rate limit.
+
+Usage:
+    python bench_payment_reconciler.py --orders 10000 --bots 200 --pay-window 60
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, ".."))
+sys.path.insert(0, SCRIPTS_DIR)
+
+FAKE_PORT = 18091
+ORDER_LIFETIME = 15 * 60
+
+
+class FakeOrders:
+    """The orders table, as far as the reconciler sees it."""
+
+    def __init__(self):
+        self.orders: dict[str, dict] = {}
+        self.paid_at: dict[str, float] = {}
+        self.delivered_at: dict[str, float] = {}
+        self.fulfill_calls = Counter()
+
+    async def load_pending(self, bot_ids: list[int]) -> list[dict]:
+        now = time.time()
+        wanted = set(bot_ids)
+        return [
+            {
+                "order_id": order_id,
+                "bot_id": order["bot_id"],
+                "amount": order["amount"],
+                "age": now - order["created"],
+                "expires_in": order["created"] + ORDER_LIFETIME - now,
+            }
+            for order_id, order in self.orders.items()
+            if order["status"] == "pending" and order["bot_id"] in wanted
+        ]
+
+    async def fulfill(self, order_id: str, paid_at) -> str:
+        self.fulfill_calls[order_id] += 1
+        order = self.orders[order_id]
+        if order["status"] != "pending":
+            # The conditional pending -> paid update in complete_order
+            return "already_paid"
+        order["status"] = "paid"
+        self.delivered_at[order_id] = time.monotonic()
+        return "delivered"
+
+
+async def bench(args):
+    # Must be set before services.pakasir / services.payment_reconciler read them
+    os.environ["PAKASIR_API_BASE_URL"] = f"http://127.0.0.1:{FAKE_PORT}/api"
+    os.environ["RECONCILER_FIRST_CHECK"] = str(args.first_check)
+    os.environ["RECONCILER_MAX_INTERVAL"] = str(args.max_interval)
+    os.environ["RECONCILER_BOT_RATE"] = str(args.bot_rate)
+    os.environ["RECONCILER_CONCURRENCY"] = str(args.concurrency)
+    os.environ["RECONCILER_SYNC_INTERVAL"] = str(args.sync_interval)
+    os.environ.setdefault("DATABASE_URL", "postgresql://bench@127.0.0.1/bench")
+
+    from fake_pakasir import FakePakasir
+    from services.pakasir import PakasirClient, close_pakasir_session
+    from services.payment_reconciler import PaymentReconciler, RECONCILER_BOT_BURST
+
+    fake = FakePakasir(latency_ms=args.latency, jitter_ms=args.jitter, fail_rate=args.fail_rate)
+    runner = await fake.start(port=FAKE_PORT)
+
+    db = FakeOrders()
+    now = time.time()
+    for n in range(args.orders):
+        order_id = f"REC{n:07d}"
+        bot_id = n % args.bots
+        db.orders[order_id] = {"bot_id": bot_id, "amount": 10000 + n, "status": "pending", "created": now}
+        fake.transactions[order_id] = {
+            "project": f"bench{bot_id}", "order_id": order_id, "amount": 10000 + n, "fee": 70,
+            "payment_method": "qris", "status": "pending", "created": now, "completed_at": None,
+        }
+
+    manager = SimpleNamespace(bots={
+        bot_id: SimpleNamespace(bot_type="store", pakasir_slug=f"bench{bot_id}", pakasir_api_key="k")
+        for bot_id in range(args.bots)
+    })
+
+    calls_per_bot: dict[int, list[float]] = {bot_id: [] for bot_id in range(args.bots)}
+
+    async def check_status(instance, order_id: str, amount: int):
+        calls_per_bot[int(instance.pakasir_slug[5:])].append(time.monotonic())
+        client = PakasirClient(instance.pakasir_slug, instance.pakasir_api_key)
+        return await client.get_transaction_status(order_id, amount)
+
+    def new_reconciler() -> PaymentReconciler:
+        return PaymentReconciler(manager, load_pending=db.load_pending, check_status=check_status, fulfill=db.fulfill)
+
+    to_pay = random.sample(sorted(db.orders), int(args.orders * args.paid_ratio))
+    pay_times = {order_id: random.uniform(0, args.pay_window) for order_id in to_pay}
+
+    async def pay():
+        for order_id in sorted(pay_times, key=pay_times.get):
+            delay = started + pay_times[order_id] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            fake.complete(order_id)
+            db.paid_at[order_id] = time.monotonic()
+
+    print("=" * 66)
+    print(
+        f"📊 Payment reconciler: {args.orders} pending orders, {args.bots} bots, "
+        f"{len(to_pay)} paid within {args.pay_window:.0f}s"
+    )
+    print("=" * 66)
+
+    started = time.monotonic()
+    reconciler = new_reconciler()
+    await reconciler.start()
+    payer = asyncio.create_task(pay())
+    restarted = False
+    checks_before_restart = 0
+
+    while time.monotonic() - started < args.timeout:
+        await asyncio.sleep(1)
+        elapsed = time.monotonic() - started
+        if not restarted and args.restart_at and elapsed >= args.restart_at:
+            checks_before_restart = reconciler.stats()["checks"]
+            await reconciler.stop()
+            reconciler = new_reconciler()
+            await reconciler.start()
+            restarted = True
+            print(f"   ↻ reconciler restarted at {elapsed:.0f}s")
+        if payer.done() and len(db.delivered_at) >= len(to_pay):
+            break
+
+    elapsed = time.monotonic() - started
+    stats = reconciler.stats()
+    await reconciler.stop()
+    payer.cancel()
+    await asyncio.gather(payer, return_exceptions=True)
+    await close_pakasir_session()
+    await runner.cleanup()
+
+    checks = checks_before_restart + stats["checks"]
+    latencies = sorted(db.delivered_at[o] - db.paid_at[o] for o in db.delivered_at if o in db.paid_at)
+    duplicates = sum(1 for count in db.fulfill_calls.values() if count > 1)
+
+    # Busiest one-second window of any bot
+    peak = 0
+    for stamps in calls_per_bot.values():
+        stamps.sort()
+        left = 0
+        for right, stamp in enumerate(stamps):
+            while stamp - stamps[left] >= 1.0:
+                left += 1
+            peak = max(peak, right - left + 1)
+
+    # What a fixed poll every --first-check seconds would have cost
+    naive_calls = sum(
+        ((db.paid_at.get(o, started + elapsed) - started) // args.first_check) + 1 for o in db.orders
+    )
+
+    print(f"\n   elapsed               {elapsed:>10.1f} s")
+    print(f"   status checks         {checks:>10}  ({checks / elapsed:.0f}/s, {stats['errors']} errors after restart)")
+    print(f"   fixed {args.first_check:.0f}s polling      {int(naive_calls):>10}  (estimate)")
+    print(f"   checks per order      {checks / args.orders:>10.2f}")
+    print(f"   delivered             {len(db.delivered_at):>10} / {len(to_pay)}")
+    if latencies:
+        print(
+            f"   paid -> delivered     p50 {statistics.median(latencies):.1f}s  "
+            f"p95 {latencies[int(len(latencies) * 0.95)]:.1f}s  "
+            f"p99 {latencies[int(len(latencies) * 0.99)]:.1f}s  max {latencies[-1]:.1f}s"
+        )
+    print(f"   peak calls/s per bot  {peak:>10}  (limit {args.bot_rate:.0f}/s, burst {RECONCILER_BOT_BURST})")
+    print(f"   still tracked         {stats['tracked']:>10}")
+
+    ok = True
+    missing = set(to_pay) - set(db.delivered_at)
+    if missing:
+        print(f"   ❌ {len(missing)} paid order(s) not delivered")
+        ok = False
+    unpaid_delivered = set(db.delivered_at) - set(to_pay)
+    if unpaid_delivered:
+        print(f"   ❌ {len(unpaid_delivered)} unpaid order(s) delivered")
+        ok = False
+    if peak > args.bot_rate + RECONCILER_BOT_BURST:
+        print("   ❌ a bot exceeded its rate limit")
+        ok = False
+
+    print(f"\n   {duplicates} order(s) were fulfilled more than once and rejected as already paid")
+    print("\n✅ Every paid order delivered exactly once" if ok else "\n❌ Reconciler checks failed")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the payment reconciler against a fake Pakasir")
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--bots", type=int, default=200)
+    parser.add_argument("--paid-ratio", type=float, default=0.6)
+    parser.add_argument("--pay-window", type=float, default=60.0, help="payments land within this many seconds")
+    parser.add_argument("--restart-at", type=float, default=30.0, help="restart the reconciler after N seconds (0 = never)")
+    parser.add_argument("--timeout", type=float, default=180.0)
+    parser.add_argument("--first-check", type=float, default=2.0)
+    parser.add_argument("--max-interval", type=float, default=20.0)
+    parser.add_argument("--bot-rate", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sync-interval", type=float, default=30.0)
+    parser.add_argument("--latency", type=float, default=20.0, help="fake Pakasir latency in ms")
+    parser.add_argument("--jitter", type=float, default=20.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(bench(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+QR Render Benchmark
+
+Times the two QR rendering paths on a QRIS-sized payload:
+
+- resample: generate_qr_image (box_size 10, LANCZOS resize, PNG encode)
+- direct:   render_qr_png (whole-pixel module scale, no resample)
+
+then measures how long the event loop stalls while purchases render QR
+codes inline versus through the cached QRRenderer process pool.
+
+Usage:
+    python bench_qr_render.py --iterations 200
+    python bench_qr_render.py --purchases 100 --repeat 3 --workers 2
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.qr_generator import generate_qr_image, render_qr_png
+from services.qr_renderer import QRRenderer
+
+
+def qris_payload() -> str:
+    """A QRIS-like string of realistic length, unique per call."""
+    return (
+        "00020101021226610016ID.CO.PAKASIR.WWW011893600914" + uuid.uuid4().hex[:20].upper()
+        + "0215ID10243456789010303UMI51440014ID.CO.QRIS.WWW0215ID2024345678901"
+        + "0303UMI5204481253033605405150005802ID5913BOTSTORE TEST6007JAKARTA61051234562070703A01"
+        + "6304ABCD"
+    )
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def bench_path(name: str, render, payloads: list[str], size: int):
+    timings = []
+    nbytes = 0
+    for payload in payloads:
+        started = time.perf_counter()
+        out = render(payload, size)
+        timings.append((time.perf_counter() - started) * 1000)
+        nbytes += len(out.getvalue() if hasattr(out, "getvalue") else out)
+    print(f"   {name:<9} mean {statistics.mean(timings):6.2f} ms  p50 {percentile(timings, 50):6.2f} ms  "
+          f"p99 {percentile(timings, 99):6.2f} ms  avg PNG {nbytes / len(payloads) / 1024:5.1f} KB")
+
+
+async def loop_lag(render, payloads: list[str]) -> tuple[float, float]:
+    """Render all payloads concurrently; returns (elapsed s, worst event loop stall ms)."""
+    worst = 0.0
+    done = False
+
+    async def probe():
+        nonlocal worst
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            worst = max(worst, (time.perf_counter() - started) * 1000 - 1)
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await asyncio.gather(*[render(payload) for payload in payloads])
+    elapsed = time.perf_counter() - started
+    done = True
+    await probe_task
+    return elapsed, worst
+
+
+async def bench_loop(purchases: int, repeat: int, workers: int, size: int):
+    payloads = [qris_payload() for _ in range(purchases)] * repeat
+
+    async def inline(payload):
+        generate_qr_image(payload, size)
+
+    renderer = QRRenderer(workers=workers)
+    # Start the pool before timing
+    await renderer.render(qris_payload(), size)
+
+    async def pooled(payload):
+        await renderer.render(payload, size)
+
+    try:
+        for name, render in (("inline", inline), ("pooled", pooled)):
+            elapsed, worst = await loop_lag(render, payloads)
+            print(f"   {name:<9} {len(payloads)} renders in {elapsed:6.2f}s  worst loop stall {worst:7.1f} ms")
+        print(f"   cache     {renderer.stats()}")
+    finally:
+        renderer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark QRIS QR rendering")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--size", type=int, default=300)
+    parser.add_argument("--purchases", type=int, default=100, help="Distinct QRIS strings for the loop test")
+    parser.add_argument("--repeat", type=int, default=3, help="Views per QRIS string (retries, re-opens)")
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    payloads = [qris_payload() for _ in range(args.iterations)]
+    print(f"🔄 {args.iterations} renders at {args.size}px, payload {len(payloads[0])} chars")
+    bench_path("resample", generate_qr_image, payloads, args.size)
+    bench_path("direct", render_qr_png, payloads, args.size)
+
+    print(f"🔄 Event loop: {args.purchases} purchases x {args.repeat} views, {args.workers} render process(es)")
+    asyncio.run(bench_loop(args.purchases, args.repeat, args.workers, args.size))
+
+
+if __name__ == "__main__":
+    main()
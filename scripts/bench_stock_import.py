@@ -0,0 +1,128 @@
+"""
+Stock Import Benchmark
+
+Adds the same stock upload to throwaway products three ways and reports
+rows/s and peak Python memory for each:
+
+- loop:   one INSERT per line, as add_stock_items / add_product_stock did
+- copy:   database_pg.add_stock_items (COPY of an in-memory list)
+- stream: the API's import_product_stock reading a file line by line,
+          as POST /products/<id>/stock/import does
+
+A share of the lines are duplicates; copy and stream must add only the
+distinct ones, loop adds everything.
+
+Usage:
+    python bench_stock_import.py --lines 50000 --duplicates 0.1
+    python bench_stock_import.py --lines 1000000 --modes stream
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import database_pg
+import database as api_database
+
+
+def write_upload(path: str, lines: int, duplicates: float) -> int:
+    """Write `lines` stock lines to `path`; returns how many are distinct."""
+    distinct = max(1, int(lines * (1 - duplicates)))
+    with open(path, "w") as f:
+        for i in range(lines):
+            n = i if i < distinct else random.randrange(distinct)
+            f.write(f"user{n}@example.com|pass-{n:08d}|note\n")
+    return distinct
+
+
+def import_loop(product_id: int, path: str) -> int:
+    with open(path) as f:
+        contents = f.read().splitlines()
+    with database_pg.get_cursor() as cursor:
+        for content in contents:
+            cursor.execute("""
+                INSERT INTO product_stock (product_id, content)
+                VALUES (%s, %s)
+            """, (product_id, content.strip()))
+    return len(contents)
+
+
+def import_copy(product_id: int, path: str) -> int:
+    with open(path) as f:
+        return database_pg.add_stock_items(product_id, f.read().splitlines())
+
+
+def import_stream(product_id: int, path: str) -> int:
+    with open(path, "rb") as f:
+        return api_database.import_product_stock(product_id, f)["added"]
+
+
+MODES = {"loop": import_loop, "copy": import_copy, "stream": import_stream}
+
+
+def count_stock(product_id: int) -> int:
+    with database_pg.get_cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) AS n FROM product_stock WHERE product_id = %s", (product_id,))
+        return cursor.fetchone()['n']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk stock import")
+    parser.add_argument("--lines", type=int, default=50000)
+    parser.add_argument("--duplicates", type=float, default=0.1, help="Share of duplicate lines")
+    parser.add_argument("--modes", default="loop,copy,stream")
+    args = parser.parse_args()
+
+    if not database_pg.DATABASE_URL:
+        print("❌ DATABASE_URL not set")
+        sys.exit(1)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        print(f"❌ Unknown mode(s): {', '.join(unknown)}")
+        sys.exit(1)
+
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    distinct = write_upload(path, args.lines, args.duplicates)
+    print(f"🔄 {args.lines} lines ({distinct} distinct, {os.path.getsize(path) / 1e6:.1f} MB)")
+
+    ok = True
+    try:
+        for mode in modes:
+            product = database_pg.create_product(None, None, f"bench-stock-import-{mode}", 1, "temporary")
+            try:
+                tracemalloc.start()
+                started = time.perf_counter()
+                added = MODES[mode](product['id'], path)
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                expected = args.lines if mode == "loop" else distinct
+                stored = count_stock(product['id'])
+                print(f"   {mode:<6} {elapsed:8.2f}s  {args.lines / elapsed:10.0f} lines/s  "
+                      f"peak {peak / 1e6:7.1f} MB  added {added}")
+                if added != expected or stored != expected:
+                    print(f"❌ {mode}: expected {expected} rows, reported {added}, stored {stored}")
+                    ok = False
+            finally:
+                database_pg.delete_product(product['id'])
+    finally:
+        os.remove(path)
+        database_pg.close_pool()
+
+    print("✅ Imports match" if ok else "❌ Import counts differ")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
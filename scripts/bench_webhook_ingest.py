@@ -0,0 +1,239 @@
+"""
+Update Ingestion Benchmark
+
+Starts a local fake Telegram Bot API server and many bot Applications
+pointed at it, then pushes updates through either per-bot getUpdates
+polling or the shared webhook listener (webhook/telegram.py) and reports
+updates/sec and delivery latency.
+
+No real Telegram traffic and no database are involved.
+
+Usage:
+    python bench_webhook_ingest.py --mode webhook --bots 200 --updates 20000
+    python bench_webhook_ingest.py --mode polling --bots 200 --updates 20000
+    python bench_webhook_ingest.py --mode both --reply
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+from aiohttp import web, ClientSession, TCPConnector
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from webhook.telegram import TelegramWebhookServer, webhook_secret, SECRET_HEADER
+
+FAKE_API_PORT = 18081
+WEBHOOK_PORT = 18082
+
+
+class FakeTelegram:
+    """Just enough of the Bot API for Application startup, polling, webhooks and replies."""
+
+    def __init__(self):
+        self.pending: dict[str, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.webhooks: dict[str, tuple[str, str]] = {}
+        self.sent = 0
+        self._message_id = 0
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self._handle)
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        token = request.match_info["token"]
+        method = request.match_info["method"].lower()
+        params = await self._params(request)
+
+        if method == "getme":
+            bot_id = int(token.split(":")[0])
+            result = {"id": bot_id, "is_bot": True, "first_name": f"Bench {bot_id}", "username": f"bench_{bot_id}_bot"}
+        elif method == "setwebhook":
+            self.webhooks[token] = (params["url"], params.get("secret_token", ""))
+            result = True
+        elif method == "deletewebhook":
+            self.webhooks.pop(token, None)
+            result = True
+        elif method == "getupdates":
+            result = await self._get_updates(token, float(params.get("timeout", 0)))
+        elif method == "sendmessage":
+            self.sent += 1
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, token: str, timeout: float) -> list:
+        queue = self.pending[token]
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout=max(timeout, 0.01)))
+        except asyncio.TimeoutError:
+            return batch
+        while not queue.empty() and len(batch) < 100:
+            batch.append(queue.get_nowait())
+        return batch
+
+
+def make_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "text": f"ping {time.perf_counter()}",
+        },
+    }
+
+
+async def run_mode(mode: str, args) -> dict:
+    fake = FakeTelegram()
+    fake_runner = web.AppRunner(fake.app, access_log=None)
+    await fake_runner.setup()
+    await web.TCPSite(fake_runner, "127.0.0.1", FAKE_API_PORT).start()
+
+    server = None
+    if mode == "webhook":
+        server = TelegramWebhookServer(
+            base_url=f"http://127.0.0.1:{WEBHOOK_PORT}", host="127.0.0.1", port=WEBHOOK_PORT
+        )
+        await server.start()
+
+    processed = 0
+    latencies: list[float] = []
+    done = asyncio.Event()
+
+    async def on_update(update: Update, context):
+        nonlocal processed
+        sent_at = float(update.message.text.split()[1])
+        latencies.append((time.perf_counter() - sent_at) * 1000)
+        if args.reply:
+            await update.message.reply_text("pong")
+        processed += 1
+        if processed >= args.updates:
+            done.set()
+
+    bots = []
+    for i in range(args.bots):
+        bot_id = 1000 + i
+        token = f"{bot_id}:bench-token-{i}"
+        app = (
+            Application.builder()
+            .token(token)
+            .base_url(f"http://127.0.0.1:{FAKE_API_PORT}/bot")
+            .build()
+        )
+        app.add_handler(TypeHandler(Update, on_update))
+        await app.initialize()
+        await app.start()
+        if mode == "webhook":
+            await server.register(bot_id, app, webhook_secret(bot_id, token))
+        else:
+            await app.updater.start_polling(poll_interval=0.0, timeout=10)
+        bots.append((bot_id, token, app))
+
+    started = time.perf_counter()
+
+    if mode == "webhook":
+        semaphore = asyncio.Semaphore(args.concurrency)
+        async with ClientSession(connector=TCPConnector(limit=args.concurrency)) as session:
+            async def post(n: int):
+                bot_id, token, _ = bots[n % len(bots)]
+                url, secret = fake.webhooks[token]
+                async with semaphore:
+                    async with session.post(
+                        url, json=make_update(n + 1, 5000 + n % 997), headers={SECRET_HEADER: secret}
+                    ) as response:
+                        response.raise_for_status()
+
+            await asyncio.gather(*[post(n) for n in range(args.updates)])
+    else:
+        for n in range(args.updates):
+            _, token, _ = bots[n % len(bots)]
+            fake.pending[token].put_nowait(make_update(n + 1, 5000 + n % 997))
+
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        print(f"⚠️ {mode}: only {processed}/{args.updates} updates processed before timeout")
+    elapsed = time.perf_counter() - started
+
+    for bot_id, _, app in bots:
+        if server is not None:
+            await server.unregister(bot_id)
+        elif app.updater.running:
+            await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+    if server is not None:
+        await server.stop()
+    await fake_runner.cleanup()
+
+    ordered = sorted(latencies) or [0.0]
+    return {
+        "mode": mode,
+        "processed": processed,
+        "rate": processed / elapsed,
+        "p50": statistics.median(ordered),
+        "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        "replies": fake.sent,
+    }
+
+
+async def bench(args):
+    modes = ["polling", "webhook"] if args.mode == "both" else [args.mode]
+
+    print("=" * 60)
+    print(f"📊 Update ingestion: {args.bots} bots, {args.updates} updates, reply={args.reply}")
+    print("=" * 60)
+    print(f"{'mode':<10}{'processed':>11}{'upd/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'replies':>9}")
+
+    for mode in modes:
+        r = await run_mode(mode, args)
+        print(
+            f"{r['mode']:<10}{r['processed']:>11}{r['rate']:>10.0f}"
+            f"{r['p50']:>10.1f}{r['p99']:>10.1f}{r['replies']:>9}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Telegram update ingestion against a fake Bot API")
+    parser.add_argument("--mode", choices=["webhook", "polling", "both"], default="both")
+    parser.add_argument("--bots", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=200, help="concurrent webhook POSTs")
+    parser.add_argument("--reply", action="store_true", help="reply to every update via sendMessage")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
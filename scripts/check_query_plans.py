@@ -0,0 +1,234 @@
+"""
+Query Plan Regression Check
+
+Seeds a multi-tenant dataset inside a transaction, runs EXPLAIN on the hot
+store queries from database_pg.py, database_async.py and api/database.py,
+and fails if any of them falls back to a sequential scan on a store table.
+Everything is rolled back at the end, including the ANALYZE statistics.
+
+Run after scripts/update_schema.py (it checks the indexes it creates).
+
+Usage:
+    python check_query_plans.py
+    python check_query_plans.py --bots 100 --products 30 --stock 300
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Tables that must never be sequentially scanned by the hot queries
+HOT_TABLES = {"product_stock", "orders", "products", "categories", "bot_users"}
+
+# (label, query) - parameters are filled from the seeded IDs
+HOT_QUERIES = [
+    ("database_pg.get_categories_by_bot", """
+        SELECT * FROM categories WHERE bot_id = %(bot_id)s AND is_active = true
+        ORDER BY sort_order, name
+    """),
+    ("database_pg.get_products_by_bot", """
+        SELECT p.*, c.name as category_name, p.available_stock as stock
+        FROM products p
+        LEFT JOIN categories c ON p.category_id = c.id
+        WHERE p.bot_id = %(bot_id)s AND p.is_active = true
+        ORDER BY p.name
+    """),
+    ("database_pg.get_products_by_category", """
+        SELECT p.*, p.available_stock as stock
+        FROM products p
+        WHERE p.category_id = %(category_id)s AND p.bot_id = %(bot_id)s AND p.is_active = true
+        ORDER BY p.name
+    """),
+    ("database_async.complete_order (free stock)", """
+        SELECT id FROM product_stock
+        WHERE product_id = %(product_id)s AND is_sold = false AND reserved_for IS NULL
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    """),
+    ("database_pg.get_orders_by_bot", """
+        SELECT o.*, p.name as product_name, bu.username, bu.first_name
+        FROM orders o
+        LEFT JOIN products p ON o.product_id = p.id
+        LEFT JOIN bot_users bu ON o.bot_user_id = bu.id
+        WHERE o.bot_id = %(bot_id)s
+        ORDER BY o.created_at DESC
+        LIMIT 50
+    """),
+    ("database_pg.get_orders_by_user", """
+        SELECT o.*, p.name as product_name
+        FROM orders o
+        LEFT JOIN products p ON o.product_id = p.id
+        WHERE o.bot_id = %(bot_id)s AND o.bot_user_id = %(bot_user_id)s
+        ORDER BY o.created_at DESC
+        LIMIT 10
+    """),
+    ("database_pg.get_bot_stats", """
+        SELECT
+            (SELECT COUNT(*) FROM products WHERE bot_id = %(bot_id)s) as total_products,
+            (SELECT COUNT(*) FROM bot_users WHERE bot_id = %(bot_id)s) as total_users,
+            (SELECT COUNT(*) FROM bot_users WHERE bot_id = %(bot_id)s AND is_blocked = false) as reachable_users,
+            (SELECT COUNT(*) FROM orders WHERE bot_id = %(bot_id)s AND status = 'paid') as total_orders,
+            (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE bot_id = %(bot_id)s AND status = 'paid') as total_revenue
+    """),
+    ("api.database.get_products_by_bot", """
+        SELECT p.*, c.name as category_name, p.available_stock as stock, p.sold_count as sold
+        FROM products p
+        LEFT JOIN categories c ON p.category_id = c.id
+        WHERE p.bot_id = %(bot_id)s
+        ORDER BY p.created_at DESC
+    """),
+    # Declared as a WITH HOLD cursor by the broadcast runner; broadcast 0 has no recipients yet
+    ("database_async.stream_broadcast_recipients", """
+        SELECT u.telegram_id FROM bot_users u
+        WHERE u.bot_id = %(bot_id)s AND u.is_blocked = false AND u.telegram_id > 0
+          AND NOT EXISTS (
+              SELECT 1 FROM broadcast_recipients r
+              WHERE r.broadcast_id = 0 AND r.telegram_id = u.telegram_id
+          )
+        ORDER BY u.telegram_id
+    """),
+]
+
+
+def seed(cursor, bots: int, products: int, stock: int, users: int, orders: int) -> dict:
+    """Insert a synthetic multi-tenant shop dataset and return IDs to query."""
+    cursor.execute("""
+        INSERT INTO users (email, password_hash, name)
+        VALUES ('plan-check@example.invalid', 'x', 'plan-check')
+        RETURNING id
+    """)
+    user_id = cursor.fetchone()['id']
+
+    cursor.execute("""
+        INSERT INTO bots (user_id, telegram_token, bot_username, bot_name)
+        SELECT %s, 'plan-check-' || g, '@plan_check_' || g, 'Plan Check ' || g
+        FROM generate_series(1, %s) g
+        RETURNING id
+    """, (user_id, bots))
+    bot_ids = [row['id'] for row in cursor.fetchall()]
+
+    cursor.execute("""
+        INSERT INTO categories (bot_id, name, sort_order)
+        SELECT b, 'Category ' || g, g
+        FROM unnest(%s::int[]) b, generate_series(1, 5) g
+    """, (bot_ids,))
+
+    cursor.execute("""
+        INSERT INTO products (bot_id, category_id, name, price)
+        SELECT c.bot_id, c.id, 'Product ' || c.id || '-' || g, 10000
+        FROM categories c, generate_series(1, %s) g
+        WHERE c.bot_id = ANY(%s)
+    """, (max(1, products // 5), bot_ids))
+
+    cursor.execute("""
+        INSERT INTO product_stock (product_id, content, is_sold)
+        SELECT p.id, 'item-' || p.id || '-' || g, g %% 3 = 0
+        FROM products p, generate_series(1, %s) g
+        WHERE p.bot_id = ANY(%s)
+    """, (stock, bot_ids))
+
+    cursor.execute("""
+        INSERT INTO bot_users (bot_id, telegram_id, first_name, is_blocked)
+        SELECT b, 1000000 + g, 'User ' || g, g %% 20 = 0
+        FROM unnest(%s::int[]) b, generate_series(1, %s) g
+    """, (bot_ids, users))
+
+    cursor.execute("""
+        INSERT INTO orders (bot_id, bot_user_id, product_id, order_id, amount, total, status, created_at)
+        SELECT bu.bot_id, bu.id, p.id,
+               'PLAN' || bu.id || '-' || g, 10000, 10000,
+               CASE WHEN g %% 4 = 0 THEN 'pending' ELSE 'paid' END,
+               NOW() - (g || ' minutes')::interval
+        FROM bot_users bu
+        JOIN LATERAL (
+            SELECT id FROM products WHERE bot_id = bu.bot_id LIMIT 1
+        ) p ON true,
+        generate_series(1, %s) g
+        WHERE bu.bot_id = ANY(%s)
+    """, (orders, bot_ids))
+
+    for table in sorted(HOT_TABLES):
+        cursor.execute(f"ANALYZE {table}")
+
+    bot_id = bot_ids[len(bot_ids) // 2]
+    cursor.execute("SELECT id FROM categories WHERE bot_id = %s LIMIT 1", (bot_id,))
+    category_id = cursor.fetchone()['id']
+    cursor.execute("SELECT id FROM products WHERE bot_id = %s LIMIT 1", (bot_id,))
+    product_id = cursor.fetchone()['id']
+    cursor.execute("SELECT id FROM bot_users WHERE bot_id = %s LIMIT 1", (bot_id,))
+    bot_user_id = cursor.fetchone()['id']
+
+    return {
+        "bot_id": bot_id,
+        "category_id": category_id,
+        "product_id": product_id,
+        "bot_user_id": bot_user_id,
+    }
+
+
+def find_seq_scans(plan: dict) -> list[str]:
+    """Walk an EXPLAIN (FORMAT JSON) plan and collect seq-scanned hot tables."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in HOT_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(find_seq_scans(child))
+    return found
+
+
+def check_query_plans(args) -> bool:
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("❌ DATABASE_URL not set")
+        return False
+
+    conn = psycopg2.connect(database_url)
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    failures = 0
+
+    try:
+        print("🌱 Seeding dataset (rolled back afterwards)...")
+        params = seed(cursor, args.bots, args.products, args.stock, args.users, args.orders)
+        cursor.execute("SET LOCAL max_parallel_workers_per_gather = 0")
+
+        for label, query in HOT_QUERIES:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cursor.fetchone()["QUERY PLAN"]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            seq_scans = find_seq_scans(plan[0]["Plan"])
+
+            if seq_scans:
+                failures += 1
+                print(f"   ❌ {label}: Seq Scan on {', '.join(sorted(set(seq_scans)))}")
+            else:
+                print(f"   ✅ {label}")
+    finally:
+        conn.rollback()
+        conn.close()
+
+    if failures:
+        print(f"\n❌ {failures} hot query(ies) fell back to a sequential scan")
+        return False
+
+    print("\n✅ All hot queries use indexes")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if hot store queries use sequential scans")
+    parser.add_argument("--bots", type=int, default=50)
+    parser.add_argument("--products", type=int, default=20, help="products per bot")
+    parser.add_argument("--stock", type=int, default=200, help="stock rows per product")
+    parser.add_argument("--users", type=int, default=500, help="users per bot")
+    parser.add_argument("--orders", type=int, default=4, help="orders per user")
+    args = parser.parse_args()
+    sys.exit(0 if check_query_plans(args) else 1)
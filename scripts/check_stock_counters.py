@@ -0,0 +1,97 @@
+"""
+Stock Counter Consistency Check
+
+Compares products.available_stock / reserved_stock / sold_count (maintained
+by triggers on product_stock) with a fresh count of product_stock rows. Run
+with --fix to recompute drifted products.
+
+Usage:
+    python check_stock_counters.py
+    python check_stock_counters.py --fix
+"""
+
+import argparse
+import os
+import sys
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from update_schema import backfill_stock_counters
+
+load_dotenv()
+
+
+def find_drift(cursor) -> list[dict]:
+    """Products whose stored counters differ from product_stock."""
+    cursor.execute("""
+        SELECT p.id, p.name, p.available_stock, p.reserved_stock, p.sold_count,
+               COALESCE(s.available, 0) AS actual_available,
+               COALESCE(s.reserved, 0) AS actual_reserved,
+               COALESCE(s.sold, 0) AS actual_sold
+        FROM products p
+        LEFT JOIN (
+            SELECT product_id,
+                   COUNT(*) FILTER (WHERE is_sold = false AND reserved_for IS NULL) AS available,
+                   COUNT(*) FILTER (WHERE is_sold = false AND reserved_for IS NOT NULL) AS reserved,
+                   COUNT(*) FILTER (WHERE is_sold = true) AS sold
+            FROM product_stock
+            GROUP BY product_id
+        ) s ON s.product_id = p.id
+        WHERE p.available_stock <> COALESCE(s.available, 0)
+           OR p.reserved_stock <> COALESCE(s.reserved, 0)
+           OR p.sold_count <> COALESCE(s.sold, 0)
+        ORDER BY p.id
+    """)
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def check_stock_counters(fix: bool = False) -> bool:
+    """Report (and optionally repair) counter drift. Returns True if consistent."""
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("❌ DATABASE_URL not set")
+        return False
+
+    conn = psycopg2.connect(database_url)
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+    try:
+        # Freeze stock writes so the comparison is not racing live sales
+        cursor.execute("LOCK TABLE product_stock IN SHARE MODE")
+        drift = find_drift(cursor)
+
+        if not drift:
+            print("✅ Stock counters are consistent")
+            return True
+
+        print(f"⚠️ {len(drift)} product(s) with drifted counters:")
+        for row in drift:
+            print(
+                f"   • #{row['id']} {row['name']}: "
+                f"available {row['available_stock']} → {row['actual_available']}, "
+                f"reserved {row['reserved_stock']} → {row['actual_reserved']}, "
+                f"sold {row['sold_count']} → {row['actual_sold']}"
+            )
+
+        if fix:
+            for row in drift:
+                backfill_stock_counters(cursor, row['id'])
+            conn.commit()
+            print(f"✅ Recomputed counters for {len(drift)} product(s)")
+            return True
+
+        return False
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check products stock counters against product_stock")
+    parser.add_argument("--fix", action="store_true", help="recompute drifted counters")
+    args = parser.parse_args()
+    sys.exit(0 if check_stock_counters(fix=args.fix) else 1)
@@ -0,0 +1,204 @@
+"""
+Fake Pakasir API Server
+
+Local stand-in for https://app.pakasir.com/api with configurable latency,
+failure rate and automatic payment completion. Used by the benchmark and
+load-test scripts; point the bot runner at it with
+PAKASIR_API_BASE_URL=http://127.0.0.1:18090/api.
+
+Usage:
+    python fake_pakasir.py --port 18090 --latency 80 --fail-rate 0.05
+    python fake_pakasir.py --complete-after 10 --webhook-url http://127.0.0.1:5000/webhook/pakasir
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from aiohttp import web, ClientSession
+
+API_PREFIX = "/api"
+
+
+class FakePakasir:
+    """In-memory Pakasir project with transactions keyed by order_id."""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        fail_rate: float = 0.0,
+        complete_after: Optional[float] = None,
+        webhook_url: Optional[str] = None
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+        self.complete_after = complete_after
+        self.webhook_url = webhook_url
+        self.transactions: dict[str, dict] = {}
+        self.calls: dict[str, int] = {}
+        self._webhook_tasks: set = set()
+
+        self.app = web.Application()
+        self.app.router.add_post(f"{API_PREFIX}/transactioncreate/{{method}}", self._create)
+        self.app.router.add_get(f"{API_PREFIX}/transactiondetail", self._detail)
+        self.app.router.add_post(f"{API_PREFIX}/transactioncancel", self._cancel)
+        self.app.router.add_post(f"{API_PREFIX}/paymentsimulation", self._simulate)
+
+    async def _simulate_network(self, endpoint: str) -> Optional[web.Response]:
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if self.fail_rate and random.random() < self.fail_rate:
+            return web.json_response({"error": "upstream unavailable"}, status=503)
+        return None
+
+    def _status_of(self, tx: dict) -> str:
+        if (
+            tx["status"] == "pending"
+            and self.complete_after is not None
+            and time.time() - tx["created"] >= self.complete_after
+        ):
+            self._complete(tx)
+        return tx["status"]
+
+    def _complete(self, tx: dict):
+        tx["status"] = "completed"
+        tx["completed_at"] = datetime.now(timezone.utc).isoformat()
+        if self.webhook_url:
+            task = asyncio.create_task(self._send_webhook(tx))
+            self._webhook_tasks.add(task)
+            task.add_done_callback(self._webhook_tasks.discard)
+
+    async def _send_webhook(self, tx: dict):
+        payload = {
+            "amount": tx["amount"],
+            "order_id": tx["order_id"],
+            "project": tx["project"],
+            "status": "completed",
+            "payment_method": tx["payment_method"],
+            "completed_at": tx["completed_at"],
+        }
+        try:
+            async with ClientSession() as session:
+                await session.post(self.webhook_url, json=payload)
+        except Exception as e:
+            print(f"⚠️ Webhook delivery failed for {tx['order_id']}: {e}")
+
+    async def _create(self, request: web.Request) -> web.Response:
+        if (failure := await self._simulate_network("transactioncreate")) is not None:
+            return failure
+        data = await request.json()
+        order_id = data["order_id"]
+        if order_id in self.transactions:
+            return web.json_response({"error": "order_id already exists"}, status=400)
+
+        amount = int(data["amount"])
+        fee = max(1, amount * 7 // 1000)
+        tx = self.transactions[order_id] = {
+            "project": data.get("project", ""),
+            "order_id": order_id,
+            "amount": amount,
+            "fee": fee,
+            "payment_method": request.match_info["method"],
+            "status": "pending",
+            "created": time.time(),
+            "completed_at": None,
+        }
+        expired_at = datetime.now(timezone.utc) + timedelta(minutes=15)
+        return web.json_response({"payment": {
+            "project": tx["project"],
+            "order_id": order_id,
+            "amount": amount,
+            "fee": fee,
+            "total_payment": amount + fee,
+            "payment_method": tx["payment_method"],
+            "payment_number": f"00020101021226FAKEQRIS{uuid.uuid4().hex.upper()}6304ABCD",
+            "expired_at": expired_at.isoformat(),
+        }})
+
+    async def _detail(self, request: web.Request) -> web.Response:
+        if (failure := await self._simulate_network("transactiondetail")) is not None:
+            return failure
+        tx = self.transactions.get(request.query.get("order_id", ""))
+        if tx is None or str(tx["amount"]) != request.query.get("amount"):
+            return web.json_response({"error": "transaction not found"}, status=404)
+        return web.json_response({"transaction": {
+            "order_id": tx["order_id"],
+            "amount": tx["amount"],
+            "status": self._status_of(tx),
+            "payment_method": tx["payment_method"],
+            "completed_at": tx["completed_at"],
+        }})
+
+    async def _cancel(self, request: web.Request) -> web.Response:
+        if (failure := await self._simulate_network("transactioncancel")) is not None:
+            return failure
+        tx = self.transactions.get((await request.json()).get("order_id", ""))
+        if tx is None or self._status_of(tx) != "pending":
+            return web.json_response({"error": "transaction not cancellable"}, status=400)
+        tx["status"] = "canceled"
+        return web.json_response({"success": True})
+
+    async def _simulate(self, request: web.Request) -> web.Response:
+        if (failure := await self._simulate_network("paymentsimulation")) is not None:
+            return failure
+        tx = self.transactions.get((await request.json()).get("order_id", ""))
+        if tx is None or self._status_of(tx) != "pending":
+            return web.json_response({"error": "transaction not payable"}, status=400)
+        self._complete(tx)
+        return web.json_response({"success": True})
+
+    def complete(self, order_id: str) -> bool:
+        """Mark a transaction paid, as if the buyer scanned the QRIS."""
+        tx = self.transactions.get(order_id)
+        if tx is None or tx["status"] != "pending":
+            return False
+        self._complete(tx)
+        return True
+
+    async def start(self, host: str = "127.0.0.1", port: int = 18090) -> web.AppRunner:
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+async def serve(args):
+    fake = FakePakasir(
+        latency_ms=args.latency,
+        jitter_ms=args.jitter,
+        fail_rate=args.fail_rate,
+        complete_after=args.complete_after,
+        webhook_url=args.webhook_url
+    )
+    await fake.start(args.host, args.port)
+    print(f"🧪 Fake Pakasir on http://{args.host}:{args.port}{API_PREFIX}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Pakasir API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--latency", type=float, default=0.0, help="base latency in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency in ms")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument("--complete-after", type=float, default=None, help="seconds until a payment completes")
+    parser.add_argument("--webhook-url", default=None, help="POST payment notifications here")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Flash Sale Load Test
+
+Simulates a drop: thousands of buyers check out one product at once.
+Each checkout reserves one stock item for its order code, either with a
+reserve_stock() statement per checkout (db) or from the in-process
+flash-sale pool with group commit (pool). Reports checkouts per second
+and latency, and verifies that every successful checkout holds exactly
+one distinct item, nothing is oversold, the product counters match the
+stock rows and the pool is returned when it stops.
+
+It creates a throwaway product (no bot attached), fills it with stock,
+runs the buyers and deletes the product again.
+
+Usage:
+    python load_flash_sale.py --buyers 5000 --stock 3000
+    python load_flash_sale.py --mode pool --buyers 20000 --stock 10000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Large pools so buyers actually run concurrently (must be set before import)
+os.environ.setdefault("DB_POOL_MAX", "50")
+
+import database_pg
+import database_async
+from services.flash_sale import FlashSalePools
+
+HOLD = 300
+
+
+def setup_product(stock: int) -> int:
+    """Create a throwaway flash-sale product with `stock` items."""
+    product = database_pg.create_product(None, None, "load-flash-sale", 1, "temporary")
+    database_pg.add_stock_items(product['id'], [f"item-{i}" for i in range(stock)])
+    database_pg.update_product(product['id'], flash_sale=True)
+    return product['id']
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run_buyers(mode: str, product_id: int, buyers: int) -> tuple[list, list, float, dict]:
+    """Returns (order codes that got an item, latencies ms, elapsed s, pool stats)."""
+    codes = [f"LOAD{mode.upper()}{i:07d}" for i in range(buyers)]
+    pools = FlashSalePools(holder=f"FLASH:load:{os.getpid()}")
+    if mode == "pool":
+        await pools.start()
+
+    latencies = []
+
+    async def buy(code: str) -> bool:
+        started = time.perf_counter()
+        if mode == "pool":
+            ok = await pools.reserve(product_id, code, HOLD)
+        else:
+            ok = await database_async.reserve_stock(code, product_id, 1, HOLD)
+        latencies.append((time.perf_counter() - started) * 1000)
+        return ok
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[buy(code) for code in codes])
+    elapsed = time.perf_counter() - started
+
+    # Stopping returns whatever is left in the pool
+    await pools.stop()
+    stats = pools.stats()
+    await database_async.close_pool()
+    return [code for code, ok in zip(codes, results) if ok], latencies, elapsed, stats
+
+
+async def release_all(codes: list) -> int:
+    released = await asyncio.gather(*[database_async.release_reservations(code) for code in codes])
+    await database_async.close_pool()
+    return sum(released)
+
+
+def verify(product_id: int, codes: list, buyers: int, stock: int) -> bool:
+    """Check that every successful checkout holds one distinct item and counters agree."""
+    ok = True
+    expected = min(buyers, stock)
+    if len(codes) != expected:
+        print(f"❌ Expected {expected} successful checkouts, got {len(codes)}")
+        ok = False
+
+    with database_pg.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*) FILTER (WHERE NOT is_sold AND reserved_for IS NULL) AS available,
+                   COUNT(*) FILTER (WHERE NOT is_sold AND reserved_for IS NOT NULL) AS reserved,
+                   COUNT(DISTINCT reserved_for) AS holders,
+                   COUNT(*) FILTER (WHERE reserved_for LIKE 'FLASH:%%') AS pooled
+            FROM product_stock WHERE product_id = %s
+        """, (product_id,))
+        db = cursor.fetchone()
+        cursor.execute("""
+            SELECT available_stock, reserved_stock FROM products WHERE id = %s
+        """, (product_id,))
+        counters = cursor.fetchone()
+
+    if db['reserved'] != len(codes) or db['holders'] != len(codes):
+        print(f"❌ Database shows {db['reserved']} reserved rows for {db['holders']} holders, "
+              f"{len(codes)} checkouts succeeded")
+        ok = False
+    if db['pooled']:
+        print(f"❌ {db['pooled']} items are still held by a flash-sale pool")
+        ok = False
+    if (counters['available_stock'], counters['reserved_stock']) != (db['available'], db['reserved']):
+        print(f"❌ Product counters {counters['available_stock']}/{counters['reserved_stock']} "
+              f"do not match stock rows {db['available']}/{db['reserved']}")
+        ok = False
+
+    released = asyncio.run(release_all(codes))
+    if released != len(codes):
+        print(f"❌ Released {released} of {len(codes)} reservations")
+        ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test flash-sale checkouts")
+    parser.add_argument("--buyers", type=int, default=5000)
+    parser.add_argument("--stock", type=int, default=3000)
+    parser.add_argument("--mode", choices=["db", "pool", "both"], default="both")
+    args = parser.parse_args()
+
+    if not database_pg.DATABASE_URL:
+        print("❌ DATABASE_URL not set")
+        sys.exit(1)
+
+    ok = True
+    for mode in (["db", "pool"] if args.mode == "both" else [args.mode]):
+        product_id = setup_product(args.stock)
+        print(f"🔄 {mode}: {args.buyers} buyers vs {args.stock} stock items (product {product_id})")
+        try:
+            codes, latencies, elapsed, stats = asyncio.run(run_buyers(mode, product_id, args.buyers))
+            print(f"   {len(codes)} checkouts in {elapsed:.2f}s ({args.buyers / elapsed:.0f}/s)  "
+                  f"p50 {percentile(latencies, 50):.1f} ms  p99 {percentile(latencies, 99):.1f} ms")
+            if mode == "pool":
+                print(f"   {stats['commits']} commits, {stats['refills']} refills, {stats['lost']} lost")
+            ok = verify(product_id, codes, args.buyers, args.stock) and ok
+        finally:
+            database_pg.delete_product(product_id)
+
+    database_pg.close_pool()
+    print("✅ Every checkout got one distinct item, counters exact" if ok else "❌ Load test failed")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
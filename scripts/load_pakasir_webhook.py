@@ -0,0 +1,227 @@
+"""
+Pakasir Webhook Load Test
+
+Replays bursts of Pakasir notifications at webhook/pakasir.py:
+
+- every order is notified --duplicates times, all shuffled together
+- some notifications carry a wrong amount or an unknown order ID
+- some orders are only inserted halfway through, so their first
+  notifications arrive before the order exists; those get 404 and are
+  retried at the end, as Pakasir would
+
+It verifies that each order is recorded and announced on payment_events
+exactly once and that rejected notifications leave nothing behind.
+
+It creates a throwaway inactive bot with pending orders, serves the
+receiver on a local port and deletes the bot again.
+
+Usage:
+    python load_pakasir_webhook.py --orders 2000 --duplicates 5 --burst 500
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Large pool so the receiver handles bursts concurrently (must be set before import)
+os.environ.setdefault("DB_POOL_MAX", "50")
+
+import aiohttp
+from aiohttp import web
+
+import database_pg
+import database_async
+from webhook.pakasir import PakasirWebhook, PAKASIR_WEBHOOK_PATH
+
+PORT = 18092
+
+
+def setup_bot(slug: str) -> int:
+    """Create an inactive bot no runner will start."""
+    with database_pg.get_cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO bots (telegram_token, bot_username, bot_name, pakasir_slug, is_active)
+            VALUES ('0:loadtest', 'loadtest', 'Webhook load test', %s, false)
+            RETURNING id
+        """, (slug,))
+        return cursor.fetchone()['id']
+
+
+def insert_orders(bot_id: int, order_ids: list[str]):
+    with database_pg.get_cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO orders (bot_id, order_id, amount, total)
+            SELECT %s, order_id, 1000, 1000 FROM unnest(%s::text[]) AS order_id
+        """, (bot_id, order_ids))
+
+
+def delete_bot(bot_id: int):
+    with database_pg.get_cursor() as cursor:
+        cursor.execute("DELETE FROM bots WHERE id = %s", (bot_id,))
+
+
+async def run(args, bot_id: int, slug: str, early: list[str], late: list[str]):
+    announced = Counter()
+    listening = asyncio.Event()
+
+    def on_payment(payload):
+        if payload is None:
+            listening.set()
+            return
+        order_id = json.loads(payload)['order_id']
+        if order_id.startswith(slug):
+            announced[order_id] += 1
+
+    await database_async.add_listener(database_async.PAYMENT_EVENTS_CHANNEL, on_payment)
+    await asyncio.wait_for(listening.wait(), timeout=30)
+
+    receiver = PakasirWebhook()
+    app = web.Application()
+    receiver.attach(app)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    url = f"http://127.0.0.1:{PORT}{PAKASIR_WEBHOOK_PATH}"
+
+    def payload(order_id: str, amount: int = 1000) -> dict:
+        return {"amount": amount, "order_id": order_id, "project": slug,
+                "status": "completed", "payment_method": "qris"}
+
+    valid = [payload(o) for o in early + late for _ in range(args.duplicates)]
+    wrong_amount = [payload(random.choice(early), 999) for _ in range(int(len(valid) * args.bad_ratio))]
+    unknown = [payload(f"{slug}-missing-{n}") for n in range(int(len(valid) * args.bad_ratio))]
+    notifications = valid + wrong_amount + unknown
+    random.shuffle(notifications)
+
+    responses: list[tuple[dict, int, str]] = []
+    latencies: list[float] = []
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def send(body: dict):
+            started = time.perf_counter()
+            async with session.post(url, json=body) as response:
+                result = (await response.json()).get("status", "")
+                latencies.append((time.perf_counter() - started) * 1000)
+                responses.append((body, response.status, result))
+
+        started = time.perf_counter()
+        for n in range(0, len(notifications), args.burst):
+            if n >= len(notifications) // 2 and late:
+                insert_orders(bot_id, late)
+                late = []
+            await asyncio.gather(*[send(body) for body in notifications[n:n + args.burst]])
+        elapsed = time.perf_counter() - started
+
+        # Pakasir retries notifications that were not accepted
+        retries = [
+            body for body, status, _ in responses
+            if status == 404 and "-missing-" not in body['order_id']
+        ]
+        await asyncio.gather(*[send(body) for body in retries])
+
+    await asyncio.sleep(2)  # let the last NOTIFYs arrive
+    await runner.cleanup()
+    await database_async.stop_listeners()
+    await database_async.close_pool()
+
+    return responses, latencies, elapsed, len(notifications), len(retries), announced, receiver.stats()
+
+
+def verify(bot_id: int, order_ids: list[str], responses: list, announced: Counter) -> bool:
+    ok = True
+    recorded = Counter(body['order_id'] for body, _, result in responses if result == "recorded")
+
+    missing = [o for o in order_ids if recorded[o] == 0]
+    twice = [o for o, n in recorded.items() if n > 1]
+    if missing:
+        print(f"❌ {len(missing)} order(s) never recorded: {missing[:5]}")
+        ok = False
+    if twice:
+        print(f"❌ {len(twice)} order(s) recorded more than once: {twice[:5]}")
+        ok = False
+
+    not_announced = [o for o in order_ids if announced[o] == 0]
+    announced_twice = [o for o, n in announced.items() if n > 1]
+    if not_announced or announced_twice:
+        print(f"❌ Announced: {len(not_announced)} missing, {len(announced_twice)} more than once")
+        ok = False
+
+    for body, status, result in responses:
+        if body['amount'] != 1000 and status != 400:
+            print(f"❌ Wrong amount for {body['order_id']} answered {status} {result}")
+            ok = False
+            break
+        if "-missing-" in body['order_id'] and status != 404:
+            print(f"❌ Unknown order {body['order_id']} answered {status} {result}")
+            ok = False
+            break
+
+    with database_pg.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*) AS events, COUNT(DISTINCT order_id) AS orders
+            FROM webhook_events WHERE bot_id = %s
+        """, (bot_id,))
+        db = cursor.fetchone()
+    if (db['events'], db['orders']) != (len(order_ids), len(order_ids)):
+        print(f"❌ webhook_events has {db['events']} rows for {db['orders']} orders, expected {len(order_ids)}")
+        ok = False
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Pakasir webhook receiver")
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--duplicates", type=int, default=5, help="notifications per order")
+    parser.add_argument("--late-ratio", type=float, default=0.1, help="orders inserted mid-run")
+    parser.add_argument("--bad-ratio", type=float, default=0.05, help="wrong-amount and unknown-order share")
+    parser.add_argument("--burst", type=int, default=500, help="notifications fired together")
+    parser.add_argument("--concurrency", type=int, default=200, help="open connections")
+    args = parser.parse_args()
+
+    if not database_pg.DATABASE_URL:
+        print("❌ DATABASE_URL not set")
+        sys.exit(1)
+
+    slug = f"whlt{os.getpid()}"
+    order_ids = [f"{slug}-{n}" for n in range(args.orders)]
+    split = int(args.orders * (1 - args.late_ratio))
+    early, late = order_ids[:split], order_ids[split:]
+
+    bot_id = setup_bot(slug)
+    try:
+        insert_orders(bot_id, early)
+        print(f"🔄 {args.orders} orders x {args.duplicates} notifications, bursts of {args.burst} (bot {bot_id})")
+
+        responses, latencies, elapsed, sent, retried, announced, stats = asyncio.run(
+            run(args, bot_id, slug, early, late)
+        )
+        latencies.sort()
+        print(f"   {sent} notifications in {elapsed:.2f}s ({sent / elapsed:.0f}/s), {retried} retried after 404")
+        print(
+            f"   response p50 {statistics.median(latencies):.1f}ms  "
+            f"p95 {latencies[int(len(latencies) * 0.95)]:.1f}ms  "
+            f"p99 {latencies[int(len(latencies) * 0.99)]:.1f}ms"
+        )
+        print(f"   outcomes: {stats}")
+
+        ok = verify(bot_id, order_ids, responses, announced)
+    finally:
+        delete_bot(bot_id)
+        database_pg.close_pool()
+
+    print("✅ Every order recorded and announced exactly once" if ok else "❌ Load test failed")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
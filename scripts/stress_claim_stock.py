@@ -0,0 +1,235 @@
+"""
+Stock Claim Stress Test
+
+Pays hundreds of pending orders of one product at once through
+complete_order(), the claim every paid checkout runs, and verifies that no
+stock item is delivered twice, nothing is oversold and every order is
+completed exactly once. Half of the orders reserve their items first, as
+checkout does; the rest are topped up from free stock, as after a released
+reservation. The reserve driver does the same with checkout reservations
+(reserve_stock), then releases them and checks the counters return.
+
+It creates a throwaway product (no bot attached), fills it with stock,
+runs the claimers and deletes the product and its orders again.
+
+Usage:
+    python stress_claim_stock.py --claimers 500 --stock 300
+    python stress_claim_stock.py --claimers 200 --stock 500 --quantity 3
+    python stress_claim_stock.py --driver reserve --claimers 5000 --stock 1000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Large pools so claimers actually run concurrently (must be set before import)
+os.environ.setdefault("DB_POOL_MAX", "50")
+
+import database_pg
+import database_async
+
+# Synthetic order codes
+ORDER_ID_BASE = 900_000_000
+HOLD = 300
+
+
+def setup_product(stock: int) -> int:
+    """Create a throwaway product with `stock` items."""
+    product = database_pg.create_product(None, None, "stress-claim-stock", 1, "temporary")
+    database_pg.add_stock_items(product['id'], [f"item-{i}" for i in range(stock)])
+    return product['id']
+
+
+async def create_orders(product_id: int, claimers: int, quantity: int) -> list:
+    """Create the pending orders; every other one reserves its items first, like checkout."""
+    codes = [f"STRESS{ORDER_ID_BASE + i}" for i in range(claimers)]
+    for i, code in enumerate(codes):
+        if i % 2 == 0:
+            await database_async.reserve_stock(code, product_id, quantity, HOLD)
+        await database_async.create_order(
+            None, None, product_id, code, quantity, total=quantity, quantity=quantity
+        )
+    await database_async.close_pool()
+    return codes
+
+
+async def run_complete(codes: list) -> list:
+    """Complete every order twice at once; results are (order, stock_items) or None."""
+    results = await asyncio.gather(*[
+        database_async.complete_order(code) for code in codes + codes
+    ])
+    await database_async.close_pool()
+    return results
+
+
+async def run_reserve(product_id: int, claimers: int) -> list:
+    """Reserve one item per checkout; results are the order codes that got one."""
+    codes = [f"STRESS{ORDER_ID_BASE + i}" for i in range(claimers)]
+    reserved = await asyncio.gather(*[
+        database_async.reserve_stock(code, product_id, 1, 60) for code in codes
+    ])
+    await database_async.close_pool()
+    return [code for code, ok in zip(codes, reserved) if ok]
+
+
+async def release_all(codes: list) -> int:
+    released = await asyncio.gather(*[database_async.release_reservations(code) for code in codes])
+    await database_async.close_pool()
+    return sum(released)
+
+
+def stock_state(product_id: int) -> tuple[dict, dict]:
+    """(stock row counts, product counters) of a product."""
+    with database_pg.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*) FILTER (WHERE NOT is_sold AND reserved_for IS NULL) AS available,
+                   COUNT(*) FILTER (WHERE NOT is_sold AND reserved_for IS NOT NULL) AS reserved,
+                   COUNT(DISTINCT reserved_for) AS holders
+            FROM product_stock WHERE product_id = %s
+        """, (product_id,))
+        db = cursor.fetchone()
+        cursor.execute("""
+            SELECT available_stock, reserved_stock FROM products WHERE id = %s
+        """, (product_id,))
+        return db, cursor.fetchone()
+
+
+def verify_reservations(product_id: int, codes: list, claimers: int, stock: int) -> bool:
+    """Check that every successful checkout holds exactly one distinct item and counters agree."""
+    ok = True
+    expected = min(claimers, stock)
+    if len(codes) != expected:
+        print(f"❌ Expected {expected} successful reservations, got {len(codes)}")
+        ok = False
+
+    db, counters = stock_state(product_id)
+    if db['reserved'] != len(codes) or db['holders'] != len(codes):
+        print(f"❌ Database shows {db['reserved']} reserved rows for {db['holders']} checkouts, "
+              f"{len(codes)} reservations returned")
+        ok = False
+    if (counters['available_stock'], counters['reserved_stock']) != (db['available'], db['reserved']):
+        print(f"❌ Product counters {counters['available_stock']}/{counters['reserved_stock']} "
+              f"do not match stock rows {db['available']}/{db['reserved']}")
+        ok = False
+
+    released = asyncio.run(release_all(codes))
+    db, counters = stock_state(product_id)
+    if released != len(codes) or db['reserved'] or counters['reserved_stock'] or counters['available_stock'] != stock:
+        print(f"❌ After release: {released} released, {db['reserved']} still reserved, "
+              f"counters {counters['available_stock']}/{counters['reserved_stock']}")
+        ok = False
+
+    return ok
+
+
+def verify(product_id: int, results: list, claimers: int, quantity: int, stock: int) -> bool:
+    """Check results and database state for double completion, double delivery or overselling."""
+    completed = [r for r in results if r]
+    claimed = [item for _, items in completed for item in items]
+    ok = True
+
+    if len(completed) != claimers or len({order['order_id'] for order, _ in completed}) != claimers:
+        print(f"❌ Expected each of {claimers} orders completed once, got {len(completed)} completions")
+        ok = False
+
+    duplicates = [sid for sid, n in Counter(item['id'] for item in claimed).items() if n > 1]
+    if duplicates:
+        print(f"❌ Stock items handed out more than once: {duplicates[:10]}")
+        ok = False
+
+    overfilled = [order['order_id'] for order, items in completed if len(items) > quantity]
+    misassigned = [order['order_id'] for order, items in completed
+                   if any(item['order_id'] != order['id'] for item in items)]
+    if overfilled or misassigned:
+        print(f"❌ Orders with too many items: {overfilled[:10]}, with another order's items: {misassigned[:10]}")
+        ok = False
+
+    expected = min(claimers * quantity, stock)
+    if len(claimed) != expected:
+        print(f"❌ Expected {expected} items claimed, got {len(claimed)}")
+        ok = False
+
+    with database_pg.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*) FILTER (WHERE is_sold) AS sold,
+                   COUNT(*) FILTER (WHERE NOT is_sold) AS unsold,
+                   COUNT(*) FILTER (WHERE reserved_for IS NOT NULL) AS reserved
+            FROM product_stock WHERE product_id = %s
+        """, (product_id,))
+        db = cursor.fetchone()
+        cursor.execute("""
+            SELECT COUNT(*) FILTER (WHERE status = 'paid') AS paid
+            FROM orders WHERE product_id = %s
+        """, (product_id,))
+        orders = cursor.fetchone()
+        cursor.execute("""
+            SELECT available_stock, reserved_stock, sold_count FROM products WHERE id = %s
+        """, (product_id,))
+        counters = cursor.fetchone()
+
+    if db['sold'] != len(claimed):
+        print(f"❌ Database shows {db['sold']} sold rows, {len(claimed)} items returned")
+        ok = False
+    if db['unsold'] != stock - len(claimed) or db['reserved']:
+        print(f"❌ Database shows {db['unsold']} unsold rows ({db['reserved']} still reserved), "
+              f"expected {stock - len(claimed)}")
+        ok = False
+    if orders['paid'] != claimers:
+        print(f"❌ {orders['paid']} of {claimers} orders are paid")
+        ok = False
+
+    if (counters['available_stock'], counters['reserved_stock'], counters['sold_count']) != (db['unsold'], 0, db['sold']):
+        print(f"❌ Product counters {counters['available_stock']}/{counters['reserved_stock']}/{counters['sold_count']} "
+              f"do not match stock rows {db['unsold']}/0/{db['sold']}")
+        ok = False
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test concurrent stock claiming")
+    parser.add_argument("--claimers", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=300)
+    parser.add_argument("--quantity", type=int, default=1, help="items per order")
+    parser.add_argument("--driver", choices=["complete", "reserve"], default="complete")
+    args = parser.parse_args()
+
+    if not database_pg.DATABASE_URL:
+        print("❌ DATABASE_URL not set")
+        sys.exit(1)
+
+    product_id = setup_product(args.stock)
+    print(f"🔄 {args.claimers} {args.driver} claimers vs {args.stock} stock items (product {product_id})")
+
+    try:
+        if args.driver == "reserve":
+            started = time.perf_counter()
+            results = asyncio.run(run_reserve(product_id, args.claimers))
+            elapsed = time.perf_counter() - started
+            print(f"   {len(results)} reserved in {elapsed:.2f}s ({args.claimers / elapsed:.0f} claims/s)")
+            ok = verify_reservations(product_id, results, args.claimers, args.stock)
+        else:
+            codes = asyncio.run(create_orders(product_id, args.claimers, args.quantity))
+            started = time.perf_counter()
+            results = asyncio.run(run_complete(codes))
+            elapsed = time.perf_counter() - started
+            claimed = sum(len(r[1]) for r in results if r)
+            print(f"   {claimed} items claimed in {elapsed:.2f}s ({args.claimers / elapsed:.0f} orders/s)")
+            ok = verify(product_id, results, args.claimers, args.quantity, args.stock)
+    finally:
+        with database_pg.get_cursor() as cursor:
+            cursor.execute("DELETE FROM orders WHERE product_id = %s", (product_id,))
+        database_pg.delete_product(product_id)
+        database_pg.close_pool()
+
+    print("✅ No double delivery, no overselling" if ok else "❌ Stress test failed")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,436 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+# Stock counters on products, kept by statement-level triggers on product_stock:
+# one products UPDATE per statement, not per stock row.
+# available = unsold and unreserved, reserved = unsold and held by a checkout
+STOCK_COUNTERS_FUNCTION = """
+CREATE OR REPLACE FUNCTION product_stock_counters() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE products p
+        SET available_stock = p.available_stock + d.available,
+            reserved_stock = p.reserved_stock + d.reserved,
+            sold_count = p.sold_count + d.sold
+        FROM (
+            SELECT product_id,
+                   COUNT(*) FILTER (WHERE is_sold = false AND reserved_for IS NULL) AS available,
+                   COUNT(*) FILTER (WHERE is_sold = false AND reserved_for IS NOT NULL) AS reserved,
+                   COUNT(*) FILTER (WHERE is_sold = true) AS sold
+            FROM new_rows GROUP BY product_id
+        ) d
+        WHERE p.id = d.product_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE products p
+        SET available_stock = p.available_stock - d.available,
+            reserved_stock = p.reserved_stock - d.reserved,
+            sold_count = p.sold_count - d.sold
+        FROM (
+            SELECT product_id,
+                   COUNT(*) FILTER (WHERE is_sold = false AND reserved_for IS NULL) AS available,
+                   COUNT(*) FILTER (WHERE is_sold = false AND reserved_for IS NOT NULL) AS reserved,
+                   COUNT(*) FILTER (WHERE is_sold = true) AS sold
+            FROM old_rows GROUP BY product_id
+        ) d
+        WHERE p.id = d.product_id;
+    ELSE
+        UPDATE products p
+        SET available_stock = p.available_stock + d.available,
+            reserved_stock = p.reserved_stock + d.reserved,
+            sold_count = p.sold_count + d.sold
+        FROM (
+            SELECT product_id, SUM(available) AS available,
+                   SUM(reserved) AS reserved, SUM(sold) AS sold
+            FROM (
+                SELECT product_id,
+                       (is_sold = false AND reserved_for IS NULL)::int AS available,
+                       (is_sold = false AND reserved_for IS NOT NULL)::int AS reserved,
+                       (is_sold = true)::int AS sold
+                FROM new_rows
+                UNION ALL
+                SELECT product_id,
+                       -(is_sold = false AND reserved_for IS NULL)::int,
+                       -(is_sold = false AND reserved_for IS NOT NULL)::int,
+                       -(is_sold = true)::int
+                FROM old_rows
+            ) changes
+            GROUP BY product_id
+            HAVING SUM(available) <> 0 OR SUM(reserved) <> 0 OR SUM(sold) <> 0
+        ) d
+        WHERE p.id = d.product_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+STOCK_COUNTERS_TRIGGERS = """
+DROP TRIGGER IF EXISTS product_stock_counters_insert ON product_stock;
+CREATE TRIGGER product_stock_counters_insert
+AFTER INSERT ON product_stock
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_stock_counters();
+
+DROP TRIGGER IF EXISTS product_stock_counters_update ON product_stock;
+CREATE TRIGGER product_stock_counters_update
+AFTER UPDATE ON product_stock
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_stock_counters();
+
+DROP TRIGGER IF EXISTS product_stock_counters_delete ON product_stock;
+CREATE TRIGGER product_stock_counters_delete
+AFTER DELETE ON product_stock
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_stock_counters();
+"""
+
+# Recompute products.available_stock / reserved_stock / sold_count from product_stock
+STOCK_COUNTERS_BACKFILL = """
+UPDATE products p
+SET available_stock = COALESCE(s.available, 0),
+    reserved_stock = COALESCE(s.reserved, 0),
+    sold_count = COALESCE(s.sold, 0)
+FROM products p2
+LEFT JOIN (
+    SELECT product_id,
+           COUNT(*) FILTER (WHERE is_sold = false AND reserved_for IS NULL) AS available,
+           COUNT(*) FILTER (WHERE is_sold = false AND reserved_for IS NOT NULL) AS reserved,
+           COUNT(*) FILTER (WHERE is_sold = true) AS sold
+    FROM product_stock
+    GROUP BY product_id
+) s ON s.product_id = p2.id
+WHERE p.id = p2.id
+"""
+
+
+# ==================== VERSIONED MIGRATIONS ====================
+# Applied once each, in order, and recorded in schema_migrations.
+# "indexes" are built with CREATE INDEX CONCURRENTLY (outside a transaction)
+# so live shops keep selling while they build, and "drop_indexes" are dropped
+# the same way; "statements" run first, in one transaction (they must be safe
+# to repeat if a later index build of the same migration fails).
+
+MIGRATIONS = [
+    {
+        "version": 1,
+        "name": "store hot-path indexes",
+        "indexes": [
+            # complete_order / get_available_stock: first unsold item per product
+            ("idx_product_stock_unsold",
+             "product_stock (product_id, id) WHERE is_sold = false"),
+            # items delivered for an order
+            ("idx_product_stock_order",
+             "product_stock (order_id) WHERE order_id IS NOT NULL"),
+            # get_orders_by_bot / get_transactions_by_bot
+            ("idx_orders_bot_created",
+             "orders (bot_id, created_at DESC)"),
+            # get_orders_by_user
+            ("idx_orders_bot_user_created",
+             "orders (bot_user_id, created_at DESC)"),
+            # get_bot_stats: paid/completed counts and revenue, index-only
+            ("idx_orders_bot_status",
+             "orders (bot_id, status) INCLUDE (amount)"),
+            # get_products_by_bot
+            ("idx_products_bot_name",
+             "products (bot_id, name)"),
+            # get_products_by_category
+            ("idx_products_bot_category",
+             "products (bot_id, category_id, name)"),
+            # get_categories_by_bot
+            ("idx_categories_bot_sort",
+             "categories (bot_id, sort_order, name)"),
+            # broadcast audiences, streamed in telegram_id order
+            ("idx_bot_users_reachable",
+             "bot_users (bot_id, telegram_id) WHERE is_blocked = false"),
+        ],
+    },
+    {
+        "version": 2,
+        "name": "bot worker registry",
+        "statements": [
+            # Heartbeats of sharded bot runner workers (see sharding.py)
+            """
+            CREATE TABLE IF NOT EXISTS bot_workers (
+                worker_id VARCHAR(100) PRIMARY KEY,
+                hostname VARCHAR(255),
+                pid INTEGER,
+                weight REAL NOT NULL DEFAULT 1.0,
+                bot_count INTEGER NOT NULL DEFAULT 0,
+                cpu_percent REAL NOT NULL DEFAULT 0,
+                loop_lag_ms REAL NOT NULL DEFAULT 0,
+                started_at TIMESTAMP DEFAULT NOW(),
+                heartbeat_at TIMESTAMP DEFAULT NOW()
+            )
+            """,
+        ],
+    },
+    {
+        "version": 3,
+        "name": "pending order index",
+        "indexes": [
+            # get_pending_orders: the payment reconciler's working set
+            ("idx_orders_pending",
+             "orders (bot_id, expired_at) WHERE status = 'pending'"),
+        ],
+    },
+    {
+        "version": 4,
+        "name": "payment webhook events",
+        "statements": [
+            # One row per distinct Pakasir notification; retries hit the unique key
+            """
+            CREATE TABLE IF NOT EXISTS webhook_events (
+                id BIGSERIAL PRIMARY KEY,
+                idempotency_key VARCHAR(200) UNIQUE NOT NULL,
+                source VARCHAR(20) NOT NULL DEFAULT 'pakasir',
+                bot_id INTEGER REFERENCES bots(id) ON DELETE CASCADE,
+                order_id VARCHAR(50) NOT NULL,
+                status VARCHAR(20),
+                payload JSONB,
+                received_at TIMESTAMP DEFAULT NOW()
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_webhook_events_order ON webhook_events (order_id)",
+        ],
+    },
+    {
+        "version": 5,
+        "name": "pending order expiry index",
+        "indexes": [
+            # expire_pending_orders: overdue pending orders across all bots
+            ("idx_orders_pending_expiry",
+             "orders (expired_at) WHERE status = 'pending'"),
+        ],
+    },
+    {
+        "version": 6,
+        "name": "delivery queue",
+        "statements": [
+            # Outbound product messages, written with the paid order (see services/delivery.py)
+            """
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id BIGSERIAL PRIMARY KEY,
+                bot_id INTEGER REFERENCES bots(id) ON DELETE CASCADE,
+                order_id INTEGER UNIQUE REFERENCES orders(id) ON DELETE CASCADE,
+                chat_id BIGINT NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                locked_until TIMESTAMP,
+                parts_sent INTEGER NOT NULL DEFAULT 0,
+                message_ids BIGINT[] NOT NULL DEFAULT '{}',
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT NOW(),
+                sent_at TIMESTAMP
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_deliveries_due
+            ON deliveries (bot_id, next_attempt_at) WHERE status IN ('pending', 'sending')
+            """,
+        ],
+    },
+    {
+        "version": 7,
+        "name": "broadcast jobs",
+        "statements": [
+            # Broadcasts run as leased jobs in the bot runners (see services/broadcast.py);
+            # recipients_count counts delivered messages
+            """
+            ALTER TABLE broadcasts
+                ADD COLUMN IF NOT EXISTS total_count INTEGER NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS failed_count INTEGER NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS last_telegram_id BIGINT NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS locked_by VARCHAR(100),
+                ADD COLUMN IF NOT EXISTS locked_until TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS started_at TIMESTAMP
+            """,
+            # Broadcasts before this were sent inside the HTTP request
+            """
+            UPDATE broadcasts SET status = 'completed', completed_at = COALESCE(completed_at, created_at)
+            WHERE status = 'pending'
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_broadcasts_active ON broadcasts (bot_id, id) WHERE status IN ('pending', 'running')",
+            # Outcome per recipient; a resumed job skips everyone recorded here
+            """
+            CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                broadcast_id INTEGER NOT NULL REFERENCES broadcasts(id) ON DELETE CASCADE,
+                telegram_id BIGINT NOT NULL,
+                status VARCHAR(20) NOT NULL,
+                error TEXT,
+                sent_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (broadcast_id, telegram_id)
+            )
+            """,
+        ],
+    },
+    {
+        "version": 8,
+        "name": "stock content hash index",
+        "indexes": [
+            # Stock imports skip items a product already has, matched by hash
+            ("idx_product_stock_content_md5",
+             "product_stock (product_id, md5(content))"),
+        ],
+    },
+    {
+        "version": 9,
+        "name": "pending orders per buyer",
+        "indexes": [
+            # Purchases reuse the buyer's pending order for the same product
+            ("idx_orders_pending_buyer",
+             "orders (bot_user_id, product_id, created_at DESC) WHERE status = 'pending'"),
+        ],
+    },
+    {
+        "version": 10,
+        "name": "stock reservations",
+        "statements": [
+            # The order code holding an unsold item, and until when an item of an
+            # order that was never created stays held
+            """
+            ALTER TABLE product_stock
+                ADD COLUMN IF NOT EXISTS reserved_for VARCHAR(50),
+                ADD COLUMN IF NOT EXISTS reserved_until TIMESTAMP
+            """,
+        ],
+        "indexes": [
+            # reserve_stock / complete_order: first free item per product
+            ("idx_product_stock_free",
+             "product_stock (product_id, id) WHERE is_sold = false AND reserved_for IS NULL"),
+            # release_reservations / complete_order / release_stale_reservations
+            ("idx_product_stock_reserved",
+             "product_stock (reserved_for) WHERE is_sold = false AND reserved_for IS NOT NULL"),
+        ],
+    },
+    {
+        "version": 11,
+        "name": "flash sale flag",
+        "statements": [
+            # Products sold from an in-process stock pool (see services/flash_sale.py)
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS flash_sale BOOLEAN NOT NULL DEFAULT false",
+        ],
+    },
+    {
+        "version": 12,
+        "name": "order items",
+        "statements": [
+            # What an order buys; orders without a row buy one item of orders.product_id
+            """
+            CREATE TABLE IF NOT EXISTS order_items (
+                id BIGSERIAL PRIMARY KEY,
+                order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+                product_id INTEGER REFERENCES products(id) ON DELETE SET NULL,
+                quantity INTEGER NOT NULL CHECK (quantity > 0),
+                unit_price INTEGER NOT NULL,
+                UNIQUE (order_id, product_id)
+            )
+            """,
+        ],
+    },
+    {
+        "version": 13,
+        "name": "drop superseded unsold stock index",
+        "drop_indexes": [
+            # Replaced by idx_product_stock_free (version 10); every stock write still maintained it
+            "idx_product_stock_unsold",
+        ],
+    },
+    {
+        "version": 14,
+        "name": "stock counters",
+        "statements": [
+            # Block stock writes until the triggers and backfill are committed
+            "LOCK TABLE product_stock IN SHARE ROW EXCLUSIVE MODE",
+            """
+            ALTER TABLE products
+                ADD COLUMN IF NOT EXISTS available_stock INTEGER NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS reserved_stock INTEGER NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS sold_count INTEGER NOT NULL DEFAULT 0
+            """,
+            STOCK_COUNTERS_FUNCTION,
+            STOCK_COUNTERS_TRIGGERS,
+            STOCK_COUNTERS_BACKFILL,
+        ],
+    },
+]
+
+
+def _drop_invalid_index(cursor, name: str):
+    """Drop an index left INVALID by an interrupted concurrent build."""
+    cursor.execute("""
+        SELECT 1 FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (name,))
+    if cursor.fetchone():
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def apply_migrations(conn) -> int:
+    """Apply pending versioned migrations. Returns the number applied."""
+    conn.autocommit = True
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(200) NOT NULL,
+            applied_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    applied = {row[0] for row in cursor.fetchall()}
+    
+    count = 0
+    for migration in MIGRATIONS:
+        if migration["version"] in applied:
+            continue
+        
+        print(f"   Migration {migration['version']}: {migration['name']}...")
+        index_work = migration.get("indexes") or migration.get("drop_indexes")
+        record = ("""
+            INSERT INTO schema_migrations (version, name) VALUES (%s, %s)
+        """, (migration["version"], migration["name"]))
+        
+        # Statements first: the indexes may cover columns they add
+        conn.autocommit = False
+        try:
+            for statement in migration.get("statements", []):
+                cursor.execute(statement)
+            if not index_work:
+                cursor.execute(*record)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+        
+        if index_work:
+            for name, definition in migration.get("indexes", []):
+                _drop_invalid_index(cursor, name)
+                cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+            
+            for name in migration.get("drop_indexes", []):
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            
+            cursor.execute(*record)
+        
+        count += 1
+    
+    return count
+
+
+def backfill_stock_counters(cursor, product_id: int = None):
+    """Recompute products.available_stock / reserved_stock / sold_count from product_stock."""
+    if product_id is None:
+        cursor.execute(STOCK_COUNTERS_BACKFILL)
+    else:
+        cursor.execute(STOCK_COUNTERS_BACKFILL + " AND p.id = %s", (product_id,))
+    return cursor.rowcount
+
+
 def update_schema():
     """Update database schema with new columns and tables."""
     database_url = os.getenv("DATABASE_URL")
@@ -187,6 +617,10 @@ def update_schema():
         """)
         
         conn.commit()
+        
+        applied = apply_migrations(conn)
+        print(f"   {applied} migration(s) applied")
+        
         print("✅ Schema updated successfully!")
         return True
         
@@ -1,15 +1,18 @@
 """Services package."""
-from services.pakasir import pakasir_client, PakasirClient, PaymentResponse, TransactionStatus
-from services.delivery import deliver_product
+from services.pakasir import (
+    PakasirClient, PakasirUnavailable, PaymentResponse, TransactionStatus, get_pakasir_stats
+)
+from services.catalog_cache import catalog_cache, CatalogCache
 
 # Note: SheerID service is imported separately via services.sheerid
+# Note: delivery, fulfillment and the background workers are imported directly
 
 __all__ = [
-    "pakasir_client",
-    "PakasirClient", 
+    "PakasirClient",
+    "PakasirUnavailable",
     "PaymentResponse",
     "TransactionStatus",
-    "deliver_product",
+    "get_pakasir_stats",
+    "catalog_cache",
+    "CatalogCache",
 ]
-
-
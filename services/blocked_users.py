@@ -0,0 +1,116 @@
+"""
+Blocked user bookkeeping.
+
+Sends that Telegram answers with 403 (the user blocked the bot or deleted
+the account) report the user through mark_blocked(). The users are
+flagged in bot_users in one batched UPDATE per flush, so broadcasts and
+audience counts stop including them. Broadcasts flag their own blocked
+recipients together with each page's outcomes; a returning user's /start
+clears the flag (database_async.get_or_create_bot_user).
+
+The same loop compacts broadcast bookkeeping: per-recipient rows of
+broadcasts completed longer ago than BROADCAST_RECIPIENT_RETENTION_DAYS
+are deleted, keeping only the totals on the broadcast.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from database_async import mark_users_blocked, compact_broadcast_recipients
+from utils.events import wait_event
+
+logger = logging.getLogger(__name__)
+
+BLOCKED_FLUSH_INTERVAL = float(os.getenv("BLOCKED_FLUSH_INTERVAL", "5"))
+BLOCKED_FLUSH_SIZE = int(os.getenv("BLOCKED_FLUSH_SIZE", "500"))
+BROADCAST_COMPACT_INTERVAL = float(os.getenv("BROADCAST_COMPACT_INTERVAL", "3600"))
+BROADCAST_RECIPIENT_RETENTION_DAYS = float(os.getenv("BROADCAST_RECIPIENT_RETENTION_DAYS", "7"))
+# Broadcasts compacted per run, so one run stays short
+BROADCAST_COMPACT_BATCH = int(os.getenv("BROADCAST_COMPACT_BATCH", "20"))
+
+
+class BlockedUsers:
+    """Batches blocked-user flags and compacts broadcast recipients."""
+
+    def __init__(self):
+        self._pending: set[tuple[int, int]] = set()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._next_compact = 0.0
+        self._stats = {"reported": 0, "flagged": 0, "recipients_compacted": 0, "errors": 0}
+
+    def mark(self, bot_id: int, telegram_id: int):
+        """Queue a user for flagging at the next flush."""
+        self._pending.add((bot_id, telegram_id))
+        self._stats["reported"] += 1
+        if len(self._pending) >= BLOCKED_FLUSH_SIZE:
+            self._full.set()
+
+    async def flush(self) -> int:
+        """Flag every queued user. Returns how many were newly flagged."""
+        if not self._pending:
+            return 0
+        users, self._pending = list(self._pending), set()
+        try:
+            flagged = await mark_users_blocked(users)
+        except Exception:
+            # Keep them for the next flush
+            self._pending.update(users)
+            raise
+        self._stats["flagged"] += flagged
+        return flagged
+
+    async def compact(self) -> int:
+        deleted = await compact_broadcast_recipients(BROADCAST_RECIPIENT_RETENTION_DAYS, BROADCAST_COMPACT_BATCH)
+        self._stats["recipients_compacted"] += deleted
+        if deleted:
+            logger.info(f"Compacted {deleted} broadcast recipient row(s)")
+        return deleted
+
+    async def _run(self):
+        while True:
+            await wait_event(self._full, BLOCKED_FLUSH_INTERVAL)
+            self._full.clear()
+
+            try:
+                await self.flush()
+                if time.monotonic() >= self._next_compact:
+                    self._next_compact = time.monotonic() + BROADCAST_COMPACT_INTERVAL
+                    await self.compact()
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Blocked user bookkeeping failed: {e}")
+
+    async def start(self):
+        global _active
+        _active = self
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the loop and flush what is queued."""
+        global _active
+        if _active is self:
+            _active = None
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Final blocked user flush failed: {e}")
+
+    def stats(self) -> dict:
+        return {**self._stats, "pending": len(self._pending)}
+
+
+_active: Optional[BlockedUsers] = None
+
+
+def mark_blocked(bot_id: int, telegram_id: int):
+    """Report a user who blocked the bot to the running BlockedUsers, if any."""
+    if _active is not None:
+        _active.mark(bot_id, telegram_id)
@@ -0,0 +1,178 @@
+"""
+Broadcast jobs for all bots.
+
+The dashboard only records a broadcast and announces it on
+BROADCAST_JOBS_CHANNEL. The runner of the bot leases the job and sends it
+through the bot's own Application, in the broadcast lane of its rate
+limiter, so broadcasts never crowd out deliveries or replies:
+
+- recipients are streamed from a server-side cursor in telegram_id order,
+  one page at a time, so memory stays flat however large the audience
+- a page is sent with bounded concurrency, then its outcomes, the
+  checkpoint (last telegram_id) and the lease are stored together
+- users who blocked the bot are flagged in bot_users with the page, so
+  later broadcasts skip them
+- a job whose worker died is taken over when its lease runs out and
+  resumes after the checkpoint, skipping anyone already recorded
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from contextlib import aclosing
+from typing import Optional
+
+from telegram.error import TelegramError
+
+from database_async import (
+    claim_broadcast, stream_broadcast_recipients, record_broadcast_progress,
+    finish_broadcast, release_broadcast
+)
+from utils.events import wait_event
+from utils.rate_limiter import PRIORITY_BROADCAST
+from utils.telegram_errors import (
+    FAILED, RATE_LIMITED, TRANSIENT, classify_send_error, retry_after_seconds
+)
+
+logger = logging.getLogger(__name__)
+
+# Broadcasts one worker sends at the same time
+BROADCAST_MAX_JOBS = int(os.getenv("BROADCAST_MAX_JOBS", "4"))
+# Messages of one broadcast in flight; the rate limiter sets the pace
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "30"))
+BROADCAST_PAGE = int(os.getenv("BROADCAST_PAGE", "200"))
+BROADCAST_LEASE = float(os.getenv("BROADCAST_LEASE", "300"))
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", "30"))
+BROADCAST_SEND_ATTEMPTS = int(os.getenv("BROADCAST_SEND_ATTEMPTS", "3"))
+# Seconds stop() lets running jobs finish their page
+BROADCAST_STOP_TIMEOUT = float(os.getenv("BROADCAST_STOP_TIMEOUT", "15"))
+
+
+class BroadcastRunner:
+    """Leases and sends broadcast jobs for the bots this process runs."""
+
+    def __init__(self, manager, worker: Optional[str] = None):
+        """
+        Args:
+            manager: BotManager whose running bots send the messages
+            worker: Lease owner name; defaults to host:pid
+        """
+        self.manager = manager
+        self.worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        self._jobs: dict[int, asyncio.Task] = {}
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "jobs_started": 0, "jobs_completed": 0, "sent": 0, "blocked": 0,
+            "failed": 0, "errors": 0,
+        }
+
+    def on_job_event(self, payload: Optional[str]):
+        """NOTIFY callback for BROADCAST_JOBS_CHANNEL; None means events may have been missed."""
+        self._wake.set()
+
+    async def _poll(self):
+        """Claim runnable jobs until BROADCAST_MAX_JOBS are running."""
+        while True:
+            try:
+                while len(self._jobs) < BROADCAST_MAX_JOBS and self.manager.bots:
+                    job = await claim_broadcast(list(self.manager.bots), self.worker, BROADCAST_LEASE)
+                    if job is None:
+                        break
+                    self._stats["jobs_started"] += 1
+                    task = asyncio.create_task(self._run_job(job))
+                    self._jobs[job['id']] = task
+                    task.add_done_callback(lambda _, job_id=job['id']: self._job_done(job_id))
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Claiming broadcasts failed: {e}")
+
+            self._wake.clear()
+            await wait_event(self._wake, BROADCAST_POLL_INTERVAL)
+
+    def _job_done(self, job_id: int):
+        self._jobs.pop(job_id, None)
+        # A slot is free; another job may be waiting
+        self._wake.set()
+
+    async def _run_job(self, job: dict):
+        broadcast_id, bot_id = job['id'], job['bot_id']
+        after = job['last_telegram_id']
+        slots = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        logger.info(f"📣 Broadcast {broadcast_id} of bot {bot_id} running (from telegram_id {after})")
+
+        try:
+            async with aclosing(stream_broadcast_recipients(broadcast_id, bot_id, after, BROADCAST_PAGE)) as pages:
+                async for chat_ids in pages:
+                    instance = self.manager.bots.get(bot_id)
+                    if self._stopping or instance is None:
+                        # Shutting down, or the bot moved to another worker
+                        await release_broadcast(broadcast_id, self.worker)
+                        return
+
+                    outcomes = await asyncio.gather(*[
+                        self._send(instance.app.bot, chat_id, job['message'], slots) for chat_id in chat_ids
+                    ])
+                    after = chat_ids[-1]
+                    results = [(chat_id, status, error) for chat_id, (status, error) in zip(chat_ids, outcomes)]
+                    for _, status, _ in results:
+                        self._stats[status] += 1
+
+                    if not await record_broadcast_progress(broadcast_id, self.worker, BROADCAST_LEASE, after, results):
+                        logger.warning(f"Broadcast {broadcast_id} was taken over by another worker, stopping")
+                        return
+
+            await finish_broadcast(broadcast_id, self.worker)
+            self._stats["jobs_completed"] += 1
+            logger.info(f"✅ Broadcast {broadcast_id} of bot {bot_id} completed")
+        except Exception as e:
+            # The lease runs out and the job is resumed from its checkpoint
+            self._stats["errors"] += 1
+            logger.error(f"Broadcast {broadcast_id} failed: {e}")
+
+    async def _send(self, bot, chat_id: int, text: str, slots: asyncio.Semaphore) -> tuple[str, Optional[str]]:
+        """Send to one recipient; returns (status, error)."""
+        error = None
+        async with slots:
+            for attempt in range(1, BROADCAST_SEND_ATTEMPTS + 1):
+                try:
+                    await bot.send_message(
+                        chat_id=chat_id, text=text, parse_mode="HTML", rate_limit_args=PRIORITY_BROADCAST
+                    )
+                    return "sent", None
+                except TelegramError as e:
+                    error = str(e)
+                    kind = classify_send_error(e)
+                    if kind == RATE_LIMITED:
+                        # The limiter already paused the bot; wait it out here too
+                        await asyncio.sleep(retry_after_seconds(e))
+                    elif kind == TRANSIENT:
+                        await asyncio.sleep(2 * attempt)
+                    else:
+                        # BLOCKED users are flagged with the page's outcomes
+                        return kind, error
+        return FAILED, error
+
+    async def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        """Stop claiming; running jobs finish their page and are released for resuming."""
+        self._stopping = True
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        jobs = list(self._jobs.values())
+        if jobs:
+            _, pending = await asyncio.wait(jobs, timeout=BROADCAST_STOP_TIMEOUT)
+            for job in pending:
+                job.cancel()
+            await asyncio.gather(*jobs, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {**self._stats, "running": sorted(self._jobs)}
@@ -0,0 +1,169 @@
+"""
+Per-bot catalog cache for Store Bots.
+
+Categories, products and stock counts change rarely compared to how often
+buyers browse them, so each bot's active catalog is loaded once and served
+from memory until it expires or is invalidated. Writers (admin handlers,
+web dashboard) invalidate through PostgreSQL NOTIFY so every bot runner
+process drops its copy.
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import database_async
+from database_async import (
+    get_categories_by_bot,
+    get_products_by_bot,
+    get_category_by_id,
+    get_product_by_id
+)
+
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+CATALOG_CHANNEL = "catalog_invalidate"
+
+
+@dataclass
+class CatalogSnapshot:
+    """Active categories and products of one bot."""
+    categories: list[dict]
+    categories_by_id: dict[int, dict]
+    products_by_id: dict[int, dict]
+    products_by_category: dict[int, list[dict]] = field(default_factory=dict)
+    loaded_at: float = 0.0
+
+
+class CatalogCache:
+    """TTL cache of bot catalogs with single-flight loading."""
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: dict[int, CatalogSnapshot] = {}
+        self._loading: dict[int, asyncio.Future] = {}
+        # Bumped on invalidation so a load that raced it is not stored
+        self._generation: dict[int, int] = {}
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0}
+
+    async def _load(self, bot_id: int) -> CatalogSnapshot:
+        categories = await get_categories_by_bot(bot_id)
+        products = await get_products_by_bot(bot_id)
+
+        snapshot = CatalogSnapshot(
+            categories=categories,
+            categories_by_id={c['id']: c for c in categories},
+            products_by_id={p['id']: p for p in products},
+            loaded_at=time.monotonic()
+        )
+        for product in products:
+            snapshot.products_by_category.setdefault(product['category_id'], []).append(product)
+        return snapshot
+
+    async def get(self, bot_id: int) -> CatalogSnapshot:
+        """Get a bot's catalog, loading it at most once for concurrent callers."""
+        snapshot = self._entries.get(bot_id)
+        if snapshot and time.monotonic() - snapshot.loaded_at < self.ttl:
+            self._stats["hits"] += 1
+            return snapshot
+
+        self._stats["misses"] += 1
+        future = self._loading.get(bot_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[bot_id] = future
+        generation = self._generation.get(bot_id, 0)
+        try:
+            snapshot = await self._load(bot_id)
+            self._stats["loads"] += 1
+            if self._generation.get(bot_id, 0) == generation:
+                self._entries[bot_id] = snapshot
+            future.set_result(snapshot)
+            return snapshot
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so waiter-less failures are not logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._loading[bot_id]
+
+    async def get_categories(self, bot_id: int) -> list[dict]:
+        return (await self.get(bot_id)).categories
+
+    async def get_category(self, bot_id: int, category_id: int) -> Optional[dict]:
+        category = (await self.get(bot_id)).categories_by_id.get(category_id)
+        if category is None:
+            # Inactive categories are not cached
+            category = await get_category_by_id(category_id)
+        return category
+
+    async def get_products_by_category(self, bot_id: int, category_id: int) -> list[dict]:
+        return (await self.get(bot_id)).products_by_category.get(category_id, [])
+
+    async def get_product(self, bot_id: int, product_id: int) -> Optional[dict]:
+        product = (await self.get(bot_id)).products_by_id.get(product_id)
+        if product is None:
+            # Inactive products are not cached
+            product = await get_product_by_id(product_id)
+        return product
+
+    def record_reservation(self, bot_id: int, product_id: int, quantity: int = 1):
+        """Move cached stock from available to reserved after a checkout reserved it."""
+        snapshot = self._entries.get(bot_id)
+        product = snapshot.products_by_id.get(product_id) if snapshot else None
+        if product and product.get('stock'):
+            moved = min(product['stock'], quantity)
+            product['stock'] -= moved
+            product['reserved_stock'] = (product.get('reserved_stock') or 0) + moved
+
+    def record_sale(self, bot_id: int, product_id: int, quantity: int = 1):
+        """Decrement the cached stock counts after a stock item was claimed."""
+        snapshot = self._entries.get(bot_id)
+        product = snapshot.products_by_id.get(product_id) if snapshot else None
+        if not product:
+            return
+        # Sales normally consume the order's reservation
+        from_reserved = min(product.get('reserved_stock') or 0, quantity)
+        if from_reserved:
+            product['reserved_stock'] -= from_reserved
+        if product.get('stock') and quantity > from_reserved:
+            product['stock'] = max(0, product['stock'] - (quantity - from_reserved))
+
+    def invalidate_local(self, bot_id: Optional[int] = None):
+        """Drop one bot's catalog (or all of them) from this process."""
+        self._stats["invalidations"] += 1
+        if bot_id is None:
+            for key in set(self._entries) | set(self._loading):
+                self._generation[key] = self._generation.get(key, 0) + 1
+            self._entries.clear()
+        else:
+            self._generation[bot_id] = self._generation.get(bot_id, 0) + 1
+            self._entries.pop(bot_id, None)
+
+    async def invalidate(self, bot_id: int):
+        """Drop a bot's catalog here and in every other bot runner process."""
+        self.invalidate_local(bot_id)
+        try:
+            await database_async.notify(CATALOG_CHANNEL, str(bot_id))
+        except Exception as e:
+            print(f"⚠️ Failed to broadcast catalog invalidation for bot {bot_id}: {e}")
+
+    def _on_notify(self, payload: Optional[str]):
+        try:
+            self.invalidate_local(int(payload) if payload else None)
+        except ValueError:
+            self.invalidate_local()
+
+    async def start(self):
+        """Subscribe to cross-process invalidations."""
+        await database_async.add_listener(CATALOG_CHANNEL, self._on_notify)
+
+    def stats(self) -> dict:
+        return {**self._stats, "bots": len(self._entries), "ttl": self.ttl}
+
+
+catalog_cache = CatalogCache()
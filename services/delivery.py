@@ -1,103 +1,246 @@
 """
-Product delivery service for digital products.
+Product delivery queue for Store Bots.
+
+Paying for an order queues a row in `deliveries` in the same transaction
+that marks it paid (database_async.complete_order). Worker coroutines in
+the bot's runner lease due rows and send the product to the buyer, so
+payment confirmation never waits on Telegram:
+
+- sends go ahead of other traffic in the bot's rate limiter; a RetryAfter
+  it passes on pauses that bot for the time Telegram asks for
+- network errors and timeouts are retried with exponential backoff
+- buyers who blocked the bot and unknown chats fail the delivery without
+  retrying; blocked buyers are flagged in bot_users
+
+Long content is split into several messages; the items of a
+multi-quantity order go out as one text file instead. Each sent message
+is stored as a receipt, so a retry continues after the last part that
+went out.
 """
 
-from telegram import Bot
-from database import Product
+import asyncio
+import logging
 import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Optional, Union
 
+from telegram.error import BadRequest, TelegramError
 
-async def deliver_product(bot: Bot, chat_id: int, product: Product, order_id: str):
-    """
-    Deliver a digital product to the buyer.
-    
-    Args:
-        bot: Telegram bot instance
-        chat_id: User's Telegram chat ID
-        product: Product to deliver
-        order_id: Order ID for reference
-    """
-    # Send success notification first
-    await bot.send_message(
-        chat_id=chat_id,
-        text=(
-            f"✅ *Pembayaran Berhasil!*\n\n"
-            f"🛒 *Pesanan:* `{order_id}`\n"
-            f"📦 *Produk:* {product.name}\n\n"
-            f"Berikut adalah produk Anda:"
-        ),
-        parse_mode="Markdown"
-    )
-    
-    # Deliver based on content type
-    if product.content_type == "file":
-        await _deliver_file(bot, chat_id, product)
-    elif product.content_type == "code":
-        await _deliver_code(bot, chat_id, product)
-    else:  # text
-        await _deliver_text(bot, chat_id, product)
-    
-    # Send thank you message
-    await bot.send_message(
-        chat_id=chat_id,
-        text=(
-            "🙏 *Terima kasih atas pembelian Anda!*\n\n"
-            "Jika ada pertanyaan, silakan hubungi admin."
-        ),
-        parse_mode="Markdown"
+from database_async import claim_deliveries, record_delivery_part, finish_delivery, retry_delivery
+from services.blocked_users import mark_blocked
+from utils.rate_limiter import PRIORITY_DELIVERY
+from utils.telegram_errors import (
+    BLOCKED, RATE_LIMITED, TRANSIENT, classify_send_error, retry_after_seconds
+)
+from utils.events import wait_event
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "8"))
+DELIVERY_POLL_INTERVAL = float(os.getenv("DELIVERY_POLL_INTERVAL", "5"))
+DELIVERY_BATCH = int(os.getenv("DELIVERY_BATCH", "50"))
+# Seconds a worker holds a delivery before another may take it over
+DELIVERY_LEASE = float(os.getenv("DELIVERY_LEASE", "120"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "10"))
+DELIVERY_BACKOFF_BASE = float(os.getenv("DELIVERY_BACKOFF_BASE", "2"))
+DELIVERY_BACKOFF_MAX = float(os.getenv("DELIVERY_BACKOFF_MAX", "600"))
+
+# Telegram allows 4096 characters per message; leave room for the header
+MAX_MESSAGE_LENGTH = 4000
+
+
+def split_text(content: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Split content into chunks Telegram accepts."""
+    return [content[i:i + max_length] for i in range(0, len(content), max_length)] or [""]
+
+
+@dataclass
+class DeliveryDocument:
+    """The items of a multi-quantity order, sent as one text file."""
+    filename: str
+    content: bytes
+    caption: str
+
+
+def build_messages(delivery: dict) -> list[Union[str, DeliveryDocument]]:
+    """Messages for one delivery, in send order."""
+    header = (
+        f"✅ *Pembayaran Berhasil!*\n\n"
+        f"Order: `{delivery['order_code']}`\n\n"
     )
+    if not delivery['items']:
+        return [header + "⚠️ Mohon hubungi admin untuk pengiriman produk."]
+
+    quantity = delivery.get('quantity') or 1
+    if quantity > 1:
+        missing = quantity - len(delivery['items'])
+        caption = header + f"📦 *Produk Anda:* {len(delivery['items'])} item, ada di file terlampir."
+        if missing > 0:
+            caption += f"\n\n⚠️ {missing} item belum tersedia. Mohon hubungi admin."
+        content = "\n".join(delivery['items']) + "\n"
+        return [DeliveryDocument(f"{delivery['order_code']}.txt", content.encode(), caption)]
+
+    content = "\n".join(delivery['items'])
+    parts = split_text(content, MAX_MESSAGE_LENGTH - len(header) - 40)
+    if len(parts) == 1:
+        return [f"{header}📦 *Produk Anda:*\n```\n{content}\n```"]
+    return [
+        (header if i == 1 else "") + f"📦 *Produk Anda* (Part {i}/{len(parts)})\n```\n{part}\n```"
+        for i, part in enumerate(parts, 1)
+    ]
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(DELIVERY_BACKOFF_MAX, DELIVERY_BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
 
 
-async def _deliver_file(bot: Bot, chat_id: int, product: Product):
-    """Deliver product as a file."""
-    file_path = product.content
-    
-    if os.path.exists(file_path):
-        with open(file_path, 'rb') as f:
-            await bot.send_document(
-                chat_id=chat_id,
-                document=f,
-                caption=f"📁 {product.name}"
+class DeliveryQueue:
+    """Sends queued deliveries for the bots this process runs."""
+
+    def __init__(self, manager, workers: int = DELIVERY_WORKERS):
+        """
+        Args:
+            manager: BotManager whose running bots send the messages
+            workers: Deliveries sent concurrently
+        """
+        self.manager = manager
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._queued: set[int] = set()
+        self._wake = asyncio.Event()
+        # bot_id -> monotonic time its RetryAfter ends
+        self._paused_until: dict[int, float] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._stats = {
+            "sent": 0, "messages": 0, "retried": 0, "rate_limited": 0,
+            "failed": 0, "errors": 0,
+        }
+
+    def wake(self):
+        """Look for new deliveries now instead of at the next poll."""
+        self._wake.set()
+
+    async def _poll(self):
+        """Lease due deliveries and feed them to the workers."""
+        while True:
+            try:
+                now = time.monotonic()
+                bot_ids = [
+                    bot_id for bot_id in self.manager.bots
+                    if self._paused_until.get(bot_id, 0) <= now
+                ]
+                room = DELIVERY_BATCH - self._queue.qsize()
+                if bot_ids and room > 0:
+                    for delivery in await claim_deliveries(bot_ids, room, DELIVERY_LEASE):
+                        if delivery['id'] not in self._queued:
+                            self._queued.add(delivery['id'])
+                            self._queue.put_nowait(delivery)
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Claiming deliveries failed: {e}")
+
+            self._wake.clear()
+            await wait_event(self._wake, DELIVERY_POLL_INTERVAL)
+
+    async def _worker(self):
+        while True:
+            delivery = await self._queue.get()
+            try:
+                await self._deliver(delivery)
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Delivery {delivery['id']} crashed: {e}")
+            finally:
+                self._queued.discard(delivery['id'])
+
+    async def _deliver(self, delivery: dict):
+        instance = self.manager.bots.get(delivery['bot_id'])
+        if instance is None:
+            # Bot stopped or moved to another worker; its new owner picks this up
+            await retry_delivery(delivery['id'], 0, "bot not running here")
+            return
+
+        paused = self._paused_until.get(delivery['bot_id'], 0) - time.monotonic()
+        if paused > 0:
+            await retry_delivery(delivery['id'], paused, "rate limited")
+            return
+
+        messages = build_messages(delivery)
+        try:
+            for index in range(delivery['parts_sent'], len(messages)):
+                message = await self._send(instance.app.bot, delivery['chat_id'], messages[index])
+                await record_delivery_part(delivery['id'], index + 1, message.message_id)
+                self._stats["messages"] += 1
+        except TelegramError as e:
+            kind = classify_send_error(e)
+            if kind == RATE_LIMITED:
+                retry_after = retry_after_seconds(e)
+                self._paused_until[delivery['bot_id']] = time.monotonic() + retry_after
+                self._stats["rate_limited"] += 1
+                await retry_delivery(delivery['id'], retry_after, str(e))
+            elif kind == TRANSIENT and delivery['attempts'] < DELIVERY_MAX_ATTEMPTS:
+                self._stats["retried"] += 1
+                await retry_delivery(delivery['id'], _backoff(delivery['attempts']), str(e))
+            else:
+                # Blocked by the buyer, chat gone or out of attempts: retrying cannot help
+                if kind == BLOCKED:
+                    mark_blocked(delivery['bot_id'], delivery['chat_id'])
+                self._stats["failed"] += 1
+                await finish_delivery(delivery['id'], 'failed', str(e))
+                logger.warning(f"Delivery {delivery['id']} of order {delivery['order_code']} failed ({kind}): {e}")
+            return
+
+        await finish_delivery(delivery['id'])
+        self._stats["sent"] += 1
+
+    @staticmethod
+    async def _send(bot, chat_id: int, message: Union[str, DeliveryDocument]):
+        if isinstance(message, DeliveryDocument):
+            return await bot.send_document(
+                chat_id=chat_id, document=message.content, filename=message.filename,
+                caption=message.caption, parse_mode="Markdown", rate_limit_args=PRIORITY_DELIVERY
             )
-    else:
-        # If file doesn't exist, send path as text
-        await bot.send_message(
-            chat_id=chat_id,
-            text=f"📥 *Download Link:*\n{product.content}",
-            parse_mode="Markdown"
-        )
-
-
-async def _deliver_text(bot: Bot, chat_id: int, product: Product):
-    """Deliver product as text message."""
-    # Split long messages if needed (Telegram limit is 4096 chars)
-    content = product.content
-    max_length = 4000
-    
-    if len(content) <= max_length:
-        await bot.send_message(
-            chat_id=chat_id,
-            text=f"📝 *{product.name}*\n\n{content}",
-            parse_mode="Markdown"
-        )
-    else:
-        # Split into multiple messages
-        parts = [content[i:i+max_length] for i in range(0, len(content), max_length)]
-        for i, part in enumerate(parts, 1):
-            await bot.send_message(
-                chat_id=chat_id,
-                text=f"📝 *{product.name}* (Part {i}/{len(parts)})\n\n{part}",
-                parse_mode="Markdown"
+        try:
+            return await bot.send_message(
+                chat_id=chat_id, text=message, parse_mode="Markdown", rate_limit_args=PRIORITY_DELIVERY
             )
+        except BadRequest as e:
+            if "parse entities" not in str(e).lower():
+                raise
+            # Content that breaks Markdown still has to reach the buyer
+            return await bot.send_message(chat_id=chat_id, text=message, rate_limit_args=PRIORITY_DELIVERY)
 
+    async def start(self):
+        global _active
+        _active = self
+        self._tasks = [asyncio.create_task(self._poll())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
 
-async def _deliver_code(bot: Bot, chat_id: int, product: Product):
-    """Deliver product as code block."""
-    content = product.content
-    
-    # Send as code block
-    await bot.send_message(
-        chat_id=chat_id,
-        text=f"💻 *{product.name}*\n\n```\n{content}\n```",
-        parse_mode="Markdown"
-    )
+    async def stop(self):
+        """Stop sending; leased deliveries are retried when their lease ends."""
+        global _active
+        if _active is self:
+            _active = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "queued": self._queue.qsize(),
+            "paused_bots": sum(1 for t in self._paused_until.values() if t > time.monotonic()),
+        }
+
+
+_active: Optional[DeliveryQueue] = None
+
+
+def wake_deliveries():
+    """Tell the running delivery queue, if any, that new deliveries exist."""
+    if _active is not None:
+        _active.wake()
@@ -0,0 +1,244 @@
+"""
+Flash-sale stock pools.
+
+When a store announces a drop, hundreds of buyers check out one product
+within seconds, and every reservation is a statement that locks
+product_stock rows and updates the product's counters row. For products
+with flash_sale on, this worker reserves stock in bulk under its own
+holder key (up to FLASH_POOL_SIZE items per product), hands the items to
+checkouts from memory and refills the pool in the background when it
+runs low.
+
+Handing an item to an order is persisted with group commit: the
+(stock item, order code) pairs of all checkouts within
+FLASH_COMMIT_WINDOW go out in one UPDATE, and each checkout waits for
+that commit before its Pakasir transaction is created. Stock numbers stay
+exact because the database always knows who holds an item: pooled items
+are reserved to the holder, whose hold is renewed while the worker runs.
+After a crash the expiry sweeper frees them once the hold runs out
+(release_stale_reservations), like any checkout that never created its
+order.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from database_async import (
+    reserve_stock_batch, assign_reserved_stock, renew_reservations, release_stock_items
+)
+from utils.events import wait_event
+
+logger = logging.getLogger(__name__)
+
+FLASH_POOL_SIZE = int(os.getenv("FLASH_POOL_SIZE", "200"))
+# Refill once a pool is down to this many items
+FLASH_POOL_LOW = int(os.getenv("FLASH_POOL_LOW", "50"))
+# Seconds pooled items stay reserved without renewal (renewed every third of it)
+FLASH_POOL_HOLD = float(os.getenv("FLASH_POOL_HOLD", "120"))
+# Pools of products nobody bought from for this long are returned
+FLASH_POOL_IDLE = float(os.getenv("FLASH_POOL_IDLE", "600"))
+# Group commit: wait this long for more checkouts, or until this many are waiting
+FLASH_COMMIT_WINDOW = float(os.getenv("FLASH_COMMIT_WINDOW", "0.01"))
+FLASH_COMMIT_BATCH = int(os.getenv("FLASH_COMMIT_BATCH", "200"))
+
+
+@dataclass
+class _Pool:
+    """Stock items of one product reserved to this worker."""
+    items: deque = field(default_factory=deque)
+    refilling: Optional[asyncio.Task] = None
+    last_used: float = 0.0
+
+
+class FlashSalePools:
+    """In-process stock pools for flash-sale products, with group-committed hand-outs."""
+
+    def __init__(self, holder: Optional[str] = None):
+        """
+        Args:
+            holder: reserved_for key of pooled items; defaults to FLASH:host:pid
+        """
+        self.holder = (holder or f"FLASH:{socket.gethostname()}:{os.getpid()}")[:50]
+        self._pools: dict[int, _Pool] = {}
+        # (product_id, stock_id, order_id, hold, future) waiting for the next commit
+        self._batch: list[tuple[int, int, str, float, asyncio.Future]] = []
+        self._pending = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "handed_out": 0, "commits": 0, "committed": 0, "lost": 0,
+            "refills": 0, "refilled": 0, "sold_out": 0, "released": 0, "errors": 0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def pooled(self, product_id: int) -> int:
+        """Items of a product waiting in this worker's pool."""
+        pool = self._pools.get(product_id)
+        return len(pool.items) if pool else 0
+
+    def has_pool(self, product_id: int) -> bool:
+        return product_id in self._pools
+
+    async def reserve(self, product_id: int, order_id: str, hold: float) -> bool:
+        """
+        Reserve one item of a flash-sale product for an order code.
+
+        Returns False if the pool and the free stock are empty, or the
+        item could not be committed; the caller may then fall back to
+        database_async.reserve_stock.
+        """
+        pool = self._pools.setdefault(product_id, _Pool())
+        pool.last_used = time.monotonic()
+
+        # Concurrent checkouts may drain a refill before this one gets an item
+        for _ in range(3):
+            if pool.items:
+                break
+            await asyncio.shield(self._refill_soon(product_id, pool))
+        if not pool.items:
+            self._stats["sold_out"] += 1
+            return False
+
+        stock_id = pool.items.popleft()
+        self._stats["handed_out"] += 1
+        if len(pool.items) < FLASH_POOL_LOW:
+            self._refill_soon(product_id, pool)
+
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((product_id, stock_id, order_id, hold, future))
+        self._pending.set()
+        if len(self._batch) >= FLASH_COMMIT_BATCH:
+            self._full.set()
+        return await future
+
+    def _refill_soon(self, product_id: int, pool: _Pool) -> asyncio.Task:
+        if pool.refilling is None or pool.refilling.done():
+            pool.refilling = asyncio.create_task(self._refill(product_id, pool))
+        return pool.refilling
+
+    async def _refill(self, product_id: int, pool: _Pool):
+        wanted = FLASH_POOL_SIZE - len(pool.items)
+        if wanted <= 0:
+            return
+        try:
+            stock_ids = await reserve_stock_batch(self.holder, product_id, wanted, FLASH_POOL_HOLD)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Refilling flash-sale pool of product {product_id} failed: {e}")
+            return
+        self._stats["refills"] += 1
+        self._stats["refilled"] += len(stock_ids)
+        if self._pools.get(product_id) is pool:
+            pool.items.extend(stock_ids)
+        elif stock_ids:
+            # The pool was released while refilling
+            await release_stock_items(self.holder, stock_ids)
+
+    async def _commit(self, batch: list):
+        """Move a batch of handed-out items to their orders in one statement."""
+        self._stats["commits"] += 1
+        try:
+            # Every checkout in a batch uses the same hold; take the longest to be safe
+            hold = max(entry[3] for entry in batch)
+            committed = set(await assign_reserved_stock(
+                self.holder, [(stock_id, order_id) for _, stock_id, order_id, _, _ in batch], hold
+            ))
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Flash-sale commit of {len(batch)} item(s) failed: {e}")
+            committed = set()
+            # Nothing moved; the items are still ours (or lapse to the sweeper if the pool is gone)
+            for product_id, stock_id, *_ in batch:
+                pool = self._pools.get(product_id)
+                if pool is not None:
+                    pool.items.appendleft(stock_id)
+
+        for _, stock_id, _, _, future in batch:
+            ok = stock_id in committed
+            if ok:
+                self._stats["committed"] += 1
+            else:
+                self._stats["lost"] += 1
+            if not future.done():
+                future.set_result(ok)
+
+    async def _maintain(self):
+        """Renew the hold on pooled items and return idle pools."""
+        now = time.monotonic()
+        for product_id, pool in list(self._pools.items()):
+            if now - pool.last_used > FLASH_POOL_IDLE:
+                await self.release(product_id)
+        if any(pool.items for pool in self._pools.values()):
+            await renew_reservations(self.holder, FLASH_POOL_HOLD)
+
+    async def _run(self):
+        next_renew = time.monotonic() + FLASH_POOL_HOLD / 3
+        while True:
+            await wait_event(self._pending, next_renew - time.monotonic())
+            if self._batch:
+                # Linger briefly so concurrent checkouts share the commit
+                await wait_event(self._full, FLASH_COMMIT_WINDOW)
+                self._full.clear()
+                self._pending.clear()
+                batch, self._batch = self._batch, []
+                await self._commit(batch)
+            else:
+                self._pending.clear()
+
+            if time.monotonic() >= next_renew:
+                next_renew = time.monotonic() + FLASH_POOL_HOLD / 3
+                try:
+                    await self._maintain()
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    logger.error(f"Flash-sale pool maintenance failed: {e}")
+
+    async def release(self, product_id: int):
+        """Return a product's pooled items to the free stock (flash sale ended or idle)."""
+        pool = self._pools.pop(product_id, None)
+        if pool is None:
+            return
+        if pool.refilling is not None:
+            pool.refilling.cancel()
+        if pool.items:
+            released = await release_stock_items(self.holder, list(pool.items))
+            self._stats["released"] += released
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Commit waiting hand-outs and return every pool to the free stock."""
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            if self._batch:
+                batch, self._batch = self._batch, []
+                await self._commit(batch)
+            for product_id in list(self._pools):
+                await self.release(product_id)
+        except Exception as e:
+            # Whatever is left is freed by the expiry sweeper once the hold runs out
+            logger.error(f"Releasing flash-sale pools failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "pools": {product_id: len(pool.items) for product_id, pool in self._pools.items()},
+            "waiting": len(self._batch),
+        }
+
+
+# Process-wide pools shared by all bots
+flash_sales = FlashSalePools()
@@ -0,0 +1,40 @@
+"""
+Order fulfillment for Store Bots.
+
+Shared by the "check status" button, the background payment reconciler
+and anything else that learns an order was paid: whichever gets there
+first marks the order paid, claims its stock and queues the delivery to
+the buyer (services/delivery.py). The others find the order no longer
+pending and do nothing, so an order is delivered once.
+"""
+
+from datetime import datetime
+
+from database_async import complete_order
+from services.catalog_cache import catalog_cache
+from services.delivery import wake_deliveries
+
+# fulfill_order() results
+DELIVERED = "delivered"
+NO_STOCK = "no_stock"
+ALREADY_PAID = "already_paid"
+
+
+async def fulfill_order(order_id: str, paid_at: datetime = None) -> str:
+    """
+    Complete a paid order and queue its product for the buyer.
+
+    Returns DELIVERED (queued for sending), NO_STOCK (paid but the product
+    ran out before all items were claimed; the buyer gets what was claimed
+    and is told to contact the admin for the rest) or ALREADY_PAID if
+    another caller completed the order first.
+    """
+    result = await complete_order(order_id, paid_at or datetime.now())
+    if result is None:
+        return ALREADY_PAID
+
+    order, stock_items = result
+    if stock_items:
+        catalog_cache.record_sale(order['bot_id'], order['product_id'], len(stock_items))
+    wake_deliveries()
+    return DELIVERED if len(stock_items) >= order['quantity'] else NO_STOCK
@@ -0,0 +1,123 @@
+"""
+Pending order expiry sweeper.
+
+Orders whose QRIS has expired are moved from pending to expired in
+batches, then cancelled at Pakasir with bounded concurrency. Each batch
+is claimed with FOR UPDATE SKIP LOCKED, so every worker can run a sweeper
+and they split the work instead of repeating it. An order Pakasir reports
+as paid after all is reopened and handed to its payment reconciler.
+
+Expiring an order releases its reserved stock in the same statement. The
+sweep then releases reservations left behind by cancelled orders and by
+checkouts whose order was never created.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from database_async import expire_pending_orders, reopen_expired_order, release_stale_reservations
+from services.pakasir import PakasirClient
+
+logger = logging.getLogger(__name__)
+
+ORDER_SWEEP_ENABLED = os.getenv("ORDER_SWEEP_ENABLED", "true").lower() == "true"
+ORDER_SWEEP_INTERVAL = float(os.getenv("ORDER_SWEEP_INTERVAL", "60"))
+ORDER_SWEEP_BATCH = int(os.getenv("ORDER_SWEEP_BATCH", "500"))
+# Batches per sweep, so one sweep cannot run unbounded after downtime
+ORDER_SWEEP_MAX_BATCHES = int(os.getenv("ORDER_SWEEP_MAX_BATCHES", "20"))
+# Seconds past expired_at before an order is expired; must outlast
+# RECONCILER_EXPIRY_GRACE so late payments are still picked up
+ORDER_EXPIRY_GRACE = float(os.getenv("ORDER_EXPIRY_GRACE", "300"))
+# Lifetime of orders created without expired_at
+ORDER_UNTIMED_TTL = float(os.getenv("ORDER_UNTIMED_TTL", "86400"))
+ORDER_CANCEL_CONCURRENCY = int(os.getenv("ORDER_CANCEL_CONCURRENCY", "10"))
+
+
+class OrderExpirySweeper:
+    """Periodically expires overdue pending orders."""
+
+    def __init__(self, interval: float = ORDER_SWEEP_INTERVAL, batch_size: int = ORDER_SWEEP_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._cancel_slots = asyncio.Semaphore(ORDER_CANCEL_CONCURRENCY)
+        self._task = None
+        self._stats = {
+            "sweeps": 0, "expired": 0, "cancelled": 0, "cancel_failed": 0,
+            "reopened": 0, "reservations_released": 0, "errors": 0,
+            "last_sweep_ms": 0.0, "last_expired": 0,
+        }
+
+    async def _cancel_upstream(self, order: dict):
+        """Cancel at Pakasir; reopen the order if it turns out to be paid."""
+        if not order['pakasir_slug'] or not order['pakasir_api_key']:
+            return
+        client = PakasirClient(order['pakasir_slug'], order['pakasir_api_key'])
+        async with self._cancel_slots:
+            if await client.cancel_transaction(order['order_id'], order['amount']):
+                self._stats["cancelled"] += 1
+                return
+            status = await client.get_transaction_status(order['order_id'], order['amount'])
+
+        if status and status.status == "completed":
+            if await reopen_expired_order(order['order_id']):
+                self._stats["reopened"] += 1
+                logger.warning(f"Order {order['order_id']} was paid after expiry, reopened")
+        else:
+            # Usually already expired at Pakasir too
+            self._stats["cancel_failed"] += 1
+
+    async def sweep(self) -> int:
+        """Expire overdue orders in batches. Returns how many were expired."""
+        started = time.monotonic()
+        total = 0
+        for _ in range(ORDER_SWEEP_MAX_BATCHES):
+            orders = await expire_pending_orders(ORDER_EXPIRY_GRACE, ORDER_UNTIMED_TTL, self.batch_size)
+            total += len(orders)
+            self._stats["expired"] += len(orders)
+            results = await asyncio.gather(
+                *[self._cancel_upstream(order) for order in orders], return_exceptions=True
+            )
+            for order, result in zip(orders, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Upstream cancel of order {order['order_id']} failed: {result}")
+            if len(orders) < self.batch_size:
+                break
+
+        for _ in range(ORDER_SWEEP_MAX_BATCHES):
+            released = await release_stale_reservations(self.batch_size)
+            self._stats["reservations_released"] += released
+            if released < self.batch_size:
+                break
+
+        self._stats["sweeps"] += 1
+        self._stats["last_expired"] = total
+        self._stats["last_sweep_ms"] = round((time.monotonic() - started) * 1000, 1)
+        if total:
+            logger.info(f"Expired {total} pending order(s) in {self._stats['last_sweep_ms']}ms")
+        return total
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Order expiry sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return dict(self._stats)
@@ -1,14 +1,36 @@
 """
 Pakasir API Client for QRIS payment integration.
 Supports per-bot configuration for multi-bot platform.
+
+All clients in a process share one pooled HTTP session (keep-alive, DNS
+cache), with per-request timeouts, bounded retries and a circuit breaker.
 """
 
-import aiohttp
+import asyncio
+import os
+import random
+import time
 from typing import Optional
 from dataclasses import dataclass
 
+import aiohttp
+
+
+PAKASIR_API_BASE_URL = os.getenv("PAKASIR_API_BASE_URL", "https://app.pakasir.com/api").rstrip("/")
+
+PAKASIR_POOL_SIZE = int(os.getenv("PAKASIR_POOL_SIZE", "100"))
+PAKASIR_TIMEOUT = float(os.getenv("PAKASIR_TIMEOUT", "10"))
+PAKASIR_CONNECT_TIMEOUT = float(os.getenv("PAKASIR_CONNECT_TIMEOUT", "3"))
+PAKASIR_MAX_RETRIES = int(os.getenv("PAKASIR_MAX_RETRIES", "2"))
+PAKASIR_RETRY_BASE = float(os.getenv("PAKASIR_RETRY_BASE", "0.2"))
+# Consecutive failures that open the circuit, and how long it stays open
+PAKASIR_BREAKER_THRESHOLD = int(os.getenv("PAKASIR_BREAKER_THRESHOLD", "5"))
+PAKASIR_BREAKER_RESET = float(os.getenv("PAKASIR_BREAKER_RESET", "30"))
 
-PAKASIR_API_BASE_URL = "https://app.pakasir.com/api"
+# Latency histogram bucket upper bounds (ms)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
 
 
 @dataclass
@@ -34,175 +56,413 @@ class TransactionStatus:
     completed_at: Optional[str] = None
 
 
+class PakasirUnavailable(Exception):
+    """Pakasir could not be reached (circuit open, timeouts or 5xx after retries)."""
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram for one endpoint."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+
+    def observe(self, ms: float, ok: bool = True):
+        index = 0
+        while index < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        if not ok:
+            self.errors += 1
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given percentile."""
+        if not self.count:
+            return None
+        target = self.count * pct / 100
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": dict(zip([*map(str, LATENCY_BUCKETS_MS), "+Inf"], self.buckets)),
+        }
+
+
+class CircuitBreaker:
+    """Fail fast after repeated upstream failures, probing again after a cool-down."""
+
+    def __init__(self, threshold: int = PAKASIR_BREAKER_THRESHOLD, reset_after: float = PAKASIR_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            # Let exactly one request through to test the upstream
+            self._probing = True
+            return True
+        return False
+
+    @property
+    def probing(self) -> bool:
+        """A half-open probe is in flight."""
+        return self._probing
+
+    def end_probe(self):
+        """Let another probe through after one ended without a verdict (cancelled, unexpected error)."""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class PakasirHTTP:
+    """Process-wide pooled transport shared by every PakasirClient."""
+
+    def __init__(self, base_url: str = PAKASIR_API_BASE_URL):
+        self.base_url = base_url
+        self.breaker = CircuitBreaker()
+        self.histograms: dict[str, LatencyHistogram] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {"requests": 0, "retries": 0, "short_circuited": 0}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        # A session is bound to the loop it was created on
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=PAKASIR_POOL_SIZE,
+                ttl_dns_cache=300,
+                keepalive_timeout=30,
+                enable_cleanup_closed=True
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=PAKASIR_TIMEOUT, connect=PAKASIR_CONNECT_TIMEOUT)
+            )
+            self._loop = loop
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(
+        self,
+        endpoint: str,
+        method: str,
+        path: str,
+        *,
+        json: dict = None,
+        params: dict = None,
+        idempotent: bool = True
+    ) -> tuple[int, Optional[dict], str]:
+        """
+        Call the Pakasir API.
+
+        Args:
+            endpoint: Name used for metrics (transactioncreate, ...)
+            method: HTTP method
+            path: Path below the API base URL
+            json: JSON body
+            params: Query parameters
+            idempotent: Retry after timeouts and 5xx. Non-idempotent calls
+                are only retried when the connection could not be opened,
+                i.e. the request was never sent.
+
+        Returns:
+            (status, JSON body or None, raw text)
+
+        Raises:
+            PakasirUnavailable: circuit open or retries exhausted
+        """
+        histogram = self.histograms.setdefault(endpoint, LatencyHistogram())
+        url = f"{self.base_url}/{path}"
+        last_error = None
+
+        for attempt in range(PAKASIR_MAX_RETRIES + 1):
+            if not self.breaker.allow():
+                self._stats["short_circuited"] += 1
+                raise PakasirUnavailable(f"circuit open ({endpoint})")
+            # Only the half-open probe sees probing set right after allow()
+            probe = self.breaker.probing
+
+            try:
+                if attempt:
+                    self._stats["retries"] += 1
+                    # Full jitter spreads retries from many bots hitting the same outage
+                    await asyncio.sleep(random.uniform(0, PAKASIR_RETRY_BASE * 2 ** attempt))
+
+                self._stats["requests"] += 1
+                started = time.perf_counter()
+                try:
+                    async with self._get_session().request(method, url, json=json, params=params) as response:
+                        text = await response.text()
+                        elapsed_ms = (time.perf_counter() - started) * 1000
+
+                        if response.status in RETRYABLE_STATUS:
+                            histogram.observe(elapsed_ms, ok=False)
+                            self.breaker.record_failure()
+                            last_error = f"HTTP {response.status}"
+                            if idempotent:
+                                continue
+                            return response.status, None, text
+
+                        histogram.observe(elapsed_ms)
+                        self.breaker.record_success()
+                        try:
+                            data = await response.json(content_type=None)
+                        except ValueError:
+                            data = None
+                        return response.status, data, text
+                except aiohttp.ClientConnectorError as e:
+                    histogram.observe((time.perf_counter() - started) * 1000, ok=False)
+                    self.breaker.record_failure()
+                    last_error = str(e)
+                except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                    histogram.observe((time.perf_counter() - started) * 1000, ok=False)
+                    self.breaker.record_failure()
+                    last_error = str(e) or type(e).__name__
+                    if not idempotent:
+                        break
+            finally:
+                # A cancelled probe (or one that raised something else) must not
+                # leave the circuit waiting for a verdict forever
+                if probe:
+                    self.breaker.end_probe()
+
+        raise PakasirUnavailable(f"{endpoint} failed: {last_error}")
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "circuit": self.breaker.state,
+            "endpoints": {name: h.snapshot() for name, h in self.histograms.items()},
+        }
+
+
+pakasir_http = PakasirHTTP()
+
+
+def get_pakasir_stats() -> dict:
+    """Request counts, circuit state and per-endpoint latency histograms."""
+    return pakasir_http.stats()
+
+
+async def close_pakasir_session():
+    """Close the shared HTTP session (on shutdown)."""
+    await pakasir_http.close()
+
+
 class PakasirClient:
     """Pakasir API client for payment operations."""
-    
-    def __init__(self, project_slug: str = None, api_key: str = None):
+
+    def __init__(self, project_slug: str = None, api_key: str = None, http: PakasirHTTP = None):
         """
         Initialize Pakasir client.
-        
+
         Args:
             project_slug: Pakasir project slug (per-bot)
             api_key: Pakasir API key (per-bot)
+            http: Transport to use (defaults to the shared process-wide one)
         """
-        self.base_url = PAKASIR_API_BASE_URL
+        self.http = http or pakasir_http
+        self.base_url = self.http.base_url
         self.project = project_slug or ""
         self.api_key = api_key or ""
-    
+
     async def create_transaction(
-        self, 
-        order_id: str, 
+        self,
+        order_id: str,
         amount: int,
         payment_method: str = "qris"
     ) -> Optional[PaymentResponse]:
         """
         Create a new payment transaction.
-        
+
         Args:
             order_id: Unique order identifier
             amount: Payment amount in IDR (without fee)
             payment_method: Payment method (qris, bni_va, bri_va, etc.)
-        
+
         Returns:
             PaymentResponse with QRIS string and payment details
         """
         if not self.project or not self.api_key:
             print("❌ Pakasir not configured for this bot")
             return None
-        
-        url = f"{self.base_url}/transactioncreate/{payment_method}"
+
         payload = {
             "project": self.project,
             "order_id": order_id,
             "amount": amount,
             "api_key": self.api_key
         }
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        payment = data.get("payment", {})
-                        return PaymentResponse(
-                            project=payment.get("project", ""),
-                            order_id=payment.get("order_id", ""),
-                            amount=payment.get("amount", 0),
-                            fee=payment.get("fee", 0),
-                            total_payment=payment.get("total_payment", 0),
-                            payment_method=payment.get("payment_method", ""),
-                            payment_number=payment.get("payment_number", ""),
-                            expired_at=payment.get("expired_at", "")
-                        )
-                    else:
-                        error_text = await response.text()
-                        print(f"❌ Pakasir API error: {response.status} - {error_text}")
-                        return None
-            except Exception as e:
-                print(f"❌ Pakasir API exception: {e}")
-                return None
-    
+
+        try:
+            status, data, text = await self.http.request(
+                "transactioncreate", "POST", f"transactioncreate/{payment_method}",
+                json=payload, idempotent=False
+            )
+        except PakasirUnavailable as e:
+            print(f"❌ Pakasir API exception: {e}")
+            return None
+
+        if status != 200 or data is None:
+            print(f"❌ Pakasir API error: {status} - {text}")
+            return None
+
+        payment = data.get("payment", {})
+        return PaymentResponse(
+            project=payment.get("project", ""),
+            order_id=payment.get("order_id", ""),
+            amount=payment.get("amount", 0),
+            fee=payment.get("fee", 0),
+            total_payment=payment.get("total_payment", 0),
+            payment_method=payment.get("payment_method", ""),
+            payment_number=payment.get("payment_number", ""),
+            expired_at=payment.get("expired_at", "")
+        )
+
     async def get_transaction_status(
-        self, 
-        order_id: str, 
+        self,
+        order_id: str,
         amount: int
     ) -> Optional[TransactionStatus]:
         """
         Get the status of a transaction.
-        
+
         Args:
             order_id: Order identifier
             amount: Original transaction amount
-        
+
         Returns:
             TransactionStatus with current status
         """
         if not self.project or not self.api_key:
             return None
-        
-        url = f"{self.base_url}/transactiondetail"
+
         params = {
             "project": self.project,
             "order_id": order_id,
             "amount": amount,
             "api_key": self.api_key
         }
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        tx = data.get("transaction", {})
-                        return TransactionStatus(
-                            order_id=tx.get("order_id", ""),
-                            amount=tx.get("amount", 0),
-                            status=tx.get("status", ""),
-                            payment_method=tx.get("payment_method", ""),
-                            completed_at=tx.get("completed_at")
-                        )
-                    else:
-                        return None
-            except Exception as e:
-                print(f"❌ Pakasir status check error: {e}")
-                return None
-    
+
+        try:
+            status, data, _ = await self.http.request(
+                "transactiondetail", "GET", "transactiondetail", params=params
+            )
+        except PakasirUnavailable as e:
+            print(f"❌ Pakasir status check error: {e}")
+            return None
+
+        if status != 200 or data is None:
+            return None
+
+        tx = data.get("transaction", {})
+        return TransactionStatus(
+            order_id=tx.get("order_id", ""),
+            amount=tx.get("amount", 0),
+            status=tx.get("status", ""),
+            payment_method=tx.get("payment_method", ""),
+            completed_at=tx.get("completed_at")
+        )
+
     async def cancel_transaction(self, order_id: str, amount: int) -> bool:
         """
         Cancel a pending transaction.
-        
+
         Args:
             order_id: Order identifier
             amount: Original transaction amount
-        
+
         Returns:
             True if cancelled successfully
         """
         if not self.project or not self.api_key:
             return False
-        
-        url = f"{self.base_url}/transactioncancel"
+
         payload = {
             "project": self.project,
             "order_id": order_id,
             "amount": amount,
             "api_key": self.api_key
         }
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, json=payload) as response:
-                    return response.status == 200
-            except Exception as e:
-                print(f"❌ Pakasir cancel error: {e}")
-                return False
-    
+
+        try:
+            status, _, _ = await self.http.request(
+                "transactioncancel", "POST", "transactioncancel", json=payload
+            )
+            return status == 200
+        except PakasirUnavailable as e:
+            print(f"❌ Pakasir cancel error: {e}")
+            return False
+
     async def simulate_payment(self, order_id: str, amount: int) -> bool:
         """
         Simulate a payment (only works in sandbox mode).
-        
+
         Args:
             order_id: Order identifier
             amount: Transaction amount
-        
+
         Returns:
             True if simulation successful
         """
         if not self.project or not self.api_key:
             return False
-        
-        url = f"{self.base_url}/paymentsimulation"
+
         payload = {
             "project": self.project,
             "order_id": order_id,
             "amount": amount,
             "api_key": self.api_key
         }
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, json=payload) as response:
-                    return response.status == 200
-            except Exception as e:
-                print(f"❌ Pakasir simulation error: {e}")
-                return False
+
+        try:
+            status, _, _ = await self.http.request(
+                "paymentsimulation", "POST", "paymentsimulation", json=payload, idempotent=False
+            )
+            return status == 200
+        except PakasirUnavailable as e:
+            print(f"❌ Pakasir simulation error: {e}")
+            return False
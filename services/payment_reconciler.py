@@ -0,0 +1,408 @@
+"""
+Background payment reconciler for Store Bots.
+
+Watches the pending orders of every store bot this process runs and polls
+Pakasir for their status, so buyers get their product without pressing
+"Cek Status". Orders sit in a heap keyed by their next check: right after
+checkout an order is checked every few seconds, backing off to once a
+minute, and it is dropped once its QRIS has expired. Status calls are rate
+limited per bot (each bot is its own Pakasir project, and the limit halves
+when Pakasir starts failing) and capped in total.
+
+Payments reported by the Pakasir webhook (webhook/pakasir.py) arrive as
+NOTIFY events and move the order to the front of the heap; the payment is
+still confirmed with Pakasir before delivery, since the webhook is not
+signed.
+
+The orders table is the only state. Fulfillment is a conditional
+pending -> paid update, so a restarted process simply reloads the pending
+orders it owns, and a payment seen by several checkers is delivered once.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from database_async import get_pending_orders
+from services.fulfillment import fulfill_order, ALREADY_PAID
+from services.pakasir import PakasirClient, pakasir_http
+from services.payment_status import payment_status
+from utils.events import wait_event
+
+logger = logging.getLogger(__name__)
+
+RECONCILER_ENABLED = os.getenv("RECONCILER_ENABLED", "true").lower() == "true"
+# First check after checkout, growing by RECONCILER_BACKOFF up to RECONCILER_MAX_INTERVAL
+RECONCILER_FIRST_CHECK = float(os.getenv("RECONCILER_FIRST_CHECK", "5"))
+RECONCILER_BACKOFF = float(os.getenv("RECONCILER_BACKOFF", "1.5"))
+RECONCILER_MAX_INTERVAL = float(os.getenv("RECONCILER_MAX_INTERVAL", "60"))
+# Status calls in flight across all bots, and per-bot calls per second
+RECONCILER_CONCURRENCY = int(os.getenv("RECONCILER_CONCURRENCY", "50"))
+RECONCILER_BOT_RATE = float(os.getenv("RECONCILER_BOT_RATE", "5"))
+RECONCILER_BOT_BURST = int(os.getenv("RECONCILER_BOT_BURST", "10"))
+# Reload pending orders from the database this often
+RECONCILER_SYNC_INTERVAL = float(os.getenv("RECONCILER_SYNC_INTERVAL", "30"))
+# Keep checking this long after expiry, for payments made at the last second
+RECONCILER_EXPIRY_GRACE = float(os.getenv("RECONCILER_EXPIRY_GRACE", "120"))
+# Lifetime assumed for orders without expired_at
+RECONCILER_ORDER_TTL = float(os.getenv("RECONCILER_ORDER_TTL", "3600"))
+
+
+def check_interval(attempts: int) -> float:
+    """Delay before the next check of an order checked `attempts` times."""
+    return min(RECONCILER_MAX_INTERVAL, RECONCILER_FIRST_CHECK * RECONCILER_BACKOFF ** attempts)
+
+
+def _attempts_for_age(age: float) -> int:
+    """How many checks an order of this age would have had, for restored orders."""
+    attempts, elapsed = 0, RECONCILER_FIRST_CHECK
+    while elapsed < age and check_interval(attempts) < RECONCILER_MAX_INTERVAL:
+        attempts += 1
+        elapsed += check_interval(attempts)
+    return attempts
+
+
+@dataclass
+class _TrackedOrder:
+    order_id: str
+    bot_id: int
+    amount: int
+    deadline: float
+    due: float = 0.0
+    attempts: int = 0
+    tracked_at: float = 0.0
+    reserved: bool = False
+
+
+class _BotLimiter:
+    """
+    Per-bot pacing of status calls (GCRA).
+
+    reserve() hands out send slots instead of refusing, so an order over
+    the limit is rescheduled once to its slot rather than retried. The
+    rate halves on gateway errors and recovers gradually on successes.
+    """
+
+    def __init__(self, rate: float = RECONCILER_BOT_RATE, burst: int = RECONCILER_BOT_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self._tat = 0.0
+
+    def reserve(self, now: float) -> float:
+        interval = 1.0 / self.rate
+        slot = max(now, self._tat - (self.burst - 1) * interval)
+        self._tat = max(self._tat, now) + interval
+        return slot
+
+    def on_error(self):
+        self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class PaymentReconciler:
+    """Polls Pakasir for pending orders and fulfills the paid ones."""
+
+    def __init__(
+        self,
+        manager,
+        load_pending=get_pending_orders,
+        check_status=None,
+        fulfill=fulfill_order,
+        breaker=pakasir_http.breaker
+    ):
+        """
+        Args:
+            manager: BotManager whose running store bots are reconciled
+            load_pending: async (bot_ids) -> pending order rows
+            check_status: async (instance, order_id, amount) -> TransactionStatus,
+                defaults to the bot's PakasirClient
+            fulfill: async (order_id, paid_at) -> fulfillment result
+            breaker: circuit breaker to pause on while Pakasir is down
+        """
+        self.manager = manager
+        self._load_pending = load_pending
+        self._check_status = check_status or self._pakasir_status
+        self._fulfill = fulfill
+        self._breaker = breaker
+        self._orders: dict[str, _TrackedOrder] = {}
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._limiters: dict[int, _BotLimiter] = {}
+        self._inflight: set = set()
+        self._wake = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._background: set = set()
+        self._stats = {
+            "checks": 0, "errors": 0, "delivered": 0, "no_stock": 0,
+            "already_paid": 0, "closed": 0, "expired": 0, "syncs": 0, "notified": 0,
+        }
+
+    @staticmethod
+    async def _pakasir_status(instance, order_id: str, amount: int):
+        client = PakasirClient(instance.pakasir_slug, instance.pakasir_api_key)
+        return await client.get_transaction_status(order_id, amount)
+
+    def _store_bots(self) -> dict:
+        return {
+            bot_id: instance for bot_id, instance in self.manager.bots.items()
+            if instance.bot_type == 'store'
+        }
+
+    # ---- tracking -------------------------------------------------------
+
+    def track(
+        self,
+        bot_id: int,
+        order_id: str,
+        amount: int,
+        expires_in: Optional[float] = None,
+        age: Optional[float] = None
+    ):
+        """
+        Start watching an order. Orders already tracked are left alone.
+
+        `age` is given for orders restored from the database, whose checks
+        resume at the interval they had reached instead of all at once.
+        """
+        if order_id in self._orders:
+            return
+        now = time.monotonic()
+        lifetime = expires_in if expires_in is not None else RECONCILER_ORDER_TTL - (age or 0.0)
+        tracked = _TrackedOrder(
+            order_id=order_id,
+            bot_id=bot_id,
+            amount=amount,
+            deadline=now + lifetime + RECONCILER_EXPIRY_GRACE,
+            attempts=_attempts_for_age(age or 0.0),
+            tracked_at=now
+        )
+        self._orders[order_id] = tracked
+        if age is not None:
+            self._schedule(tracked, now + random.uniform(0, check_interval(tracked.attempts)))
+        else:
+            self._schedule(tracked, now + RECONCILER_FIRST_CHECK)
+
+    def expedite(self, bot_id: int, order_id: str, amount: int):
+        """Check an order right away, e.g. after Pakasir reported it paid."""
+        tracked = self._orders.get(order_id)
+        if tracked is None:
+            self.track(bot_id, order_id, amount)
+            tracked = self._orders[order_id]
+        tracked.attempts = 0
+        tracked.reserved = False
+        self._schedule(tracked, time.monotonic())
+
+    def on_payment_event(self, payload: Optional[str]):
+        """NOTIFY callback for payments recorded by the Pakasir webhook."""
+        if payload is None:
+            # Reconnected; notifications may have been missed
+            self._spawn(self.sync())
+            return
+        try:
+            event = json.loads(payload)
+            bot_id, order_id, amount = int(event['bot_id']), str(event['order_id']), int(event['amount'])
+        except (ValueError, TypeError, KeyError):
+            logger.warning(f"Ignoring malformed payment event: {payload!r}")
+            return
+        # Every worker hears the event; only the owner of the bot acts on it
+        if bot_id in self._store_bots():
+            self._stats["notified"] += 1
+            self.expedite(bot_id, order_id, amount)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def forget(self, order_id: str):
+        """Stop watching an order (stale heap entries are skipped)."""
+        self._orders.pop(order_id, None)
+
+    def _schedule(self, tracked: _TrackedOrder, due: float):
+        tracked.due = min(due, tracked.deadline)
+        heapq.heappush(self._heap, (tracked.due, next(self._seq), tracked.order_id))
+        if self._heap[0][2] == tracked.order_id:
+            self._wake.set()
+
+    def _reschedule(self, tracked: _TrackedOrder, now: float):
+        if now >= tracked.deadline:
+            self.forget(tracked.order_id)
+            self._stats["expired"] += 1
+            return
+        tracked.attempts += 1
+        interval = check_interval(tracked.attempts)
+        self._schedule(tracked, now + interval * random.uniform(0.9, 1.1))
+
+    async def sync(self):
+        """Track pending orders from the database and drop ones no longer pending."""
+        started = time.monotonic()
+        bots = self._store_bots()
+        rows = await self._load_pending(list(bots)) if bots else []
+        self._stats["syncs"] += 1
+
+        pending = set()
+        for row in rows:
+            pending.add(row['order_id'])
+            expires_in = row.get('expires_in')
+            if expires_in is not None and expires_in < -RECONCILER_EXPIRY_GRACE:
+                continue
+            is_new = row['order_id'] not in self._orders
+            self.track(row['bot_id'], row['order_id'], row['amount'], expires_in, row.get('age') or 0.0)
+            if is_new and row.get('notified'):
+                # Paid while no reconciler was listening
+                self.expedite(row['bot_id'], row['order_id'], row['amount'])
+
+        for order_id, tracked in list(self._orders.items()):
+            # Orders tracked after the query started may not be in its result yet
+            if tracked.tracked_at < started and (order_id not in pending or tracked.bot_id not in bots):
+                self.forget(order_id)
+
+    # ---- checking -------------------------------------------------------
+
+    def _dispatch(self) -> float:
+        """Start due checks. Returns the time until there is work again."""
+        now = time.monotonic()
+        if self._breaker is not None and self._breaker.state == "open":
+            return max(0.1, self._breaker.opened_at + self._breaker.reset_after - now)
+
+        while self._heap and self._heap[0][0] <= now:
+            if len(self._inflight) >= RECONCILER_CONCURRENCY:
+                return 1.0
+            due, _, order_id = heapq.heappop(self._heap)
+            tracked = self._orders.get(order_id)
+            if tracked is None or tracked.due != due:
+                continue
+
+            if not tracked.reserved:
+                limiter = self._limiters.get(tracked.bot_id)
+                if limiter is None:
+                    limiter = self._limiters[tracked.bot_id] = _BotLimiter()
+                slot = limiter.reserve(now)
+                if slot > now:
+                    tracked.reserved = True
+                    self._schedule(tracked, slot)
+                    continue
+            tracked.reserved = False
+
+            task = asyncio.create_task(self._check(tracked))
+            self._inflight.add(task)
+            task.add_done_callback(self._check_done)
+
+        return self._heap[0][0] - now if self._heap else RECONCILER_SYNC_INTERVAL
+
+    def _check_done(self, task: asyncio.Task):
+        self._inflight.discard(task)
+        self._wake.set()
+
+    async def _check(self, tracked: _TrackedOrder):
+        instance = self._store_bots().get(tracked.bot_id)
+        if instance is None:
+            self.forget(tracked.order_id)
+            return
+
+        limiter = self._limiters[tracked.bot_id]
+        self._stats["checks"] += 1
+        try:
+            status = await self._check_status(instance, tracked.order_id, tracked.amount)
+        except Exception as e:
+            logger.error(f"Status check for order {tracked.order_id} failed: {e}")
+            status = None
+
+        if self._orders.get(tracked.order_id) is not tracked:
+            return
+        if status is None:
+            self._stats["errors"] += 1
+            limiter.on_error()
+            self._reschedule(tracked, time.monotonic())
+            return
+
+        limiter.on_success()
+        if status.status == "completed":
+            try:
+                result = await self._fulfill(tracked.order_id, datetime.now())
+            except Exception as e:
+                logger.error(f"Fulfilling order {tracked.order_id} failed: {e}")
+                self._schedule(tracked, time.monotonic() + RECONCILER_FIRST_CHECK)
+                return
+            self.forget(tracked.order_id)
+            if result != ALREADY_PAID:
+                payment_status.mark_paid(tracked.order_id)
+            else:
+                # Paid elsewhere, or cancelled/expired here; let the next check read the row
+                payment_status.forget(tracked.order_id)
+            self._stats[result] += 1
+        elif status.status == "pending":
+            self._reschedule(tracked, time.monotonic())
+        else:
+            # Cancelled or expired at Pakasir; nothing will arrive any more
+            self.forget(tracked.order_id)
+            self._stats["closed"] += 1
+
+    # ---- lifecycle ------------------------------------------------------
+
+    async def _run(self):
+        while True:
+            delay = self._dispatch()
+            self._wake.clear()
+            await wait_event(self._wake, delay)
+
+    async def _sync_loop(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Pending order sync failed: {e}")
+            await asyncio.sleep(RECONCILER_SYNC_INTERVAL)
+
+    async def start(self):
+        """Load pending orders and start checking them."""
+        global _active
+        _active = self
+        self._tasks = [
+            asyncio.create_task(self._sync_loop()),
+            asyncio.create_task(self._run()),
+        ]
+
+    async def stop(self):
+        """Stop checking; in-flight checks are cancelled and retried after restart."""
+        global _active
+        if _active is self:
+            _active = None
+        tasks = self._tasks + list(self._inflight) + list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "tracked": len(self._orders),
+            "inflight": len(self._inflight),
+            "throttled_bots": sum(1 for l in self._limiters.values() if l.rate < l.max_rate),
+        }
+
+
+_active: Optional[PaymentReconciler] = None
+
+
+def track_order(bot_id: int, order_id: str, amount: int, expired_at: Optional[datetime] = None):
+    """Hand a new order to the running reconciler, if any."""
+    if _active is None:
+        return
+    expires_in = None
+    if expired_at is not None:
+        expires_in = (expired_at - datetime.now(expired_at.tzinfo)).total_seconds()
+    _active.track(bot_id, order_id, amount, expires_in)
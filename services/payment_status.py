@@ -0,0 +1,155 @@
+"""
+Coalesced payment status checks for the "Cek Status" button.
+
+Impatient buyers press the button again and again, and every press used
+to read the order and ask Pakasir. Now checks of one order share a single
+lookup while it is in flight, a pending result is reused for
+PAYMENT_STATUS_TTL seconds, and presses within PAYMENT_CHECK_COOLDOWN of
+the previous one only get a short notice. Orders known to be paid (this
+process fulfilled them, or the database says so) are answered from
+memory and never looked up again.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from database_async import get_order_by_order_id, reopen_expired_order
+from services.fulfillment import fulfill_order, ALREADY_PAID
+from services.pakasir import PakasirClient
+
+# check() results
+PAID = "paid"              # paid earlier; the product was already sent
+FULFILLED = "fulfilled"    # this check found the payment; the delivery is queued
+PENDING = "pending"        # not paid (or Pakasir could not tell)
+CANCELLED = "cancelled"    # the order was cancelled; a payment for it needs the admin
+NOT_FOUND = "not_found"
+
+PAYMENT_STATUS_TTL = float(os.getenv("PAYMENT_STATUS_TTL", "5"))
+PAYMENT_CHECK_COOLDOWN = float(os.getenv("PAYMENT_CHECK_COOLDOWN", "3"))
+# Orders remembered as paid, and checked orders before stale entries are pruned
+PAYMENT_STATUS_MAX_ORDERS = int(os.getenv("PAYMENT_STATUS_MAX_ORDERS", "10000"))
+
+
+class PaymentStatusCache:
+    """Single-flight, short-TTL payment status checks with a per-order cooldown."""
+
+    def __init__(
+        self,
+        ttl: float = PAYMENT_STATUS_TTL,
+        cooldown: float = PAYMENT_CHECK_COOLDOWN,
+        max_orders: int = PAYMENT_STATUS_MAX_ORDERS
+    ):
+        self.ttl = ttl
+        self.cooldown = cooldown
+        self.max_orders = max_orders
+        self._paid: OrderedDict[str, None] = OrderedDict()
+        # order_id -> (result, checked_at)
+        self._results: dict[str, tuple[str, float]] = {}
+        self._checking: dict[str, asyncio.Future] = {}
+        # order_id -> time of the last press
+        self._pressed: dict[str, float] = {}
+        self._stats = {"checks": 0, "paid_hits": 0, "hits": 0, "coalesced": 0, "lookups": 0, "cooldowns": 0}
+
+    def mark_paid(self, order_id: str):
+        """Remember a paid order; its checks are answered without a lookup from now on."""
+        self._paid[order_id] = None
+        self._paid.move_to_end(order_id)
+        while len(self._paid) > self.max_orders:
+            self._paid.popitem(last=False)
+        self._results.pop(order_id, None)
+
+    def forget(self, order_id: str):
+        """Drop a cached result so the next check reads the order again."""
+        self._results.pop(order_id, None)
+
+    def cooldown_remaining(self, order_id: str) -> float:
+        """Seconds until the order may be checked again; counts the press when it is 0."""
+        now = time.monotonic()
+        last = self._pressed.get(order_id)
+        if last is not None and now - last < self.cooldown:
+            self._stats["cooldowns"] += 1
+            return self.cooldown - (now - last)
+
+        self._pressed[order_id] = now
+        if len(self._pressed) > self.max_orders:
+            self._prune(now)
+        return 0.0
+
+    def _prune(self, now: float):
+        keep = max(self.ttl, self.cooldown)
+        self._pressed = {k: t for k, t in self._pressed.items() if now - t < keep}
+        self._results = {k: r for k, r in self._results.items() if now - r[1] < self.ttl}
+
+    async def _lookup(self, order_id: str, pakasir_slug: str, pakasir_api_key: str) -> str:
+        order = await get_order_by_order_id(order_id)
+        if not order:
+            return NOT_FOUND
+        if order['status'] == "paid":
+            return PAID
+        if order['status'] == "cancelled":
+            # complete_order only takes pending orders; nothing is delivered for it
+            return CANCELLED
+
+        self._stats["lookups"] += 1
+        pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
+        status = await pakasir.get_transaction_status(order_id, order['amount'])
+        if not status or status.status != "completed":
+            return PENDING
+
+        if order['status'] == "expired":
+            # Paid after the expiry sweeper got to it; reopen it like the sweeper does
+            await reopen_expired_order(order_id)
+        # Only the caller that flips the order to paid delivers
+        if await fulfill_order(order_id, datetime.now()) != ALREADY_PAID:
+            return FULFILLED
+        # Someone else completed it, or it is no longer pending; trust only the row
+        order = await get_order_by_order_id(order_id)
+        return PAID if order and order['status'] == "paid" else PENDING
+
+    async def check(self, order_id: str, pakasir_slug: str, pakasir_api_key: str) -> str:
+        """Status of an order as PAID, FULFILLED, PENDING, CANCELLED or NOT_FOUND."""
+        self._stats["checks"] += 1
+        if order_id in self._paid:
+            self._stats["paid_hits"] += 1
+            return PAID
+
+        cached = self._results.get(order_id)
+        if cached and time.monotonic() - cached[1] < self.ttl:
+            self._stats["hits"] += 1
+            return cached[0]
+
+        future = self._checking.get(order_id)
+        if future is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._checking[order_id] = future
+        try:
+            result = await self._lookup(order_id, pakasir_slug, pakasir_api_key)
+            if result in (PAID, FULFILLED):
+                self.mark_paid(order_id)
+            else:
+                self._results[order_id] = (result, time.monotonic())
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so waiter-less failures are not logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._checking[order_id]
+
+    def stats(self) -> dict:
+        return {**self._stats, "paid_orders": len(self._paid), "cached": len(self._results)}
+
+
+# Process-wide cache shared by all bots
+payment_status = PaymentStatusCache()
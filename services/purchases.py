@@ -0,0 +1,270 @@
+"""
+Idempotent purchases for Store Bots.
+
+Tapping "confirm buy" twice, or going back and buying the same product
+again, used to create a new Pakasir transaction, order and QR code every
+time. A purchase is now keyed on (bot_user_id, product_id): while the
+buyer's newest pending order for the product is valid for at least
+PURCHASE_REUSE_MIN_VALIDITY more seconds and still has the current price
+and the chosen quantity, it is shown again, with the caption and the
+Telegram file_id of the QR photo this process sent for it, so nothing is
+rendered or uploaded twice. Concurrent taps share one purchase.
+
+A new order first reserves its stock (database_async.reserve_stock), so
+a buyer is only shown a QR code when there are items to deliver. One
+order and one Pakasir transaction cover any quantity up to
+ORDER_MAX_QUANTITY. The items stay held while the order is pending;
+cancelling or expiring the order releases them.
+
+Single items of products in flash-sale mode come from this worker's pool
+(services.flash_sale) instead, and fall back to the database when the
+pool has nothing to give.
+
+The buyer's other pending orders for the product are cancelled in the
+background, at Pakasir first: an order Pakasir refuses to cancel may
+already be paid and is left to the payment reconciler.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from database_async import (
+    create_order, get_reusable_order, get_superseded_orders, cancel_pending_order,
+    reserve_stock, release_reservations
+)
+from services.catalog_cache import catalog_cache
+from services.flash_sale import flash_sales
+from services.pakasir import PakasirClient
+from services.payment_reconciler import track_order
+
+logger = logging.getLogger(__name__)
+
+# Pending orders closer to expiry than this are replaced, not shown again
+PURCHASE_REUSE_MIN_VALIDITY = float(os.getenv("PURCHASE_REUSE_MIN_VALIDITY", "120"))
+# Captions and photo file_ids remembered for reuse
+PURCHASE_CACHE_SIZE = int(os.getenv("PURCHASE_CACHE_SIZE", "5000"))
+# Seconds a reservation outlives an order that was never created (gateway failure, crash)
+PURCHASE_RESERVATION_HOLD = float(os.getenv("PURCHASE_RESERVATION_HOLD", "300"))
+# Items one order may buy
+ORDER_MAX_QUANTITY = int(os.getenv("ORDER_MAX_QUANTITY", "100"))
+
+
+class OutOfStock(Exception):
+    """No free stock item could be reserved for a new order."""
+
+
+def generate_order_id() -> str:
+    """Generate unique order ID."""
+    timestamp = datetime.now().strftime("%y%m%d")
+    unique = uuid.uuid4().hex[:6].upper()
+    return f"ORD{timestamp}{unique}"
+
+
+@dataclass
+class Purchase:
+    """A pending order to show the buyer."""
+    order: dict
+    reused: bool
+    expired_at: Optional[datetime] = None
+    caption: Optional[str] = None
+    # Telegram file_id of the QR photo sent for this order before
+    photo: Optional[str] = None
+
+
+class PurchaseCoordinator:
+    """Creates or reuses the pending order of a buyer and product."""
+
+    def __init__(self, min_validity: float = PURCHASE_REUSE_MIN_VALIDITY, max_entries: int = PURCHASE_CACHE_SIZE):
+        self.min_validity = min_validity
+        self.max_entries = max_entries
+        self._buying: dict[tuple[int, int], asyncio.Future] = {}
+        # order_id -> (caption, photo file_id)
+        self._shown: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self._background: set[asyncio.Task] = set()
+        self._stats = {
+            "created": 0, "reused": 0, "coalesced": 0, "out_of_stock": 0,
+            "gateway_errors": 0, "superseded": 0, "flash": 0,
+        }
+
+    async def purchase(
+        self,
+        bot_id: int,
+        bot_user_id: int,
+        product: dict,
+        pakasir_slug: str,
+        pakasir_api_key: str,
+        quantity: int = 1
+    ) -> Optional[Purchase]:
+        """
+        The buyer's pending order for `quantity` items of the product, created if needed.
+
+        Returns None if Pakasir failed; raises OutOfStock if not enough items are free.
+        """
+        key = (bot_user_id, product['id'])
+        future = self._buying.get(key)
+        while future is not None:
+            self._stats["coalesced"] += 1
+            purchase = await asyncio.shield(future)
+            if purchase is None or purchase.order['quantity'] == quantity:
+                return purchase
+            # A concurrent tap for another quantity went first; this one supersedes it
+            future = self._buying.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._buying[key] = future
+        try:
+            purchase = await self._purchase(bot_id, bot_user_id, product, pakasir_slug, pakasir_api_key, quantity)
+            future.set_result(purchase)
+            return purchase
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so waiter-less failures are not logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._buying[key]
+
+    async def _purchase(
+        self,
+        bot_id: int,
+        bot_user_id: int,
+        product: dict,
+        pakasir_slug: str,
+        pakasir_api_key: str,
+        quantity: int
+    ) -> Optional[Purchase]:
+        amount = product['price'] * quantity
+        order = await get_reusable_order(bot_user_id, product['id'], self.min_validity)
+        if order and order['quantity'] == quantity and order['amount'] == amount:
+            self._stats["reused"] += 1
+            self._spawn(self._cancel_superseded(
+                bot_user_id, product['id'], order['order_id'], pakasir_slug, pakasir_api_key
+            ))
+            caption, photo = self._shown.get(order['order_id'], (None, None))
+            return Purchase(order, True, order['expired_at'], caption, photo)
+
+        order_id = generate_order_id()
+        if not await self._reserve(bot_id, order_id, product, quantity):
+            self._stats["out_of_stock"] += 1
+            raise OutOfStock(product['id'])
+
+        try:
+            pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
+            payment = await pakasir.create_transaction(order_id=order_id, amount=amount)
+        except BaseException:
+            await asyncio.shield(self._release(order_id))
+            raise
+        if not payment:
+            self._stats["gateway_errors"] += 1
+            await self._release(order_id)
+            return None
+
+        # Parse expired_at
+        try:
+            expired_at = datetime.fromisoformat(payment.expired_at.replace("Z", "+00:00"))
+        except (AttributeError, ValueError):
+            expired_at = None
+
+        order = await create_order(
+            bot_id=bot_id,
+            bot_user_id=bot_user_id,
+            product_id=product['id'],
+            order_id=order_id,
+            amount=amount,
+            fee=payment.fee,
+            total=payment.total_payment,
+            qris_string=payment.payment_number,
+            expired_at=expired_at,
+            quantity=quantity
+        )
+        self._stats["created"] += 1
+
+        # Deliver automatically once the payment shows up at Pakasir
+        track_order(bot_id, order_id, amount, expired_at)
+        self._spawn(self._cancel_superseded(
+            bot_user_id, product['id'], order_id, pakasir_slug, pakasir_api_key
+        ))
+        return Purchase(order, False, expired_at)
+
+    async def _reserve(self, bot_id: int, order_id: str, product: dict, quantity: int) -> bool:
+        """Reserve the items of a new order; single items of flash-sale products come from the pool."""
+        if flash_sales.running:
+            if product.get('flash_sale'):
+                if quantity == 1 and await flash_sales.reserve(product['id'], order_id, PURCHASE_RESERVATION_HOLD):
+                    # The item was already counted as reserved when it entered the pool
+                    self._stats["flash"] += 1
+                    return True
+            elif flash_sales.has_pool(product['id']):
+                # Flash sale ended elsewhere (dashboard, another worker's admin)
+                self._spawn(flash_sales.release(product['id']))
+
+        if not await reserve_stock(order_id, product['id'], quantity, PURCHASE_RESERVATION_HOLD):
+            return False
+        catalog_cache.record_reservation(bot_id, product['id'], quantity)
+        return True
+
+    async def _release(self, order_id: str):
+        """Free the stock reserved for an order that will not be created."""
+        try:
+            await release_reservations(order_id)
+        except Exception as e:
+            # The expiry sweeper releases it once the hold runs out
+            logger.error(f"Releasing reservation of {order_id} failed: {e}")
+
+    def remember(self, order_id: str, caption: str, photo: str):
+        """Keep what was sent for an order so showing it again sends the same photo."""
+        self._shown[order_id] = (caption, photo)
+        self._shown.move_to_end(order_id)
+        while len(self._shown) > self.max_entries:
+            self._shown.popitem(last=False)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _cancel_superseded(
+        self,
+        bot_user_id: int,
+        product_id: int,
+        keep_order_id: str,
+        pakasir_slug: str,
+        pakasir_api_key: str
+    ):
+        try:
+            orders = await get_superseded_orders(bot_user_id, product_id, keep_order_id)
+            if not orders:
+                return
+            pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
+            for order in orders:
+                # Pakasir refuses once the order is paid; the reconciler delivers it then
+                if not await pakasir.cancel_transaction(order['order_id'], order['amount']):
+                    continue
+                if await cancel_pending_order(order['order_id']):
+                    self._stats["superseded"] += 1
+                    self._shown.pop(order['order_id'], None)
+        except Exception as e:
+            logger.error(f"Cancelling superseded orders of buyer {bot_user_id} failed: {e}")
+
+    async def stop(self):
+        """Cancel background work; leftover orders are superseded by the next purchase or expire."""
+        tasks = list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {**self._stats, "remembered": len(self._shown), "background": len(self._background)}
+
+
+# Process-wide coordinator shared by all bots
+purchases = PurchaseCoordinator()
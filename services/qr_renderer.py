@@ -0,0 +1,107 @@
+"""
+QRIS QR code rendering off the event loop.
+
+Building a QR code is pure Python and holds the GIL, so rendering on the
+event loop (or in a thread) stalls every bot in the process. Images are
+rendered in a small spawn-context process pool with
+utils.qr_generator.render_qr_png and kept in an LRU cache keyed by the
+QRIS string, so repeat views and retries of one order are served from
+memory. Concurrent requests for the same string share one render.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from utils.qr_generator import render_qr_png
+
+logger = logging.getLogger(__name__)
+
+# Render processes; 0 renders in the default thread pool instead
+QR_RENDER_WORKERS = int(os.getenv("QR_RENDER_WORKERS", "2"))
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "512"))
+QR_SIZE = int(os.getenv("QR_SIZE", "300"))
+
+
+class QRRenderer:
+    """LRU cache of rendered QR PNGs with single-flight rendering in a process pool."""
+
+    def __init__(self, workers: int = QR_RENDER_WORKERS, max_entries: int = QR_CACHE_SIZE):
+        self.workers = workers
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, int], bytes] = OrderedDict()
+        self._rendering: dict[tuple[str, int], asyncio.Future] = {}
+        self._executor: Optional[Executor] = None
+        self._stats = {"hits": 0, "misses": 0, "renders": 0, "errors": 0}
+
+    def _get_executor(self) -> Optional[Executor]:
+        if self._executor is None and self.workers > 0:
+            # Spawn, not fork: the parent runs an event loop and pool threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def _render(self, qris_string: str, size: int) -> bytes:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), render_qr_png, qris_string, size)
+        except BrokenProcessPool:
+            # A render process died; start a fresh pool next time, render this one in a thread
+            logger.warning("QR render pool broke, restarting it")
+            self.close()
+            return await loop.run_in_executor(None, render_qr_png, qris_string, size)
+
+    async def render(self, qris_string: str, size: int = QR_SIZE) -> bytes:
+        """PNG bytes of the QR code for `qris_string`, rendered at most once."""
+        key = (qris_string, size)
+        png = self._entries.get(key)
+        if png is not None:
+            self._stats["hits"] += 1
+            self._entries.move_to_end(key)
+            return png
+
+        self._stats["misses"] += 1
+        future = self._rendering.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._rendering[key] = future
+        try:
+            png = await self._render(qris_string, size)
+            self._stats["renders"] += 1
+            self._entries[key] = png
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            future.set_result(png)
+            return png
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self._stats["errors"] += 1
+            future.set_exception(e)
+            # Mark retrieved so waiter-less failures are not logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._rendering[key]
+
+    def close(self):
+        """Shut the render processes down (on shutdown)."""
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {**self._stats, "entries": len(self._entries), "workers": self.workers}
+
+
+# Process-wide renderer shared by all bots
+qr_renderer = QRRenderer()
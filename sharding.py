@@ -0,0 +1,273 @@
+"""
+Bot Sharding Module.
+Spreads bots over bot runner worker processes by consistent hashing of
+bot_id, with PostgreSQL advisory locks guaranteeing that a bot token is
+only ever served by one worker at a time.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import time
+from typing import Optional
+
+import asyncpg
+import psutil
+
+from database_async import DATABASE_LISTEN_URL, _asyncpg_dsn
+from utils.events import wait_event
+
+logger = logging.getLogger(__name__)
+
+SHARD_INTERVAL = float(os.getenv("SHARD_INTERVAL", "10"))
+# Workers without a heartbeat for this long are dropped from the ring
+SHARD_WORKER_TTL = float(os.getenv("SHARD_WORKER_TTL", "30"))
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+# Seconds before retrying a bot that failed to start
+SHARD_RETRY_AFTER = float(os.getenv("SHARD_RETRY_AFTER", "300"))
+
+# First key of the two-key advisory lock, so bot IDs do not collide with other locks
+ADVISORY_LOCK_NAMESPACE = 0x626F74  # "bot"
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring with weighted virtual nodes."""
+
+    def __init__(self, vnodes: int = SHARD_VNODES):
+        self.vnodes = vnodes
+        self._keys: list[int] = []
+        self._nodes: list[str] = []
+
+    def set_nodes(self, weights: dict[str, float]):
+        """
+        Rebuild the ring. A node with weight w gets round(vnodes * w) points;
+        points are numbered from 0, so changing a weight only moves the keys
+        of the points added or removed.
+        """
+        points = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node, weight in weights.items()
+            for i in range(max(1, round(self.vnodes * weight)))
+        )
+        self._keys = [key for key, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key) -> Optional[str]:
+        """Node owning `key`, or None if the ring is empty."""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._nodes[index]
+
+    def nodes(self) -> set[str]:
+        return set(self._nodes)
+
+
+def capacity_weight(cpu_percent: float, loop_lag_ms: float) -> float:
+    """Map worker load to a ring weight; coarse steps keep bots from flapping."""
+    if cpu_percent > 85 or loop_lag_ms > 250:
+        return 0.5
+    if cpu_percent > 60 or loop_lag_ms > 100:
+        return 0.75
+    return 1.0
+
+
+class ShardCoordinator:
+    """Keeps a BotManager running exactly the bots this worker owns."""
+
+    def __init__(self, manager, worker_id: str):
+        self.manager = manager
+        self.worker_id = worker_id
+        self.ring = HashRing()
+        self._conn: Optional[asyncpg.Connection] = None
+        self._locked: set[int] = set()
+        self._failed: dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lag_task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._process = psutil.Process()
+        self._cpu = 0.0
+        self._lag_ms = 0.0
+        self._stats = {"rebalances": 0, "acquired": 0, "released": 0, "lock_conflicts": 0, "reconnects": 0}
+
+    # ---------- lifecycle ----------
+
+    async def start(self):
+        """Join the ring and start rebalancing in the background."""
+        self._process.cpu_percent(None)
+        self._lag_task = asyncio.create_task(self._measure_loop_lag())
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop this worker's bots, then release their locks and leave the ring."""
+        for task in (self._task, self._lag_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._lag_task = None
+
+        # Locks go away with the session, so bots must be stopped first
+        await self.manager.stop_all()
+
+        if self._conn is not None and not self._conn.is_closed():
+            try:
+                await self._conn.execute("DELETE FROM bot_workers WHERE worker_id = $1", self.worker_id)
+                await self._conn.close()
+            except Exception:
+                self._conn.terminate()
+        self._conn = None
+        self._locked.clear()
+
+    def owns(self, bot_id: int) -> bool:
+        return self.ring.owner(bot_id) == self.worker_id
+
+    def wake(self):
+        """Rebalance now instead of at the next interval (e.g. a bot was added)."""
+        self._wakeup.set()
+
+    # ---------- main loop ----------
+
+    async def _run(self):
+        settled = False
+        while True:
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    await self._connect()
+                    settled = False
+
+                await self._heartbeat()
+                if settled:
+                    async with self.manager.lifecycle_lock:
+                        await self._rebalance()
+                # Give peers starting at the same time one interval to
+                # register, so the first rebalance does not grab every bot
+                settled = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[{self.worker_id}] Shard coordination failed: {e}")
+                await self._drop_connection()
+
+            await wait_event(self._wakeup, SHARD_INTERVAL)
+            self._wakeup.clear()
+
+    async def _connect(self):
+        # Advisory locks are session-level: use a direct, unpooled connection
+        self._conn = await asyncpg.connect(_asyncpg_dsn(DATABASE_LISTEN_URL), statement_cache_size=0)
+        self._stats["reconnects"] += 1
+
+    async def _drop_connection(self):
+        """Our locks died with the session: stop every bot before anyone else takes them."""
+        if self._locked:
+            logger.warning(f"[{self.worker_id}] Lost lock session, stopping {len(self.manager.bots)} bot(s)")
+        async with self.manager.lifecycle_lock:
+            await self.manager.stop_all()
+        self._locked.clear()
+        if self._conn is not None:
+            self._conn.terminate()
+            self._conn = None
+
+    async def _heartbeat(self):
+        self._cpu = self._process.cpu_percent(None)
+        weight = capacity_weight(self._cpu, self._lag_ms)
+        await self._conn.execute("""
+            INSERT INTO bot_workers (worker_id, hostname, pid, weight, bot_count, cpu_percent, loop_lag_ms, heartbeat_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, NOW())
+            ON CONFLICT (worker_id) DO UPDATE SET
+                hostname = EXCLUDED.hostname,
+                pid = EXCLUDED.pid,
+                weight = EXCLUDED.weight,
+                bot_count = EXCLUDED.bot_count,
+                cpu_percent = EXCLUDED.cpu_percent,
+                loop_lag_ms = EXCLUDED.loop_lag_ms,
+                heartbeat_at = NOW()
+        """, self.worker_id, socket.gethostname(), os.getpid(), weight,
+            len(self.manager.bots), self._cpu, self._lag_ms)
+
+    async def _rebalance(self):
+        workers = await self._conn.fetch("""
+            SELECT worker_id, weight FROM bot_workers
+            WHERE heartbeat_at > NOW() - make_interval(secs => $1)
+        """, SHARD_WORKER_TTL)
+        self.ring.set_nodes({w['worker_id']: w['weight'] for w in workers})
+
+        active = await self._conn.fetch("SELECT id FROM bots WHERE is_active = true")
+        desired = {row['id'] for row in active if self.owns(row['id'])}
+        running = set(self.manager.bots)
+
+        released = running - desired
+        acquired = desired - running
+        if released or acquired:
+            self._stats["rebalances"] += 1
+
+        # Hand bots over first so their new owners can lock them
+        for bot_id in released:
+            await self.manager.stop_bot(bot_id)
+            if bot_id not in self.manager.bots:
+                await self._unlock(bot_id)
+
+        now = time.monotonic()
+        for bot_id in acquired:
+            if now - self._failed.get(bot_id, -SHARD_RETRY_AFTER) < SHARD_RETRY_AFTER:
+                continue
+            if not await self._try_lock(bot_id):
+                # Previous owner has not let go yet; retry next interval
+                self._stats["lock_conflicts"] += 1
+                continue
+            if await self.manager.start_bot(bot_id):
+                self._failed.pop(bot_id, None)
+            else:
+                self._failed[bot_id] = now
+                await self.manager.stop_bot(bot_id)
+                self.manager.bots.pop(bot_id, None)
+                await self._unlock(bot_id)
+
+        # Locks held for bots that are neither running nor wanted
+        for bot_id in self._locked - set(self.manager.bots):
+            await self._unlock(bot_id)
+
+    async def _try_lock(self, bot_id: int) -> bool:
+        if bot_id in self._locked:
+            return True
+        if await self._conn.fetchval(
+            "SELECT pg_try_advisory_lock($1, $2)", ADVISORY_LOCK_NAMESPACE, bot_id
+        ):
+            self._locked.add(bot_id)
+            self._stats["acquired"] += 1
+            return True
+        return False
+
+    async def _unlock(self, bot_id: int):
+        if bot_id in self._locked:
+            await self._conn.fetchval("SELECT pg_advisory_unlock($1, $2)", ADVISORY_LOCK_NAMESPACE, bot_id)
+            self._locked.discard(bot_id)
+            self._stats["released"] += 1
+
+    async def _measure_loop_lag(self):
+        """Exponentially weighted event loop lag, reported as load."""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.5)
+            lag_ms = max(0.0, (time.perf_counter() - started - 0.5) * 1000)
+            self._lag_ms = 0.8 * self._lag_ms + 0.2 * lag_ms
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "worker_id": self.worker_id,
+            "workers": sorted(self.ring.nodes()),
+            "locked": len(self._locked),
+            "cpu_percent": self._cpu,
+            "loop_lag_ms": round(self._lag_ms, 1),
+            "weight": capacity_weight(self._cpu, self._lag_ms),
+        }
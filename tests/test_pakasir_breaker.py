@@ -0,0 +1,69 @@
+"""Circuit breaker of the shared Pakasir transport."""
+
+import asyncio
+import time
+
+import pytest
+
+from services.pakasir import PakasirHTTP, PakasirUnavailable
+
+
+class _HangingResponse:
+    """Request context that never answers, like a stalled upstream."""
+
+    async def __aenter__(self):
+        await asyncio.Event().wait()
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _Session:
+    def __init__(self, error: BaseException = None):
+        self.error = error
+
+    def request(self, *args, **kwargs):
+        if self.error is not None:
+            raise self.error
+        return _HangingResponse()
+
+
+def _half_open_transport(session: _Session) -> PakasirHTTP:
+    http = PakasirHTTP(base_url="http://pakasir.invalid")
+    http._get_session = lambda: session
+    breaker = http.breaker
+    breaker.failures = breaker.threshold
+    breaker.opened_at = time.monotonic() - breaker.reset_after - 1
+    return http
+
+
+def test_cancelled_probe_lets_the_next_probe_through():
+    async def run():
+        http = _half_open_transport(_Session())
+        probe = asyncio.create_task(http.request("transactiondetail", "GET", "transactiondetail"))
+        await asyncio.sleep(0.01)
+        assert http.breaker.probing
+
+        # Other callers fail fast while the probe is out
+        with pytest.raises(PakasirUnavailable):
+            await http.request("transactiondetail", "GET", "transactiondetail")
+
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert not http.breaker.probing
+        assert http.breaker.state == "half_open"
+        assert http.breaker.allow()
+
+    asyncio.run(run())
+
+
+def test_probe_failing_unexpectedly_lets_the_next_probe_through():
+    async def run():
+        http = _half_open_transport(_Session(RuntimeError("boom")))
+        with pytest.raises(RuntimeError):
+            await http.request("transactiondetail", "GET", "transactiondetail")
+        assert not http.breaker.probing
+        assert http.breaker.allow()
+
+    asyncio.run(run())
@@ -0,0 +1,19 @@
+"""asyncio.Event helpers for background loops."""
+
+import asyncio
+
+
+async def wait_event(event: asyncio.Event, timeout: float) -> bool:
+    """
+    Wait until `event` is set or `timeout` seconds pass.
+
+    Returns whether the event was set. Used instead of asyncio.wait_for,
+    which before Python 3.12 can swallow a cancellation that races the
+    event being set, leaving a loop that never stops.
+    """
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        done, _ = await asyncio.wait({waiter}, timeout=max(timeout, 0.0))
+        return bool(done)
+    finally:
+        waiter.cancel()
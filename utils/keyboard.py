@@ -83,14 +83,25 @@ def create_product_detail_keyboard(product_id: int, category_id: int) -> InlineK
     return InlineKeyboardMarkup(keyboard)
 
 
-def create_confirm_purchase_keyboard(product_id: int) -> InlineKeyboardMarkup:
-    """Create keyboard for purchase confirmation."""
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Ya, Bayar", callback_data=f"confirm_buy_{product_id}"),
-            InlineKeyboardButton("❌ Batal", callback_data=f"prod_{product_id}"),
-        ],
-    ]
+def create_confirm_purchase_keyboard(product_id: int, quantity: int = 1, max_quantity: int = 1) -> InlineKeyboardMarkup:
+    """Create keyboard for purchase confirmation with a quantity picker."""
+    keyboard = []
+    
+    # Quantity steps, clamped to 1..max_quantity
+    row = []
+    targets = {quantity}
+    for step, label in ((-10, "➖10"), (-1, "➖"), (1, "➕"), (10, "➕10")):
+        target = max(1, min(max_quantity, quantity + step))
+        if target not in targets:
+            targets.add(target)
+            row.append(InlineKeyboardButton(label, callback_data=f"buy_{product_id}_{target}"))
+    if row:
+        keyboard.append(row)
+    
+    keyboard.append([
+        InlineKeyboardButton("✅ Ya, Bayar", callback_data=f"confirm_buy_{product_id}_{quantity}"),
+        InlineKeyboardButton("❌ Batal", callback_data=f"prod_{product_id}"),
+    ])
     return InlineKeyboardMarkup(keyboard)
 
 
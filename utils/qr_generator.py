@@ -42,6 +42,53 @@ def generate_qr_image(qris_string: str, size: int = 300) -> io.BytesIO:
     return buffer
 
 
+def render_qr_png(qris_string: str, size: int = 300, border: int = 4) -> bytes:
+    """
+    Render a QR code as PNG bytes without resampling.
+    
+    Modules are drawn at the largest whole-pixel scale that fits `size`
+    and the image is padded to exactly `size` with extra quiet zone, so
+    no LANCZOS pass is needed and edges stay sharp. Top-level so it can
+    run in a process pool.
+    
+    Args:
+        qris_string: QRIS payment string from Pakasir
+        size: Size of the QR code in pixels
+        border: Quiet zone in modules
+    
+    Returns:
+        PNG image bytes
+    """
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        border=border,
+    )
+    qr.add_data(qris_string)
+    qr.make(fit=True)
+    
+    # One pixel per module (quiet zone included), scaled up by a whole factor
+    matrix = qr.get_matrix()
+    modules = len(matrix)
+    scale = max(1, size // modules)
+    img = Image.frombytes(
+        "L", (modules, modules),
+        bytes(0 if dark else 255 for row in matrix for dark in row)
+    ).resize((modules * scale, modules * scale), Image.Resampling.NEAREST)
+    
+    # Pad the remainder with white to reach the requested size
+    canvas_size = max(size, modules * scale)
+    if canvas_size != modules * scale:
+        canvas = Image.new("L", (canvas_size, canvas_size), 255)
+        offset = (canvas_size - modules * scale) // 2
+        canvas.paste(img, (offset, offset))
+        img = canvas
+    
+    buffer = io.BytesIO()
+    img.convert("1", dither=Image.Dither.NONE).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
 def generate_qr_with_logo(qris_string: str, logo_path: str = None, size: int = 300) -> io.BytesIO:
     """
     Generate QR code with optional logo in center.
@@ -0,0 +1,221 @@
+"""
+Telegram rate limiter.
+
+One TelegramRateLimiter per bot token, plugged into python-telegram-bot
+through ApplicationBuilder.rate_limiter(), so every call a bot makes goes
+through it. It keeps each bot under Telegram's flood limits:
+
+- a global bucket for all requests of the bot (about 30/s)
+- a bucket per chat for sent messages (1/s in private chats, 20/min in groups)
+
+Requests wait for the global bucket in priority lanes: product deliveries
+go before replies to users, which go before broadcasts, so a broadcast
+never delays a purchase. A RetryAfter from Telegram pauses the whole bot
+for the time asked and the request is retried.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Any, Callable, Coroutine, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from utils.telegram_errors import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_GLOBAL_BURST = float(os.getenv("TG_GLOBAL_BURST", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+TG_GROUP_PER_MINUTE = float(os.getenv("TG_GROUP_PER_MINUTE", "20"))
+TG_GROUP_BURST = float(os.getenv("TG_GROUP_BURST", "3"))
+# RetryAfter is retried this many times, if Telegram asks for at most
+# TG_MAX_RETRY_WAIT seconds; otherwise it reaches the caller
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "2"))
+TG_MAX_RETRY_WAIT = float(os.getenv("TG_MAX_RETRY_WAIT", "30"))
+
+# Priority lanes, passed as rate_limit_args; lower goes first
+PRIORITY_DELIVERY = 0
+PRIORITY_REPLY = 1
+PRIORITY_BROADCAST = 2
+_LANES = {PRIORITY_DELIVERY: "delivery", PRIORITY_REPLY: "reply", PRIORITY_BROADCAST: "broadcast"}
+
+# Per-chat buckets idle this long are dropped
+_CHAT_IDLE = 300
+_CHAT_PRUNE_SIZE = 10_000
+
+
+class _Bucket:
+    """Token bucket that hands out send times instead of blocking."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available_in(self) -> float:
+        """Seconds until a token is available, without taking it."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self) -> float:
+        """Take one token; returns seconds until it may be used."""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+def _chat_limited(endpoint: str, data: dict) -> bool:
+    """Whether the request sends a message into data['chat_id']."""
+    return "chat_id" in data and endpoint.startswith(("send", "forward", "copy"))
+
+
+class TelegramRateLimiter(BaseRateLimiter[int]):
+    """Global and per-chat throttling with priority lanes for one bot."""
+
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, global_burst: float = TG_GLOBAL_BURST):
+        self._global = _Bucket(global_rate, global_burst)
+        self._chats: dict[Any, _Bucket] = {}
+        # (priority, seq, future) waiting for a global token
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wake: Optional[asyncio.Event] = None
+        self._paused_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "requests": 0, "throttled": 0, "retry_after": 0, "retried": 0,
+            "wait_seconds": 0.0, "max_queue": 0,
+        }
+
+    async def initialize(self) -> None:
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+    def _chat_bucket(self, chat_id) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _CHAT_PRUNE_SIZE:
+                cutoff = time.monotonic() - _CHAT_IDLE
+                self._chats = {k: b for k, b in self._chats.items() if b.updated > cutoff}
+            try:
+                is_group = int(chat_id) < 0
+            except (TypeError, ValueError):
+                is_group = True  # @channel usernames
+            if is_group:
+                bucket = _Bucket(TG_GROUP_PER_MINUTE / 60, TG_GROUP_BURST)
+            else:
+                bucket = _Bucket(TG_CHAT_RATE, TG_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _dispatch(self):
+        """Hand out global tokens to waiters, best lane first."""
+        while True:
+            if not self._waiters:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            # Pick the waiter only once a token is free, so a request that
+            # arrives meanwhile in a better lane still goes first
+            delay = self._global.available_in()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._global.reserve()
+                future.set_result(None)
+
+    async def _acquire(self, priority: int):
+        if self._task is None:
+            await self.initialize()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._stats["max_queue"] = max(self._stats["max_queue"], len(self._waiters))
+        self._wake.set()
+        await future
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: Optional[int],
+    ):
+        priority = PRIORITY_REPLY if rate_limit_args is None else rate_limit_args
+        self._stats["requests"] += 1
+        started = time.monotonic()
+
+        for attempt in range(TG_MAX_RETRIES + 1):
+            if _chat_limited(endpoint, data):
+                delay = self._chat_bucket(data["chat_id"]).reserve()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self._acquire(priority)
+
+            waited = time.monotonic() - started
+            if attempt == 0 and waited > 0.001:
+                self._stats["throttled"] += 1
+            self._stats["wait_seconds"] += waited
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = retry_after_seconds(e)
+                self._stats["retry_after"] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning(f"⏳ Telegram flood limit on {endpoint}, pausing bot for {retry_after:.0f}s")
+                if attempt >= TG_MAX_RETRIES or retry_after > TG_MAX_RETRY_WAIT:
+                    raise
+                self._stats["retried"] += 1
+                started = time.monotonic()
+
+    def stats(self) -> dict:
+        lanes = {name: 0 for name in _LANES.values()}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                lanes[_LANES.get(priority, "reply")] += 1
+        paused = self._paused_until - time.monotonic()
+        return {
+            **self._stats,
+            "wait_seconds": round(self._stats["wait_seconds"], 1),
+            "queued": lanes,
+            "chats": len(self._chats),
+            "paused_for": round(paused, 1) if paused > 0 else 0,
+        }
@@ -0,0 +1,35 @@
+"""
+Classification of Telegram send errors.
+
+Shared by everything that sends on behalf of a bot (deliveries,
+broadcasts) so they agree on what can be retried and which users can no
+longer be reached.
+"""
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+# classify_send_error() results
+BLOCKED = "blocked"            # 403: user blocked the bot, deleted the account, never started it
+RATE_LIMITED = "rate_limited"  # 429: wait retry_after_seconds() and resend
+TRANSIENT = "transient"        # timeouts and connection errors: resend with backoff
+FAILED = "failed"              # anything else; resending the same request cannot help
+
+
+def classify_send_error(error: Exception) -> str:
+    """Map an exception from a send call to BLOCKED, RATE_LIMITED, TRANSIENT or FAILED."""
+    if isinstance(error, Forbidden):
+        return BLOCKED
+    if isinstance(error, RetryAfter):
+        return RATE_LIMITED
+    if isinstance(error, BadRequest):
+        # BadRequest subclasses NetworkError but is never transient
+        return FAILED
+    if isinstance(error, NetworkError):
+        return TRANSIENT
+    return FAILED
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """RetryAfter.retry_after as seconds; it is a timedelta in newer releases."""
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
@@ -10,6 +10,7 @@ interface Bot {
   is_active: boolean;
   products_count: number;
   users_count: number;
+  reachable_users_count: number;
   transactions_count: number;
 }
 
@@ -145,8 +146,10 @@ export default function BotsPage() {
                 <p className="text-xs text-[var(--text-muted)]">Produk</p>
               </div>
               <div className="p-3 rounded-lg bg-[var(--bg-dark)]">
-                <p className="text-lg font-bold">{bot.users_count || 0}</p>
-                <p className="text-xs text-[var(--text-muted)]">Users</p>
+                <p className="text-lg font-bold">
+                  {bot.reachable_users_count || 0}/{bot.users_count || 0}
+                </p>
+                <p className="text-xs text-[var(--text-muted)]">Users aktif</p>
               </div>
               <div className="p-3 rounded-lg bg-[var(--bg-dark)]">
                 <p className="text-lg font-bold">
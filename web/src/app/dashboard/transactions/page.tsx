@@ -13,6 +13,7 @@ interface Transaction {
   id: number;
   order_id: string;
   product_name: string;
+  quantity: number;
   buyer_username: string;
   amount: number;
   status: string;
@@ -282,7 +283,10 @@ export default function TransactionsPage() {
                     <td className="px-6 py-4">
                       <span className="font-mono text-sm">{tx.order_id}</span>
                     </td>
-                    <td className="px-6 py-4">{tx.product_name || "-"}</td>
+                    <td className="px-6 py-4">
+                      {tx.product_name || "-"}
+                      {tx.quantity > 1 && <span className="text-[var(--text-muted)]"> x{tx.quantity}</span>}
+                    </td>
                     <td className="px-6 py-4">
                       @{tx.buyer_username || "unknown"}
                     </td>
@@ -155,6 +155,51 @@ class ApiClient {
     });
   }
 
+  async importProductStock(productId: number, file: File, onProgress?: (lines: number) => void) {
+    const body = new FormData();
+    body.append('file', file);
+
+    try {
+      const response = await fetch(`${API_BASE_URL}/products/${productId}/stock/import`, {
+        method: 'POST',
+        headers: this.token ? { Authorization: `Bearer ${this.token}` } : {},
+        body,
+      });
+
+      if (!response.ok || !response.body) {
+        const data = await response.json().catch(() => ({}));
+        return { error: data.error || 'Terjadi kesalahan' };
+      }
+
+      // NDJSON: progress lines, then the result
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { done, value } = await reader.read();
+        buffer += decoder.decode(value, { stream: !done });
+        const lines = buffer.split('\n');
+        buffer = lines.pop() || '';
+        for (const line of done ? [...lines, buffer] : lines) {
+          if (!line.trim()) continue;
+          const event = JSON.parse(line);
+          if (event.progress !== undefined) {
+            onProgress?.(event.progress);
+          } else if (event.error) {
+            return { error: event.error as string };
+          } else {
+            return { data: event as { received: number; added: number; duplicates: number } };
+          }
+        }
+        if (done) break;
+      }
+      return { error: 'Import terputus' };
+    } catch (error) {
+      console.error('API Error:', error);
+      return { error: 'Tidak dapat terhubung ke server' };
+    }
+  }
+
   // ==================== TRANSACTIONS ====================
 
   async getTransactions(botId: number) {
@@ -167,6 +212,10 @@ class ApiClient {
     return this.request<{ broadcasts: any[] }>(`/bots/${botId}/broadcast`);
   }
 
+  async getBroadcast(botId: number, broadcastId: number) {
+    return this.request<{ broadcast: any }>(`/bots/${botId}/broadcast/${broadcastId}`);
+  }
+
   async sendBroadcast(botId: number, message: string) {
     return this.request<{ broadcast: any; message?: string }>(`/bots/${botId}/broadcast`, {
       method: 'POST',
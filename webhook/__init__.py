@@ -1,4 +1,5 @@
 """Webhook package."""
-from webhook.server import app, run_webhook_server, set_bot_reference
+from webhook.telegram import TelegramWebhookServer, webhook_secret
+from webhook.pakasir import PakasirWebhook
 
-__all__ = ["app", "run_webhook_server", "set_bot_reference"]
+__all__ = ["TelegramWebhookServer", "webhook_secret", "PakasirWebhook"]
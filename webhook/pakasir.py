@@ -0,0 +1,79 @@
+"""
+Pakasir payment webhook for all bots.
+
+Pakasir POSTs a notification to /webhook/pakasir when a QRIS payment
+completes. The receiver only validates the notification against its order,
+records it once in webhook_events and answers; the order's worker is told
+through PostgreSQL NOTIFY and its payment reconciler confirms the payment
+with Pakasir and delivers. Retries and duplicates are answered from the
+unique idempotency key, so the response never waits on Pakasir or Telegram.
+
+Opt-in with PAKASIR_WEBHOOK_ENABLED=true, which opens the shared listener on
+WEBHOOK_PORT (+ worker index); without it payments are found by polling.
+"""
+
+import json
+import logging
+import os
+
+from aiohttp import web
+
+from database_async import record_payment_webhook
+
+logger = logging.getLogger(__name__)
+
+PAKASIR_WEBHOOK_ENABLED = os.getenv("PAKASIR_WEBHOOK_ENABLED", "false").lower() == "true"
+PAKASIR_WEBHOOK_PATH = "/webhook/pakasir"
+
+# HTTP status per record_payment_webhook() outcome; 404 makes Pakasir retry
+# a notification that raced the order insert
+_RESPONSE_STATUS = {
+    "recorded": 200,
+    "duplicate": 200,
+    "not_pending": 200,
+    "unknown_order": 404,
+    "project_mismatch": 400,
+    "amount_mismatch": 400,
+}
+
+
+class PakasirWebhook:
+    """Receives Pakasir payment notifications on a shared aiohttp app."""
+
+    def __init__(self, record=record_payment_webhook):
+        self._record = record
+        self._stats = {outcome: 0 for outcome in _RESPONSE_STATUS}
+        self._stats.update({"invalid": 0, "errors": 0})
+
+    def attach(self, web_app: web.Application):
+        """Add the route; must be called before the app starts."""
+        web_app.router.add_post(PAKASIR_WEBHOOK_PATH, self._handle)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        try:
+            data = json.loads(await request.read())
+            project = str(data["project"])
+            order_id = str(data["order_id"])
+            amount = int(data["amount"])
+            status = str(data.get("status", ""))
+        except (ValueError, TypeError, KeyError):
+            self._stats["invalid"] += 1
+            return web.json_response({"error": "invalid payload"}, status=400)
+
+        try:
+            outcome = await self._record(project, order_id, amount, status, json.dumps(data))
+        except Exception as e:
+            # 5xx so Pakasir retries once the database is back
+            self._stats["errors"] += 1
+            logger.error(f"Failed to record Pakasir webhook for {order_id}: {e}")
+            return web.json_response({"error": "temporarily unavailable"}, status=503)
+
+        self._stats[outcome] += 1
+        if outcome in ("project_mismatch", "amount_mismatch"):
+            logger.warning(f"Rejected Pakasir webhook for {order_id}: {outcome}")
+        elif outcome == "not_pending" and status == "completed":
+            logger.warning(f"Pakasir reports payment for order {order_id}, which is no longer pending")
+        return web.json_response({"status": outcome}, status=_RESPONSE_STATUS[outcome])
+
+    def stats(self) -> dict:
+        return dict(self._stats)
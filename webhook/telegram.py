@@ -0,0 +1,136 @@
+"""
+Telegram webhook ingress for all bots.
+
+One aiohttp listener receives updates for every bot on
+/tg/<bot_id>/<secret> and puts them on that bot's Application.update_queue,
+instead of running one getUpdates long-poll loop per bot.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "5000"))
+# Concurrent webhook connections Telegram may open per bot (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_secret(bot_id: int, telegram_token: str) -> str:
+    """Per-bot secret used both in the URL path and as Telegram's secret_token."""
+    return hmac.new(
+        telegram_token.encode(), f"tg-webhook:{bot_id}".encode(), hashlib.sha256
+    ).hexdigest()
+
+
+class TelegramWebhookServer:
+    """Shared HTTP listener that routes Telegram updates to bot applications."""
+
+    def __init__(self, base_url: str = WEBHOOK_BASE_URL, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT):
+        self.base_url = base_url.rstrip("/")
+        self.host = host
+        self.port = port
+        self._bots: dict[int, tuple[Application, str]] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._stats = {"received": 0, "rejected": 0, "unknown_bot": 0, "invalid": 0}
+
+        self.web_app = web.Application()
+        self.web_app.router.add_post("/tg/{bot_id}/{secret}", self._handle_update)
+        self.web_app.router.add_get("/health", self._handle_health)
+
+    def url_for(self, bot_id: int, secret: str) -> str:
+        return f"{self.base_url}/tg/{bot_id}/{secret}"
+
+    async def start(self):
+        """Start listening."""
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Telegram webhook listener on {self.host}:{self.port}")
+
+    async def stop(self):
+        """Stop listening."""
+        if self._runner is not None:
+            runner, self._runner = self._runner, None
+            await runner.cleanup()
+
+    async def register(self, bot_id: int, application: Application, secret: str, drop_pending_updates: bool = True):
+        """Route updates for `bot_id` to `application` and point Telegram at us."""
+        self._bots[bot_id] = (application, secret)
+        try:
+            await application.bot.set_webhook(
+                url=self.url_for(bot_id, secret),
+                secret_token=secret,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=drop_pending_updates
+            )
+        except Exception:
+            self._bots.pop(bot_id, None)
+            raise
+
+    async def unregister(self, bot_id: int, delete_webhook: bool = True):
+        """Stop routing updates for `bot_id`."""
+        entry = self._bots.pop(bot_id, None)
+        if entry and delete_webhook:
+            try:
+                await entry[0].bot.delete_webhook()
+            except Exception as e:
+                logger.warning(f"Failed to delete webhook for bot {bot_id}: {e}")
+
+    def is_registered(self, bot_id: int) -> bool:
+        return bot_id in self._bots
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        try:
+            bot_id = int(request.match_info["bot_id"])
+        except ValueError:
+            self._stats["unknown_bot"] += 1
+            return web.Response(status=404)
+
+        entry = self._bots.get(bot_id)
+        if entry is None:
+            self._stats["unknown_bot"] += 1
+            return web.Response(status=404)
+
+        application, secret = entry
+        if not (
+            hmac.compare_digest(request.match_info["secret"], secret)
+            and hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret)
+        ):
+            self._stats["rejected"] += 1
+            return web.Response(status=403)
+
+        try:
+            update = Update.de_json(json.loads(await request.read()), application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            # A 2xx stops Telegram from redelivering an update we can never parse
+            self._stats["invalid"] += 1
+            logger.warning(f"Dropping malformed update for bot {bot_id}: {e}")
+            return web.Response()
+
+        await application.update_queue.put(update)
+        self._stats["received"] += 1
+        return web.Response()
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "bots": len(self._bots)})
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "bots": len(self._bots),
+            "queued": sum(app.update_queue.qsize() for app, _ in self._bots.values()),
+        }